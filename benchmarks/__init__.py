@@ -0,0 +1,5 @@
+"""Benchmarks of the packaging hot paths on synthetic xcframeworks and site-packages.
+
+Run with `python -m benchmarks` from the repository root (psbuilder installed),
+see `python -m benchmarks --help`.
+"""
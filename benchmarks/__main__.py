@@ -0,0 +1,68 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+import argparse
+import sys
+import tempfile
+
+from .cases import create_benchmarks
+from .runner import DEFAULT_THRESHOLD, compare, default_baseline, load_baseline, report, save_baseline
+from .synthetic import PROFILES
+
+
+def parse_threshold(value: str) -> tuple[str, float]:
+    name, _, threshold = value.rpartition("=")
+    return name, float(threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the packaging hot paths")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small",
+                        help="size of the synthetic inputs")
+    parser.add_argument("--workdir", default=join(tempfile.gettempdir(), "psbuilder-benchmarks"),
+                        help="where inputs are generated (kept between runs) and outputs written")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per benchmark, the median is reported")
+    parser.add_argument("--only", action="append", default=[],
+                        help="run only benchmarks whose name contains this (multiple allowed)")
+    parser.add_argument("--baseline", default=default_baseline(),
+                        help="baseline JSON to compare with")
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=parse_threshold, action="append", default=[],
+                        metavar="[NAME=]FRACTION",
+                        help="allowed slowdown, e.g. 0.25 or zip_xcframework=0.1 (default {})".format(DEFAULT_THRESHOLD))
+    args = parser.parse_args()
+
+    threshold = DEFAULT_THRESHOLD
+    overrides = {}
+    for name, value in args.threshold:
+        if name:
+            overrides[name] = value
+        else:
+            threshold = value
+
+    benchmarks = create_benchmarks(join(args.workdir, args.profile), PROFILES[args.profile])
+    results = {}
+    for benchmark in benchmarks:
+        if args.only and not any(part in benchmark.name for part in args.only):
+            continue
+        results[benchmark.name] = benchmark.measure(args.repeat)
+        print("{:<36} {:.4f}s".format(benchmark.name, results[benchmark.name]["seconds"]), file=sys.stderr)
+
+    baseline = load_baseline(args.baseline)
+    if baseline and baseline.get("profile") != args.profile:
+        print("Baseline {} is for the {} profile, not comparing".format(args.baseline, baseline.get("profile")))
+        baseline = None
+    print(report(results, baseline))
+    if args.save:
+        save_baseline(args.baseline, args.profile, results)
+        print("Saved baseline to {}".format(args.baseline))
+        return
+    if baseline:
+        regressions = compare(results, baseline, threshold, overrides)
+        if regressions:
+            print("Slower than the baseline: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
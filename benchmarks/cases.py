@@ -0,0 +1,129 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs
+import json
+import shutil
+
+# standalone modules only, the ones needing the toolchain (kivy_ios, sh) are in toolchain_cases
+from psbuilder.archive import ZipWriter, zip_tree
+from psbuilder.checksums import ChecksumIndex, sha256_file
+from psbuilder.staging import stage_file
+from psbuilder.sync import sync_tree, tree_files
+
+from .runner import Benchmark
+from .synthetic import make_xcframework, make_libraries, make_site_packages
+
+
+def remove(path: str):
+    if isdir(path):
+        shutil.rmtree(path)
+    elif exists(path):
+        unlink(path)
+
+
+def create_benchmarks(workdir: str, profile: dict) -> list[Benchmark]:
+    """Generate the synthetic inputs below workdir and return the benchmarks using them."""
+    inputs = join(workdir, "inputs")
+    outputs = join(workdir, "outputs")
+    remove(outputs)
+    makedirs(outputs)
+    marker = join(inputs, "profile.json")
+    if load_json(marker) != profile:
+        remove(inputs)
+        for i in range(2):
+            make_xcframework(join(inputs, "xcframeworks"), f"Synthetic{i}", profile, i)
+        make_libraries(join(inputs, "lib"), profile)
+        make_site_packages(join(inputs, "site-packages"), profile)
+        with open(marker, "w") as fp:
+            json.dump(profile, fp)
+    xcframeworks = sorted(join(inputs, "xcframeworks", fn) for fn in listdir(join(inputs, "xcframeworks")))
+    libraries = sorted(
+        join(inputs, "lib", sdk, fn) for sdk in listdir(join(inputs, "lib")) for fn in listdir(join(inputs, "lib", sdk))
+    )
+    site_packages = join(inputs, "site-packages")
+    xc = xcframeworks[0]
+    xc_size = tree_size(xc)
+    site_size = tree_size(site_packages)
+    xc_zip = join(outputs, "xc.zip")
+    zips = [join(outputs, "{}.zip".format(splitext(basename(path))[0])) for path in xcframeworks]
+    zips_size = 0
+
+    def zip_xcframework(workers: int | None = None):
+        zip_tree(xc, xc_zip, workers=workers)
+        return xc_size
+
+    def zip_all_xcframeworks():
+        nonlocal zips_size
+        for path, zip_path in zip(xcframeworks, zips):
+            zip_tree(path, zip_path)
+        zips_size = sum(tree_size(path) for path in zips)
+
+    zip_all_xcframeworks()
+
+    def checksum_cold():
+        for path in zips:
+            sha256_file(path)
+        return zips_size
+
+    index = ChecksumIndex(join(outputs, "checksums.json"))
+    for path in zips:
+        index.record(path, sha256_file(path))
+
+    def checksum_index():
+        for path in zips:
+            index.checksum(path)
+        return zips_size
+
+    site_copy = join(outputs, "site-packages")
+
+    def sync_site_packages():
+        for name in listdir(site_packages):
+            sync_tree(join(site_packages, name), join(site_copy, name))
+        return site_size
+
+    def stream_site_packages():
+        with ZipWriter(join(outputs, "site-packages.zip")) as writer:
+            writer.add_dir("site-packages", site_packages)
+            writer.add_tree(site_packages, site_packages, "site-packages")
+        return writer.bytes_in
+
+    staged = join(outputs, "dist_files")
+
+    def stage_libraries():
+        size = 0
+        for lib in libraries:
+            stage_file(lib, join(staged, basename(dirname(lib)), basename(lib)))
+            size += tree_size(lib)
+        return size
+
+    return [
+        Benchmark("zip_xcframework", zip_xcframework),
+        Benchmark("zip_xcframework_one_worker", lambda: zip_xcframework(1)),
+        Benchmark("checksum_sha256", checksum_cold),
+        Benchmark("checksum_index_warm", checksum_index),
+        Benchmark("sync_site_packages_cold", sync_site_packages, lambda: remove(site_copy)),
+        Benchmark("sync_site_packages_warm", sync_site_packages),
+        Benchmark("stream_site_packages", stream_site_packages),
+        Benchmark("stage_libraries", stage_libraries, lambda: remove(staged)),
+        *toolchain_benchmarks(outputs, index, xcframeworks),
+    ]
+
+
+def toolchain_benchmarks(outputs: str, index: ChecksumIndex, xcframeworks: list[str]) -> list[Benchmark]:
+    """Benchmarks of package.py and the state stores, none when the toolchain is not installed."""
+    try:
+        from .toolchain_cases import create_benchmarks
+    except ImportError as err:
+        print("Skipping the package and state benchmarks: {}".format(err))
+        return []
+    return create_benchmarks(outputs, index, xcframeworks)
+
+
+def tree_size(path: str) -> int:
+    return sum(file_stat.st_size for file_stat in tree_files(path).values())
+
+
+def load_json(filename: str):
+    if not exists(filename):
+        return None
+    with open(filename) as fp:
+        return json.load(fp)
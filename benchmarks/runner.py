@@ -0,0 +1,105 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs
+from typing import Callable
+import json
+import platform
+import statistics
+import sys
+import time
+
+DEFAULT_THRESHOLD = 0.25
+
+
+class Benchmark:
+    """A timed operation; setup runs before every repeat and is not timed.
+
+    run returns the number of bytes it processed (or None).
+    """
+
+    name: str
+    run: Callable[[], int | None]
+    setup: Callable[[], None] | None
+
+    def __init__(self, name: str, run: Callable[[], int | None], setup: Callable[[], None] | None = None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    def measure(self, repeat: int) -> dict:
+        timings = []
+        processed = None
+        for _ in range(repeat):
+            if self.setup:
+                self.setup()
+            start = time.perf_counter()
+            processed = self.run()
+            timings.append(time.perf_counter() - start)
+        seconds = statistics.median(timings)
+        result = {"seconds": seconds, "min": min(timings), "repeat": repeat}
+        if processed:
+            result["bytes"] = processed
+            result["mb_per_second"] = processed / seconds / (1 << 20) if seconds else 0
+        return result
+
+
+def machine() -> dict:
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "processor": platform.processor(),
+    }
+
+
+def default_baseline() -> str:
+    return join(dirname(realpath(__file__)), "baselines", "{}-{}.json".format(sys.platform, platform.machine()))
+
+
+def load_baseline(filename: str) -> dict | None:
+    if not exists(filename):
+        return None
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def save_baseline(filename: str, profile: str, results: dict[str, dict], thresholds: dict[str, float] | None = None):
+    previous = load_baseline(filename) or {}
+    makedirs(dirname(filename), exist_ok=True)
+    with open(filename, "w") as fp:
+        json.dump({
+            "machine": machine(),
+            "profile": profile,
+            # kept from the previous baseline, edited by hand
+            "thresholds": thresholds or previous.get("thresholds", {}),
+            "results": results,
+        }, fp, indent=2, sort_keys=True)
+
+
+def compare(results: dict[str, dict], baseline: dict, threshold: float, overrides: dict[str, float]) -> list[str]:
+    """Names of the benchmarks more than their threshold slower than the baseline."""
+    thresholds = dict(baseline.get("thresholds", {}))
+    thresholds.update(overrides)
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        allowed = thresholds.get(name, threshold)
+        if result["seconds"] > base["seconds"] * (1 + allowed):
+            regressions.append(name)
+    return regressions
+
+
+def report(results: dict[str, dict], baseline: dict | None) -> str:
+    lines = ["{:<36} {:>10} {:>10} {:>10} {:>8}".format("benchmark", "seconds", "baseline", "MB/s", "change")]
+    for name, result in results.items():
+        base = (baseline or {}).get("results", {}).get(name)
+        change = ""
+        base_seconds = ""
+        if base:
+            base_seconds = "{:.4f}".format(base["seconds"])
+            change = "{:+.1f}%".format(100 * (result["seconds"] / base["seconds"] - 1)) if base["seconds"] else ""
+        throughput = "{:.1f}".format(result["mb_per_second"]) if "mb_per_second" in result else ""
+        lines.append("{:<36} {:>10.4f} {:>10} {:>10} {:>8}".format(
+            name, result["seconds"], base_seconds, throughput, change))
+    return "\n".join(lines)
@@ -0,0 +1,84 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs
+import plistlib
+import random
+
+# sizes of the generated trees, "large" is roughly what PythonCore/KivyCore produce
+PROFILES = {
+    "small": {
+        "headers": 400, "header_size": 2048, "libraries": 2, "library_size": 4 << 20,
+        "packages": 20, "modules": 20, "module_size": 4096,
+    },
+    "large": {
+        "headers": 3000, "header_size": 4096, "libraries": 3, "library_size": 96 << 20,
+        "packages": 120, "modules": 40, "module_size": 8192,
+    },
+}
+
+XC_PLATFORMS = ["ios-arm64", "ios-arm64_x86_64-simulator"]
+
+
+def write_random(path: str, size: int, rng: random.Random, compressible: bool = False):
+    """Write size bytes, text-like when compressible (headers, sources) else object-code like."""
+    makedirs(dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        if compressible:
+            line = b"".join(rng.choice([b"int ", b"void ", b"static ", b"#define ", b"PyObject *", b"return ", b";\n"]) for _ in range(64))
+            fp.write((line * (size // len(line) + 1))[:size])
+            return
+        block = rng.randbytes(1 << 16)
+        written = 0
+        while written < size:
+            chunk = block[:size - written]
+            # mostly random with runs of zeros, like static libraries
+            fp.write(chunk[:len(chunk) // 2] + bytes(len(chunk) - len(chunk) // 2))
+            written += len(chunk)
+
+
+def make_xcframework(root: str, name: str, profile: dict, seed: int = 0) -> str:
+    """An xcframework with a static library and a headers folder per platform."""
+    rng = random.Random(seed)
+    xc = join(root, f"{name}.xcframework")
+    libraries = []
+    for plat in XC_PLATFORMS:
+        lib = f"lib{name}.a"
+        write_random(join(xc, plat, lib), profile["library_size"], rng)
+        for index in range(profile["headers"]):
+            folder = "Headers/cpython" if index % 3 else "Headers"
+            write_random(join(xc, plat, folder, f"header_{index}.h"), profile["header_size"], rng, True)
+        libraries.append({
+            "LibraryIdentifier": plat,
+            "LibraryPath": lib,
+            "HeadersPath": "Headers",
+            "SupportedPlatform": "ios",
+        })
+    with open(join(xc, "Info.plist"), "wb") as fp:
+        fp.write(plistlib.dumps({"AvailableLibraries": libraries, "XCFrameworkFormatVersion": "1.0"}))
+    return xc
+
+
+def make_libraries(root: str, profile: dict, seed: int = 0) -> list[str]:
+    """Static libraries like the ones of dist/lib/<sdk>."""
+    rng = random.Random(seed)
+    libraries = []
+    for index in range(profile["libraries"]):
+        for sdk in ("iphoneos", "iphonesimulator"):
+            path = join(root, sdk, f"libsynthetic{index}.a")
+            write_random(path, profile["library_size"], rng)
+            libraries.append(path)
+    return libraries
+
+
+def make_site_packages(root: str, profile: dict, seed: int = 0) -> list[str]:
+    """A site-packages folder of nested pure python packages, returns the package names."""
+    rng = random.Random(seed)
+    names = []
+    for index in range(profile["packages"]):
+        name = f"package_{index}"
+        names.append(name)
+        for module in range(profile["modules"]):
+            sub = "" if module % 4 else "sub"
+            write_random(join(root, name, sub, f"module_{module}.py"), profile["module_size"], rng, True)
+        write_random(join(root, name, "__init__.py"), 64, rng, True)
+        write_random(join(root, f"{name}-1.0.dist-info", "RECORD"), 2048, rng, True)
+    return names
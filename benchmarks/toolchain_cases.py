@@ -0,0 +1,85 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs
+import json
+
+from psbuilder.checksums import ChecksumIndex
+from psbuilder.package import SwiftPackage
+from psbuilder.targets import SwiftTarget
+from psbuilder.utils import JsonStore, SqliteStore
+
+from .runner import Benchmark
+
+STATE_KEYS = 2000
+
+
+class SyntheticContext:
+    checksums: ChecksumIndex
+
+    def __init__(self, checksums: ChecksumIndex):
+        self.checksums = checksums
+
+
+class SyntheticTarget(SwiftTarget):
+    name = "Synthetic"
+
+    def __init__(self, xcframeworks: list[str]):
+        self._xcframeworks = xcframeworks
+
+    @property
+    def xcframeworks(self) -> list[str]:
+        return self._xcframeworks
+
+
+class SyntheticPackage(SwiftPackage):
+    """A package whose binary targets are the zips of the synthetic xcframeworks."""
+
+    def __init__(self, ctx: SyntheticContext, xcframeworks: list[str], zip_root: str):
+        self.ctx = ctx
+        self.targets = [SyntheticTarget(xcframeworks)]
+        self.zip_root = zip_root
+
+    @property
+    def swift_package_dir(self) -> str:
+        return self.zip_root
+
+    @property
+    def swift_package_xcframeworks(self) -> str:
+        return self.zip_root
+
+
+def create_benchmarks(outputs: str, index: ChecksumIndex, xcframeworks: list[str]) -> list[Benchmark]:
+    """Benchmarks of the modules importing kivy_ios and sh, written to outputs."""
+
+    def dump_package_json():
+        package = SyntheticPackage(SyntheticContext(index), xcframeworks, outputs)
+        with open(join(outputs, "package.json"), "w") as fp:
+            json.dump(package.dump, fp)
+
+    def state_writes(store_type: type, batched: bool):
+        filename = join(outputs, "state.{}".format(store_type.__name__))
+
+        def setup():
+            for fn in listdir(outputs):
+                if fn.startswith("state."):
+                    unlink(join(outputs, fn))
+
+        def run():
+            store = store_type(filename)
+            if batched:
+                with store.batch():
+                    for i in range(STATE_KEYS):
+                        store["Package{}.step.{}".format(i % 7, i)] = True
+            else:
+                for i in range(STATE_KEYS // 10):
+                    store["Package{}.step.{}".format(i % 7, i)] = True
+            if hasattr(store, "close"):
+                store.close()
+        return Benchmark("state_{}_{}".format(store_type.__name__, "batch" if batched else "single"), run, setup)
+
+    return [
+        Benchmark("dump_package_json", dump_package_json),
+        state_writes(JsonStore, False),
+        state_writes(JsonStore, True),
+        state_writes(SqliteStore, False),
+        state_writes(SqliteStore, True),
+    ]
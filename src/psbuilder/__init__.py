@@ -1 +1,13 @@
-from .toolchain import main
\ No newline at end of file
+import sys
+
+# commands answered without importing the toolchain (kivy_ios, sh and the recipes)
+LIGHT_COMMANDS = {"packages"}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in LIGHT_COMMANDS:
+        from .registry import packages_command
+        packages_command(sys.argv[2:])
+        return
+    from .toolchain import main
+    main()
@@ -0,0 +1,486 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, relpath, abspath
+from os import listdir, unlink, makedirs, walk, stat, replace, cpu_count
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from tempfile import SpooledTemporaryFile
+from time import localtime, gmtime
+from fnmatch import fnmatch
+from typing import Callable
+import stat as st
+import hashlib
+import posixpath
+import struct
+import zlib
+import os
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# sizes, offsets and entry counts from these on are stored in the ZIP64 fields,
+# the classic fields then hold the markers
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+CHUNK_SIZE = 1 << 20
+SPOOL_SIZE = 8 << 20
+
+CHECKSUM_SUFFIX = ".sha256"
+
+# entry time of deterministic archives unless SOURCE_DATE_EPOCH is set (1980-01-01 UTC, the first DOS date)
+DETERMINISTIC_MTIME = 315532800
+
+# already compressed payloads, stored as they are
+STORED_PATTERNS = [
+    "*.zip", "*.gz", "*.tgz", "*.bz2", "*.xz", "*.zst", "*.whl", "*.jar",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.mp3", "*.mp4", "*.m4a", "*.ogg",
+]
+
+
+def default_workers() -> int:
+    return cpu_count() or 1
+
+
+def dos_datetime(mtime: float, utc: bool = False) -> tuple[int, int]:
+    t = gmtime(mtime) if utc else localtime(mtime)
+    year = max(t.tm_year, 1980)
+    if year > 2107:
+        year = 2107
+    date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, time
+
+
+def deterministic_mtime() -> int:
+    return int(os.environ.get("SOURCE_DATE_EPOCH", DETERMINISTIC_MTIME))
+
+
+def normalized_mode(mode: int, is_dir: bool) -> int:
+    """rwxr-xr-x for folders and executables, rw-r--r-- for everything else."""
+    if is_dir or mode & 0o111:
+        return 0o755
+    return 0o644
+
+
+class CompressionPolicy:
+    """Deflate level per entry: the level of the first (pattern, level) rule
+    matching the entry name or its file name, else the level of the writer.
+    Level 0 stores the entry uncompressed.
+    """
+
+    rules: list[tuple[str, int]]
+
+    def __init__(self, rules: list[tuple[str, int]] | None = None):
+        self.rules = list(rules or [])
+
+    def level_for(self, arcname: str, default: int) -> int:
+        name = arcname.rpartition("/")[2]
+        for pattern, level in self.rules:
+            if fnmatch(arcname, pattern) or fnmatch(name, pattern):
+                return level
+        return default
+
+    @property
+    def dump(self) -> list[list]:
+        return [list(rule) for rule in self.rules]
+
+
+DEFAULT_COMPRESSION = CompressionPolicy([(pattern, 0) for pattern in STORED_PATTERNS])
+
+
+def checksum_path(path: str) -> str:
+    return f"{path}{CHECKSUM_SUFFIX}"
+
+
+def write_checksum_file(path: str, sha256: str):
+    sidecar = checksum_path(path)
+    with open(f"{sidecar}.tmp", "w") as fp:
+        fp.write(f"{sha256}  {basename(path)}\n")
+    replace(f"{sidecar}.tmp", sidecar)
+
+
+def read_checksum_file(path: str) -> str | None:
+    """SHA-256 recorded next to path by ZipWriter, if it is not older than path."""
+    sidecar = checksum_path(path)
+    try:
+        if stat(sidecar).st_mtime_ns < stat(path).st_mtime_ns:
+            return None
+        with open(sidecar) as fp:
+            sha256 = fp.read().split(maxsplit=1)[0]
+    except (FileNotFoundError, IndexError):
+        return None
+    return sha256 if len(sha256) == 64 else None
+
+
+class ZipMember:
+    arcname: str
+    path: str | None
+    mode: int
+    mtime: float
+    # (st_dev, st_ino) of files with more than one hard link
+    identity: tuple[int, int] | None
+    # target of a symlink entry, relative to the folder of arcname
+    link: str | None
+
+    def __init__(self, arcname: str, path: str | None, mode: int, mtime: float, identity: tuple[int, int] | None = None):
+        self.arcname = arcname
+        self.path = path
+        self.mode = mode
+        self.mtime = mtime
+        self.identity = identity
+        self.link = None
+
+    @classmethod
+    def of_file(cls, arcname: str, path: str, file_stat) -> "ZipMember":
+        identity = (file_stat.st_dev, file_stat.st_ino) if file_stat.st_nlink > 1 else None
+        return cls(arcname, path, file_stat.st_mode, file_stat.st_mtime, identity)
+
+    @property
+    def is_dir(self) -> bool:
+        return self.arcname.endswith("/")
+
+
+class CompressedMember:
+    member: ZipMember
+    method: int
+    crc: int
+    size: int
+    compress_size: int
+    data: SpooledTemporaryFile | None
+
+    def __init__(self, member: ZipMember, method: int, crc: int = 0, size: int = 0, compress_size: int = 0, data: SpooledTemporaryFile | None = None):
+        self.member = member
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.compress_size = compress_size
+        self.data = data
+
+
+class CentralEntry:
+    name: bytes
+    flags: int
+    method: int
+    date: int
+    time: int
+    crc: int
+    size: int
+    compress_size: int
+    offset: int
+    external_attr: int
+
+    def __init__(self, name: bytes, flags: int, method: int, date: int, time: int, crc: int, size: int, compress_size: int, offset: int, external_attr: int):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.date = date
+        self.time = time
+        self.crc = crc
+        self.size = size
+        self.compress_size = compress_size
+        self.offset = offset
+        self.external_attr = external_attr
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT or self.compress_size >= ZIP64_LIMIT or self.offset >= ZIP64_LIMIT
+
+
+def compress_member(member: ZipMember, level: int, spool_dir: str | None = None) -> CompressedMember:
+    if member.is_dir:
+        return CompressedMember(member, ZIP_STORED)
+    if member.link is not None:
+        target = member.link.encode("utf-8")
+        spool = SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=spool_dir)
+        spool.write(target)
+        spool.seek(0)
+        return CompressedMember(member, ZIP_STORED, zlib.crc32(target), len(target), len(target), spool)
+    method = ZIP_DEFLATED if level > 0 else ZIP_STORED
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=spool_dir)
+    crc = 0
+    size = 0
+    compress_size = 0
+    with open(member.path, "rb") as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            spool.write(chunk)
+    if compressor:
+        tail = compressor.flush()
+        compress_size += len(tail)
+        spool.write(tail)
+    spool.seek(0)
+    return CompressedMember(member, method, crc, size, compress_size, spool)
+
+
+def arcname(path: str, root: str, prefix: str = "") -> str:
+    name = relpath(path, root).replace(os.sep, "/")
+    return f"{prefix}/{name}" if prefix else name
+
+
+def collect_tree(src: str, root: str, prefix: str = "", exclude: Callable[[str], bool] | None = None) -> list[ZipMember]:
+    """Members for src and everything below it, named relative to root (like `zip -r`),
+    below the folder prefix when given. Files whose path matches exclude are left out."""
+    members: list[ZipMember] = []
+    src_stat = stat(src)
+    if not st.S_ISDIR(src_stat.st_mode):
+        return [ZipMember.of_file(arcname(src, root, prefix), src, src_stat)]
+    for dir_path, dir_names, file_names in walk(src, followlinks=True):
+        dir_stat = stat(dir_path)
+        arc_dir = arcname(dir_path, root, prefix)
+        members.append(ZipMember(f"{arc_dir}/", None, dir_stat.st_mode, dir_stat.st_mtime))
+        for fn in file_names:
+            path = join(dir_path, fn)
+            if exclude and exclude(path):
+                continue
+            try:
+                file_stat = stat(path)
+            except FileNotFoundError:
+                # dangling symlink, `zip -r` skips these as well
+                continue
+            members.append(ZipMember.of_file(f"{arc_dir}/{fn}", path, file_stat))
+    return members
+
+
+class ZipWriter:
+    """Zip archive writer compressing members on a thread pool.
+
+    Compressed members are spooled (in memory up to SPOOL_SIZE, then on disk)
+    and appended in submission order, so at most `max_pending` members are in
+    flight at any time. The output is written sequentially without seeking and
+    is moved into place only when the archive is complete. Its SHA-256 is
+    computed while writing and recorded in a `.sha256` file next to it.
+
+    When deterministic (the default) trees are added in sorted order and the
+    entries get a fixed time and normalized permissions, so the same content
+    gives the same bytes on any machine. The level of each entry comes from
+    policy when given, else level.
+
+    With dedup_links=True a file hard linked to one already added is stored
+    as a relative symlink to that entry instead of a second copy. Only use it
+    for archives whose consumers keep the whole tree, the link of a slice
+    pointing into another one breaks when a single slice is copied.
+    """
+
+    path: str
+    level: int
+    workers: int
+    policy: CompressionPolicy | None
+    deterministic: bool
+    dedup_links: bool
+    sha256: str | None
+
+    def __init__(
+            self, path: str, level: int = 6, workers: int | None = None,
+            policy: CompressionPolicy | None = None, deterministic: bool = True, dedup_links: bool = False):
+        self.path = path
+        self.level = level
+        self.policy = policy
+        self.deterministic = deterministic
+        self.dedup_links = dedup_links
+        self._linked: dict[tuple[int, int], str] = {}
+        self._mtime = deterministic_mtime()
+        self.workers = workers or default_workers()
+        self.max_pending = self.workers * 2
+        self.bytes_in = 0
+        self.sha256 = None
+        self._hash = hashlib.sha256()
+        self._tmp_path = f"{path}.tmp"
+        self._spool_dir = dirname(abspath(path))
+        makedirs(self._spool_dir, exist_ok=True)
+        self._fp = open(self._tmp_path, "wb")
+        self._offset = 0
+        self._entries: list[CentralEntry] = []
+        self._pending: deque[Future] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self) -> "ZipWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, member: ZipMember):
+        if self.dedup_links and member.identity is not None:
+            first = self._linked.setdefault(member.identity, member.arcname)
+            if first != member.arcname:
+                member.link = posixpath.relpath(first, posixpath.dirname(member.arcname))
+        level = self.policy.level_for(member.arcname, self.level) if self.policy else self.level
+        self._pending.append(
+            self._executor.submit(compress_member, member, level, self._spool_dir)
+        )
+        while len(self._pending) >= self.max_pending:
+            self._write_next()
+
+    def add_file(self, path: str, arcname: str):
+        self.add(ZipMember.of_file(arcname, path, stat(path)))
+
+    def add_dir(self, arcname: str, path: str):
+        dir_stat = stat(path)
+        self.add(ZipMember(f"{arcname.rstrip('/')}/", None, dir_stat.st_mode, dir_stat.st_mtime))
+
+    def add_tree(self, src: str, root: str | None = None, prefix: str = "", exclude: Callable[[str], bool] | None = None):
+        src = abspath(src)
+        members = collect_tree(src, root or dirname(src), prefix, exclude)
+        if self.deterministic:
+            members.sort(key=lambda member: member.arcname)
+        for member in members:
+            self.add(member)
+
+    def close(self):
+        while self._pending:
+            self._write_next()
+        self._executor.shutdown()
+        self._write_central_directory()
+        self._fp.close()
+        replace(self._tmp_path, self.path)
+        self.sha256 = self._hash.hexdigest()
+        write_checksum_file(self.path, self.sha256)
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown()
+        for future in self._pending:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                data = future.result().data
+                if data: data.close()
+        self._pending.clear()
+        self._fp.close()
+        if exists(self._tmp_path):
+            unlink(self._tmp_path)
+
+    def _write(self, data: bytes):
+        self._fp.write(data)
+        self._hash.update(data)
+        self._offset += len(data)
+
+    def _write_next(self):
+        compressed: CompressedMember = self._pending.popleft().result()
+        member = compressed.member
+        name = member.arcname.encode("utf-8")
+        flags = 0x800 if not member.arcname.isascii() else 0
+        mode = st.S_IMODE(member.mode)
+        if self.deterministic:
+            date, time = dos_datetime(self._mtime, utc=True)
+            mode = normalized_mode(mode, member.is_dir)
+        else:
+            date, time = dos_datetime(member.mtime)
+        if member.is_dir:
+            external_attr = (st.S_IFDIR | mode) << 16 | 0x10
+        elif member.link is not None:
+            external_attr = (st.S_IFLNK | 0o777) << 16
+        else:
+            external_attr = (st.S_IFREG | mode) << 16
+        entry = CentralEntry(
+            name, flags, compressed.method, date, time, compressed.crc,
+            compressed.size, compressed.compress_size, self._offset, external_attr
+        )
+        zip64 = compressed.size >= ZIP64_LIMIT or compressed.compress_size >= ZIP64_LIMIT
+        extra = b""
+        if zip64:
+            extra = struct.pack("<HHQQ", 1, 16, compressed.size, compressed.compress_size)
+        self._write(struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034b50,
+            45 if zip64 else 20,
+            flags,
+            compressed.method,
+            time,
+            date,
+            compressed.crc,
+            ZIP64_MARKER if zip64 else compressed.compress_size,
+            ZIP64_MARKER if zip64 else compressed.size,
+            len(name),
+            len(extra)
+        ))
+        self._write(name)
+        self._write(extra)
+        if compressed.data:
+            with compressed.data as data:
+                while True:
+                    chunk = data.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self._write(chunk)
+        self.bytes_in += compressed.size
+        self._entries.append(entry)
+
+    def _write_central_directory(self):
+        cd_offset = self._offset
+        for entry in self._entries:
+            extra_fields = []
+            if entry.size >= ZIP64_LIMIT:
+                extra_fields.append(entry.size)
+            if entry.compress_size >= ZIP64_LIMIT:
+                extra_fields.append(entry.compress_size)
+            if entry.offset >= ZIP64_LIMIT:
+                extra_fields.append(entry.offset)
+            extra = b""
+            if extra_fields:
+                extra = struct.pack(f"<HH{len(extra_fields)}Q", 1, 8 * len(extra_fields), *extra_fields)
+            version = 45 if entry.zip64 else 20
+            self._write(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014b50,
+                3 << 8 | version,
+                version,
+                entry.flags,
+                entry.method,
+                entry.time,
+                entry.date,
+                entry.crc,
+                ZIP64_MARKER if entry.compress_size >= ZIP64_LIMIT else entry.compress_size,
+                ZIP64_MARKER if entry.size >= ZIP64_LIMIT else entry.size,
+                len(entry.name),
+                len(extra),
+                0, 0, 0,
+                entry.external_attr,
+                ZIP64_MARKER if entry.offset >= ZIP64_LIMIT else entry.offset
+            ))
+            self._write(entry.name)
+            self._write(extra)
+        cd_size = self._offset - cd_offset
+        count = len(self._entries)
+        if count >= ZIP_MAX_ENTRIES or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_end_offset = self._offset
+            self._write(struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064b50, 44, 3 << 8 | 45, 45, 0, 0,
+                count, count, cd_size, cd_offset
+            ))
+            self._write(struct.pack("<IIQI", 0x07064b50, 0, zip64_end_offset, 1))
+        self._write(struct.pack(
+            "<IHHHHIIH",
+            0x06054b50, 0, 0,
+            ZIP64_COUNT_MARKER if count >= ZIP_MAX_ENTRIES else count,
+            ZIP64_COUNT_MARKER if count >= ZIP_MAX_ENTRIES else count,
+            ZIP64_MARKER if cd_size >= ZIP64_LIMIT else cd_size,
+            ZIP64_MARKER if cd_offset >= ZIP64_LIMIT else cd_offset,
+            0
+        ))
+
+
+def zip_tree(
+        src: str, destination: str, root: str | None = None, level: int = 6,
+        workers: int | None = None, policy: CompressionPolicy | None = DEFAULT_COMPRESSION,
+        dedup_links: bool = False, exclude: Callable[[str], bool] | None = None) -> str:
+    """Zip src (file or folder) into destination, entries relative to root (default: parent of src).
+
+    The archive is deterministic, entries matching policy are stored and
+    files whose path matches exclude are left out.
+    """
+    with ZipWriter(destination, level, workers, policy, dedup_links=dedup_links) as writer:
+        writer.add_tree(src, root, exclude=exclude)
+    return destination
@@ -0,0 +1,206 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs, replace
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock, Lock
+import hashlib
+import json
+import time
+
+from kivy_ios.toolchain import logger
+
+from .checksums import sha256_file, file_identity
+from .fetch import Fetcher, FetchError, ChecksumMismatch
+from .staging import stage_file
+from .utils import atomic_write_json
+
+DEFAULT_MAX_BYTES = 4 << 30
+
+
+class ArtifactError(FetchError):
+    pass
+
+
+class ArtifactUnavailable(ArtifactError):
+    pass
+
+
+class ArtifactCache:
+    """Content-addressed cache for downloaded release assets.
+
+    Files are stored once per SHA-256 under `objects/` and found again by URL
+    (and expected SHA-256 when known). Objects are verified when added and
+    again before they are served if their file changed since, the least
+    recently used ones are evicted above max_bytes. In offline mode nothing
+    is downloaded.
+    """
+
+    root: str
+    max_bytes: int
+    offline: bool
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False, fetcher: Fetcher | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.fetcher = fetcher or Fetcher()
+        self.lock = RLock()
+        self.url_locks: dict[str, Lock] = {}
+        self.index = {"urls": {}, "objects": {}}
+        if exists(self.index_filename):
+            try:
+                with open(self.index_filename, encoding="utf-8") as fd:
+                    self.index = json.load(fd)
+            except ValueError:
+                print("Unable to read the artifact index, content will be replaced.")
+
+    @property
+    def index_filename(self) -> str:
+        return join(self.root, "index.json")
+
+    def object_path(self, sha256: str) -> str:
+        return join(self.root, "objects", sha256[:2], sha256)
+
+    def lookup(self, url: str, sha256: str | None = None) -> str | None:
+        """Path of the verified cached object for url (and sha256), or None.
+
+        An object whose file identity (size, mtime_ns, inode) is the one recorded
+        when it was verified is trusted, others are hashed again outside of the lock.
+        """
+        with self.lock:
+            sha256 = sha256 or self.index["urls"].get(url)
+            if not sha256 or sha256 not in self.index["objects"]:
+                return None
+            path = self.object_path(sha256)
+            identity = self.index["objects"][sha256].get("identity")
+        try:
+            verified = identity is not None and file_identity(path) == identity
+            if not verified:
+                verified = sha256_file(path) == sha256
+                identity = file_identity(path)
+        except FileNotFoundError:
+            verified = False
+        with self.lock:
+            entry = self.index["objects"].get(sha256)
+            if entry is None:
+                return None
+            if not verified:
+                logger.warning("Cached artifact {} is missing or corrupt, dropping it".format(path))
+                self._remove(sha256)
+                self._save()
+                return None
+            self.index["urls"][url] = sha256
+            entry["identity"] = identity
+            entry["last_used"] = time.time()
+            if url not in entry["urls"]:
+                entry["urls"].append(url)
+            self._save()
+            return path
+
+    def cached_size(self, url: str, sha256: str | None = None) -> int | None:
+        """Size of the cached object for url (and sha256) according to the index, without verifying it."""
+        with self.lock:
+            sha256 = sha256 or self.index["urls"].get(url)
+            entry = self.index["objects"].get(sha256) if sha256 else None
+            if entry is None or not exists(self.object_path(sha256)):
+                return None
+            return entry["size"]
+
+    def fetch(self, url: str, sha256: str | None = None) -> str:
+        """Path of the cached object for url, downloading it first if needed."""
+        with self._url_lock(url):
+            path = self.lookup(url, sha256)
+            if path:
+                logger.info("Using cached {}".format(url))
+                return path
+            if self.offline:
+                raise ArtifactUnavailable("{} is not cached and downloads are disabled (offline)".format(url))
+            tmp = self.download_path(url)
+            logger.info("Downloading {}".format(url))
+            digest = self.fetcher.fetch(url, tmp, sha256)
+            return self.add(url, tmp, digest, verified=True)
+
+    def fetch_many(self, downloads: list[tuple[str, str | None]]) -> list[str]:
+        """fetch() several (url, sha256) at once, missing ones are downloaded concurrently."""
+        if len(downloads) < 2:
+            return [self.fetch(url, sha256) for url, sha256 in downloads]
+        with ThreadPoolExecutor(max_workers=min(self.fetcher.max_workers, len(downloads))) as executor:
+            futures = [executor.submit(self.fetch, url, sha256) for url, sha256 in downloads]
+            return [future.result() for future in futures]
+
+    def download_path(self, url: str) -> str:
+        """Temporary download location of url, stable so an interrupted download can be resumed."""
+        name = hashlib.sha256(url.encode()).hexdigest()[:16]
+        return join(self.root, "tmp", "{}-{}".format(name, basename(url)))
+
+    def add(self, url: str, tmp: str, sha256: str | None = None, verified: bool = False) -> str:
+        """Move a downloaded file into the cache, checking it against sha256.
+
+        verified=True skips hashing tmp again when sha256 was computed while downloading.
+        """
+        digest = sha256 if verified and sha256 else sha256_file(tmp)
+        if sha256 and digest != sha256:
+            unlink(tmp)
+            raise ChecksumMismatch("{} has SHA-256 {}, expected {}".format(url, digest, sha256))
+        with self.lock:
+            path = self.object_path(digest)
+            makedirs(dirname(path), exist_ok=True)
+            replace(tmp, path)
+            entry = self.index["objects"].setdefault(digest, {"size": 0, "last_used": 0, "urls": []})
+            entry["identity"] = file_identity(path)
+            entry["size"] = entry["identity"][0]
+            entry["last_used"] = time.time()
+            if url not in entry["urls"]:
+                entry["urls"].append(url)
+            self.index["urls"][url] = digest
+            self.evict(keep=digest)
+            self._save()
+        return path
+
+    def copy_to(self, url: str, destination: str, sha256: str | None = None) -> str:
+        stage_file(self.fetch(url, sha256), destination, hardlink=False)
+        return destination
+
+    def evict(self, max_bytes: int | None = None, keep: str | None = None) -> list[str]:
+        """Remove least recently used objects until the cache fits max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = []
+        with self.lock:
+            objects = self.index["objects"]
+            total = sum(entry["size"] for entry in objects.values())
+            for sha256, entry in sorted(objects.items(), key=lambda item: item[1]["last_used"]):
+                if total <= max_bytes:
+                    break
+                if sha256 == keep:
+                    continue
+                total -= entry["size"]
+                self._remove(sha256)
+                removed.append(sha256)
+            if removed:
+                logger.info("Evicted {} artifacts from {}".format(len(removed), self.root))
+                self._save()
+        return removed
+
+    def entries(self) -> dict[str, dict]:
+        with self.lock:
+            return json.loads(json.dumps(self.index["objects"]))
+
+    @property
+    def size(self) -> int:
+        with self.lock:
+            return sum(entry["size"] for entry in self.index["objects"].values())
+
+    def _url_lock(self, url: str) -> Lock:
+        with self.lock:
+            return self.url_locks.setdefault(url, Lock())
+
+    def _remove(self, sha256: str):
+        entry = self.index["objects"].pop(sha256, None)
+        for url in (entry or {}).get("urls", []):
+            if self.index["urls"].get(url) == sha256:
+                del self.index["urls"][url]
+        path = self.object_path(sha256)
+        if exists(path):
+            unlink(path)
+
+    def _save(self):
+        atomic_write_json(self.index_filename, self.index)
@@ -0,0 +1,263 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs, environ, chdir, getcwd, walk, dup2
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections import deque
+import logging
+import sys
+
+from kivy_ios.toolchain import Recipe, logger
+
+from .context import PackageContext
+from .scheduler import run_graph
+from .outputs import OutputRecorder
+
+
+class BuildOptions:
+    """Settings a worker process needs to rebuild the parent's context."""
+
+    num_cores: int
+    use_pigz: bool
+    use_pbzip2: bool
+    platforms: list[str]
+    custom_recipes_paths: list[str]
+    wanted_recipes: list[str]
+    log_dir: str
+
+    def __init__(self, ctx: PackageContext, log_dir: str):
+        self.num_cores = ctx.num_cores
+        self.use_pigz = ctx.use_pigz
+        self.use_pbzip2 = ctx.use_pbzip2
+        self.platforms = [plat.name for plat in ctx.selected_platforms]
+        self.custom_recipes_paths = list(ctx.custom_recipes_paths)
+        self.wanted_recipes = list(getattr(ctx, "wanted_recipes", []))
+        self.log_dir = log_dir
+
+    def create_context(self) -> PackageContext:
+        ctx = PackageContext()
+        ctx.num_cores = self.num_cores
+        ctx.use_pigz = self.use_pigz
+        ctx.use_pbzip2 = self.use_pbzip2
+        ctx.selected_platforms = [
+            plat for plat in ctx.supported_platforms if plat.name in self.platforms
+        ]
+        ctx.custom_recipes_paths = list(self.custom_recipes_paths)
+        ctx.wanted_recipes = list(self.wanted_recipes)
+        return ctx
+
+    def log_file(self, name: str) -> str:
+        return join(self.log_dir, f"{name}.log")
+
+
+def capture_output(log_file: str):
+    """Send everything this process writes (including subprocesses) to log_file."""
+    makedirs(dirname(log_file), exist_ok=True)
+    for handler in logging.getLogger().handlers + logger.handlers:
+        handler.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log_file, "w") as fp:
+        dup2(fp.fileno(), 1)
+        dup2(fp.fileno(), 2)
+
+
+class BuildUnit:
+    """One scheduling unit of a recipe build.
+
+    step is "build" (the whole recipe), "download" (with the hostpython
+    prerequisites), "platform" (one platform slice, built in its own build
+    directory) or "assemble" (build_all over the already built slices, which
+    creates the xcframeworks).
+    """
+
+    recipe: str
+    step: str
+    platform: str | None
+
+    def __init__(self, recipe: str, step: str = "build", platform: str | None = None):
+        self.recipe = recipe
+        self.step = step
+        self.platform = platform
+
+    @property
+    def name(self) -> str:
+        match self.step:
+            case "build" | "assemble":
+                return self.recipe
+            case "platform":
+                return f"{self.recipe}.{self.platform}"
+            case _:
+                return f"{self.recipe}.{self.step}"
+
+
+def build_unit_worker(unit: BuildUnit, options: BuildOptions, platforms: list[str] | None = None) -> str:
+    capture_output(options.log_file(unit.name))
+    if unit.platform:
+        options.platforms = [unit.platform]
+    ctx = options.create_context()
+    recipe = Recipe.get_recipe(unit.recipe, ctx)
+    recipe.init_with_ctx(ctx)
+    try:
+        match unit.step:
+            case "download":
+                recipe.download()
+                # execute() does this before build_all, the platform units need them too
+                recipe.install_hostpython_prerequisites()
+            case "platform":
+                plat = ctx.selected_platforms[0]
+                recipe.download()
+                recipe.extract_platform(plat)
+                if getattr(recipe, "custom_dir", None):
+                    # the build directory was copied again from the custom folder, as
+                    # execute() does for such recipes the build must run again
+                    ctx.state.remove_all("{}.build.{}".format(recipe.name, plat))
+                recipe.build(plat)
+            case "assemble":
+                build_platform = recipe.build
+                def build(plat, *args, **kwargs):
+                    # built by the "platform" units of this run, in other processes
+                    if plat.name in platforms:
+                        logger.info("{} for {} already built".format(unit.recipe, plat.name))
+                        return
+                    return build_platform(plat, *args, **kwargs)
+                recipe.build = build
+                # downloaded and extracted per platform by the other units, execute()
+                # would extract again and replace the built slices of a custom_dir recipe
+                with ctx.state.batch():
+                    if getattr(recipe, "custom_dir", None):
+                        ctx.state.remove_all("{}.build_all".format(recipe.name))
+                    ctx.state["{}.download".format(recipe.name)] = True
+                    ctx.state["{}.extract".format(recipe.name)] = True
+                recipe.build_all()
+            case _:
+                recipe.execute()
+    except BaseException:
+        logger.exception("Build of {} failed".format(unit.name))
+        raise
+    finally:
+        sys.stdout.flush()
+    return unit.name
+
+
+def log_tail(log_file: str, lines: int = 40) -> str:
+    if not exists(log_file):
+        return ""
+    with open(log_file, errors="replace") as fp:
+        return "".join(deque(fp, maxlen=lines))
+
+
+def recipe_dependencies(recipes: list[Recipe]) -> dict[str, set[str]]:
+    """Dependency sets for recipes given in build order.
+
+    A dependency that is not one of the recipes (an alias) makes the recipe
+    wait for every recipe before it in the build order.
+    """
+    order = [recipe.name for recipe in recipes]
+    position = {name: index for index, name in enumerate(order)}
+    graph: dict[str, set[str]] = {}
+    for recipe in recipes:
+        index = position[recipe.name]
+        deps: set[str] = set()
+        for dep in recipe.depends:
+            if dep in position:
+                deps.add(dep)
+            else:
+                deps.update(order[:index])
+        for dep in recipe.optional_depends:
+            if dep in position and position[dep] < index:
+                deps.add(dep)
+        graph[recipe.name] = deps
+    return graph
+
+
+def recipe_platforms(recipe: Recipe, ctx: PackageContext) -> list[str]:
+    """Names of the platforms recipe builds that can be split off into their own units."""
+    selected = [plat.name for plat in ctx.selected_platforms]
+    platforms = [plat.name for plat in getattr(recipe, "platforms_to_build", ctx.selected_platforms)]
+    if len(platforms) < 2 or not set(platforms) <= set(selected):
+        return []
+    return platforms
+
+
+def build_units(recipes: list[Recipe], ctx: PackageContext, split_platforms: bool = False) -> tuple[dict[str, set[str]], dict[str, tuple[BuildUnit, list[str] | None]]]:
+    """Scheduling graph of recipe build units and the units by node name.
+
+    With split_platforms every recipe building several platforms becomes a
+    download unit (which also installs the hostpython prerequisites, after
+    the recipe's dependencies when there are any), one unit per platform
+    (after the download and the recipe's dependencies) and an assemble unit
+    after all of its platforms.
+    """
+    recipe_graph = recipe_dependencies(recipes)
+    graph: dict[str, set[str]] = {}
+    units: dict[str, tuple[BuildUnit, list[str] | None]] = {}
+    for recipe in recipes:
+        deps = recipe_graph[recipe.name]
+        platforms = recipe_platforms(recipe, ctx) if split_platforms else []
+        if not platforms:
+            unit = BuildUnit(recipe.name)
+            graph[unit.name] = set(deps)
+            units[unit.name] = (unit, None)
+            continue
+        download = BuildUnit(recipe.name, "download")
+        # the download unit also installs the hostpython prerequisites,
+        # which needs the hostpython of the dependencies
+        graph[download.name] = set(deps) if getattr(recipe, "hostpython_prerequisites", None) else set()
+        units[download.name] = (download, None)
+        slices = []
+        for plat in platforms:
+            unit = BuildUnit(recipe.name, "platform", plat)
+            graph[unit.name] = {download.name, *deps}
+            units[unit.name] = (unit, None)
+            slices.append(unit.name)
+        assemble = BuildUnit(recipe.name, "assemble")
+        graph[assemble.name] = set(slices)
+        units[assemble.name] = (assemble, platforms)
+    return graph, units
+
+
+def build_recipes_concurrently(
+        recipes: list[Recipe], ctx: PackageContext, jobs: int, split_platforms: bool = False,
+        outputs: OutputRecorder | None = None):
+    """Build recipes in worker processes, each unit as soon as its dependencies are built.
+
+    Recipes change directory and environment while building, so every unit
+    gets its own process. Output of each unit goes to build/logs/<unit>.log.
+    The recipe state store must be safe to share between processes.
+    """
+    if not getattr(ctx.state, "process_safe", False):
+        raise RuntimeError(
+            "Concurrent builds need a recipe state store shared safely between processes, {} is not".format(
+                type(ctx.state).__name__))
+    options = BuildOptions(ctx, join(ctx.build_dir, "logs"))
+    graph, units = build_units(recipes, ctx, split_platforms)
+    logger.info("Building {} units with {} workers, logs in {}".format(len(graph), jobs, options.log_dir))
+    executor = ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=get_context("spawn"),
+        max_tasks_per_child=1
+    )
+
+    def build(name: str):
+        unit, platforms = units[name]
+        log_file = options.log_file(name)
+        logger.info("Building {} (log: {})".format(name, log_file))
+        if outputs:
+            outputs.start(unit.recipe)
+        try:
+            executor.submit(build_unit_worker, unit, options, platforms).result()
+        except BaseException:
+            logger.error("Build of {} failed, end of {}:\n{}".format(name, log_file, log_tail(log_file)))
+            if outputs:
+                outputs.finish(unit.recipe, succeeded=False)
+            raise
+        logger.info("Built {}".format(name))
+        # the worker committed to the state store, the parent reads it next
+        ctx.state.reload()
+        if outputs and unit.step in ("build", "assemble"):
+            outputs.finish(unit.recipe)
+
+    try:
+        run_graph(graph, build, jobs)
+    finally:
+        executor.shutdown()
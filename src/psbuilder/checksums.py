@@ -0,0 +1,170 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, abspath, relpath
+from os import listdir, unlink, makedirs, stat, replace, walk
+from threading import RLock
+from contextlib import contextmanager
+import hashlib
+import json
+
+from .archive import read_checksum_file
+
+BUF_SIZE = 65536
+
+
+def sha256_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while True:
+            data = fp.read(BUF_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def file_identity(path: str) -> list[int]:
+    st = stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class ChecksumIndex:
+    """Persistent SHA-256 index keyed by path and file identity (size, mtime_ns, inode).
+
+    A recorded checksum is only returned while the file on disk still has the
+    identity it had when it was hashed, so unchanged archives are never read again.
+    Changes are written to filename right away, or once at the end of a batch().
+    """
+
+    filename: str
+    data: dict[str, dict]
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.data = {}
+        self.lock = RLock()
+        self._batch_depth = 0
+        self._dirty = False
+        if exists(filename):
+            try:
+                with open(filename, encoding="utf-8") as fd:
+                    self.data = json.load(fd)
+            except ValueError:
+                print("Unable to read the checksum index, content will be replaced.")
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+
+    def get(self, path: str) -> str | None:
+        key = abspath(path)
+        with self.lock:
+            entry = self.data.get(key)
+            if not entry:
+                return None
+            try:
+                identity = file_identity(key)
+            except FileNotFoundError:
+                return None
+            if entry["identity"] != identity:
+                return None
+            return entry["sha256"]
+
+    def record(self, path: str, sha256: str, sync: bool = True):
+        key = abspath(path)
+        with self.lock:
+            self.data[key] = {
+                "identity": file_identity(key),
+                "sha256": sha256
+            }
+            if sync:
+                self.sync()
+
+    def checksum(self, path: str) -> str:
+        sha256 = self.get(path)
+        if sha256:
+            return sha256
+        # digest recorded by the zip step while the archive was written
+        sha256 = read_checksum_file(path) or sha256_file(path)
+        self.record(path, sha256)
+        return sha256
+
+    def invalidate(self, prefix: str | None = None) -> list[str]:
+        """Forget entries whose path starts with prefix (all entries if None)."""
+        with self.lock:
+            if prefix is None:
+                removed = list(self.data.keys())
+            else:
+                prefix = abspath(prefix)
+                removed = [key for key in self.data if key.startswith(prefix)]
+            for key in removed:
+                del self.data[key]
+            self.sync()
+        return removed
+
+    def prune(self) -> list[str]:
+        """Drop entries for files that no longer exist or have changed."""
+        with self.lock:
+            stale = [key for key in self.data if self.get(key) is None]
+            for key in stale:
+                del self.data[key]
+            self.sync()
+        return stale
+
+    def entries(self) -> dict[str, dict]:
+        with self.lock:
+            return {
+                key: {**entry, "valid": self.get(key) is not None}
+                for key, entry in self.data.items()
+            }
+
+    @contextmanager
+    def batch(self):
+        """Write the changes made inside the outermost batch once, when it exits."""
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self.sync()
+
+    def sync(self):
+        with self.lock:
+            if self._batch_depth:
+                self._dirty = True
+                return
+            self._dirty = False
+            makedirs(dirname(self.filename), exist_ok=True)
+            tmp = f"{self.filename}.tmp"
+            with open(tmp, "w") as fd:
+                json.dump(self.data, fd, ensure_ascii=False)
+            replace(tmp, self.filename)
+
+
+def tree_fingerprint(path: str, index: ChecksumIndex | None = None) -> str | None:
+    """SHA-256 over the relative path, executable bit and content of every file below path.
+
+    Unlike tree_manifest it ignores mtimes, so a rebuild producing the same
+    files gives the same fingerprint. File digests are cached in index.
+    """
+    if not exists(path):
+        return None
+    files = [path] if not isdir(path) else sorted(
+        join(dir_path, fn) for dir_path, dir_names, file_names in walk(path, followlinks=True) for fn in file_names
+    )
+    digest = hashlib.sha256()
+    for file_path in files:
+        try:
+            sha256 = index.get(file_path) if index else None
+            if sha256 is None:
+                sha256 = sha256_file(file_path)
+                if index:
+                    index.record(file_path, sha256, sync=False)
+            executable = bool(stat(file_path).st_mode & 0o111)
+        except FileNotFoundError:
+            continue
+        name = basename(path) if file_path == path else relpath(file_path, path)
+        digest.update("{}\0{:d}\0{}\n".format(name, executable, sha256).encode("utf-8"))
+    if index:
+        index.sync()
+    return digest.hexdigest()
@@ -2,19 +2,33 @@ from os.path import join, dirname, realpath, exists, isdir, basename, splitext
 from os import listdir, unlink, makedirs, environ, chdir, getcwd, walk
 
 from kivy_ios.toolchain import Context as Context
-from kivy_ios.toolchain import JsonStore
 from kivy_ios.toolchain import iPhoneOSARM64Platform, iPhoneSimulatorx86_64Platform, iPhoneSimulatorARM64Platform
 
+from .checksums import ChecksumIndex
+from .artifacts import ArtifactCache
+from .outputs import RecipeOutputStore
+from .utils import JsonStore, SqliteStore, open_state_store
+
 initial_working_directory = getcwd()
 
 class PackageContext(Context):
     
-    package_state: JsonStore
+    packages_state: JsonStore | SqliteStore
+    state: JsonStore | SqliteStore
+    checksums: ChecksumIndex
+    artifacts: ArtifactCache
+    # None disables restoring and storing recipe outputs
+    recipe_outputs: RecipeOutputStore | None
     site_packages_root: str
     
     def __init__(self):
         super().__init__()
-        self.packages_state = JsonStore(join(self.swift_packages, "packages_state.db"))
+        # dist/state.db is shared with kivy_ios
+        self.state = open_state_store(join(self.dist_dir, "state.db"), shared=True)
+        self.packages_state = open_state_store(join(self.swift_packages, "packages_state.db"))
+        self.checksums = ChecksumIndex(join(self.swift_packages, "checksums.json"))
+        self.artifacts = ArtifactCache(join(self.cache_dir, "artifacts"))
+        self.recipe_outputs = RecipeOutputStore(join(self.cache_dir, "recipe_outputs"))
         platforms = [
             iPhoneOSARM64Platform(self),
             iPhoneSimulatorARM64Platform(self),
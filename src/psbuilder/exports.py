@@ -0,0 +1,87 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import makedirs, replace
+import json
+
+from kivy_ios.toolchain import logger
+
+EXPORT_MANIFEST = "export_manifest.json"
+
+
+class ExportedTarget:
+    """Last export of a binary target: the content it was zipped from and where it was published."""
+
+    __slots__ = ("name", "file", "fingerprint", "version", "sha256")
+
+    name: str
+    file: str
+    fingerprint: str
+    version: str
+    sha256: str
+
+    def __init__(self, name: str, file: str, fingerprint: str, version: str, sha256: str):
+        self.name = name
+        self.file = file
+        self.fingerprint = fingerprint
+        self.version = version
+        self.sha256 = sha256
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "file": self.file,
+            "fingerprint": self.fingerprint,
+            "version": self.version,
+            "sha256": self.sha256,
+        }
+
+
+class ExportManifest:
+    """Exported binary targets of a package, kept next to its package.json.
+
+    A target whose content fingerprint matches its entry is not zipped again
+    and keeps the version (so the release url) and checksum of its entry.
+    upload lists the zips the last export made, which have to be published.
+    """
+
+    filename: str
+    targets: dict[str, ExportedTarget]
+    upload: list[str]
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.targets = {}
+        self.upload = []
+        if exists(filename):
+            try:
+                with open(filename, encoding="utf-8") as fp:
+                    data = json.load(fp)
+                self.targets = {
+                    name: ExportedTarget(name, **entry) for name, entry in data.get("targets", {}).items()
+                }
+                self.upload = data.get("upload", [])
+            except (ValueError, TypeError):
+                logger.warning("Unable to read {}, all targets will be exported.".format(filename))
+
+    def get(self, name: str) -> ExportedTarget | None:
+        return self.targets.get(name)
+
+    def changed(self, name: str, fingerprint: str | None) -> bool:
+        entry = self.targets.get(name)
+        return fingerprint is None or entry is None or entry.fingerprint != fingerprint
+
+    def record(self, name: str, file: str, fingerprint: str, version: str, sha256: str):
+        self.targets[name] = ExportedTarget(name, file, fingerprint, version, sha256)
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "targets": {name: target.dump for name, target in sorted(self.targets.items())},
+            "upload": self.upload,
+        }
+
+    def sync(self):
+        makedirs(dirname(self.filename), exist_ok=True)
+        tmp = f"{self.filename}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump(self.dump, fp, indent=2)
+        replace(tmp, self.filename)
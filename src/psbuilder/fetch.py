@@ -0,0 +1,213 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs, stat, replace
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urlsplit, urljoin
+import http.client
+import hashlib
+import time
+
+from kivy_ios.toolchain import logger
+
+CHUNK_SIZE = 1 << 20
+MAX_REDIRECTS = 10
+USER_AGENT = "psbuilder"
+
+
+class FetchError(Exception):
+    pass
+
+
+class ChecksumMismatch(FetchError):
+    pass
+
+
+class ConnectionPool:
+    """Idle keep-alive connections by (scheme, host, port)."""
+
+    def __init__(self, max_idle_per_host: int = 8, timeout: float = 60.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.lock = Lock()
+        self.idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+
+    def get(self, scheme: str, host: str, port: int | None) -> http.client.HTTPConnection:
+        key = (scheme, host, port)
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+        return self.connect(scheme, host, port)
+
+    def connect(self, scheme: str, host: str, port: int | None) -> http.client.HTTPConnection:
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def put(self, scheme: str, host: str, port: int | None, connection: http.client.HTTPConnection):
+        key = (scheme, host, port)
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+class Fetcher:
+    """HTTP downloader reusing connections, resuming partial downloads and retrying.
+
+    Data is written to `<destination>.part` and hashed while it streams in;
+    after a dropped connection the download continues with a Range request
+    from where the part file ends. The part file is only moved to the
+    destination once its SHA-256 matches the expected one (when given).
+    """
+
+    def __init__(self, max_workers: int = 4, retries: int = 5, backoff: float = 1.0, timeout: float = 60.0):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(max_workers * 2, timeout)
+
+    def fetch(self, url: str, destination: str, sha256: str | None = None) -> str:
+        """Download url to destination and return its SHA-256."""
+        makedirs(dirname(destination) or ".", exist_ok=True)
+        part = f"{destination}.part"
+        attempt = 0
+        while True:
+            try:
+                digest = self._download(url, part)
+                break
+            except (OSError, http.client.HTTPException) as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise FetchError("Giving up on {} after {} attempts: {}".format(url, attempt, err)) from err
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.warning("Download of {} failed ({}), retrying in {:.1f}s".format(url, err, delay))
+                time.sleep(delay)
+        if sha256 and digest != sha256:
+            unlink(part)
+            raise ChecksumMismatch("{} has SHA-256 {}, expected {}".format(url, digest, sha256))
+        replace(part, destination)
+        return digest
+
+    def fetch_many(self, downloads: list[tuple[str, str, str | None]]) -> list[str]:
+        """Fetch (url, destination, sha256) items concurrently, returns their SHA-256 in order."""
+        if len(downloads) < 2:
+            return [self.fetch(*download) for download in downloads]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(downloads))) as executor:
+            futures = [executor.submit(self.fetch, *download) for download in downloads]
+            return [future.result() for future in futures]
+
+    def close(self):
+        self.pool.close()
+
+    def _download(self, url: str, part: str) -> str:
+        sha256 = hashlib.sha256()
+        offset = 0
+        if exists(part):
+            # hash what is already there, then only ask for the rest
+            with open(part, "rb") as fp:
+                while True:
+                    chunk = fp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    offset += len(chunk)
+        headers = {"User-Agent": USER_AGENT}
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+        for _ in range(MAX_REDIRECTS):
+            scheme, host, port, response, connection = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader("Location")
+                response.read()
+                self._release(scheme, host, port, response, connection)
+                if not location:
+                    raise FetchError("Redirect without location from {}".format(url))
+                url = urljoin(url, location)
+                continue
+            break
+        else:
+            raise FetchError("Too many redirects for {}".format(url))
+        try:
+            if response.status == 416 and offset:
+                # nothing left to fetch, unless the part file is bogus
+                total = response.getheader("Content-Range", "").rpartition("/")[2]
+                response.read()
+                if total.isdigit() and int(total) == offset:
+                    self._release(scheme, host, port, response, connection)
+                    return sha256.hexdigest()
+                logger.info("Range request rejected for {}, restarting".format(url))
+                connection.close()
+                unlink(part)
+                return self._download(url, part)
+            if response.status == 200:
+                if offset:
+                    logger.info("{} does not support resuming, restarting".format(url))
+                sha256 = hashlib.sha256()
+                mode = "wb"
+            elif response.status == 206:
+                content_range = response.getheader("Content-Range", "")
+                if not content_range.startswith("bytes {}-".format(offset)):
+                    unlink(part)
+                    raise http.client.HTTPException("Unexpected range {} from {}".format(content_range, url))
+                mode = "ab"
+            else:
+                response.read()
+                message = "{} answered {} {}".format(url, response.status, response.reason)
+                if response.status >= 500:
+                    # server side trouble is worth a retry, anything else is not
+                    raise http.client.HTTPException(message)
+                raise FetchError(message)
+            received = 0
+            with open(part, mode) as fp:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    sha256.update(chunk)
+                    received += len(chunk)
+            length = response.getheader("Content-Length", "")
+            if length.isdigit() and received != int(length):
+                # the part file is kept, the next attempt resumes after what arrived
+                raise http.client.IncompleteRead(b"", int(length) - received)
+        except BaseException:
+            connection.close()
+            raise
+        self._release(scheme, host, port, response, connection)
+        return sha256.hexdigest()
+
+    def _request(self, url: str, headers: dict):
+        split = urlsplit(url)
+        scheme = split.scheme
+        host = split.hostname
+        port = split.port
+        path = split.path or "/"
+        if split.query:
+            path = f"{path}?{split.query}"
+        connection = self.pool.get(scheme, host, port)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            # an idle connection may have been closed by the server, retry once on a new one
+            connection = self.pool.connect(scheme, host, port)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        return scheme, host, port, response, connection
+
+    def _release(self, scheme, host, port, response: http.client.HTTPResponse, connection: http.client.HTTPConnection):
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(scheme, host, port, connection)
@@ -0,0 +1,29 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive import default_workers
+from .sync import SyncReport, sync_tree, link_file
+
+
+def inject_headers(
+        headers: str,
+        xcframeworks: list[str],
+        platforms: list[str],
+        name: str | None = None,
+        workers: int | None = None
+    ) -> SyncReport:
+    """Hard link the header folder into <xcframework>/<platform>/<name> of every slice.
+
+    All slices share the files of headers instead of holding a copy each,
+    header folders left by an earlier run are brought up to date. The slices
+    are processed in parallel. Change header files afterwards only through
+    write_file, writing to them in place changes every slice.
+    """
+    name = name or basename(headers)
+    destinations = [join(xc, platform, name) for xc in xcframeworks for platform in platforms]
+    report = SyncReport()
+    with ThreadPoolExecutor(max_workers=workers or default_workers()) as executor:
+        for result in executor.map(
+                lambda destination: sync_tree(headers, destination, copy_function=link_file), destinations):
+            report.add(result)
+    return report
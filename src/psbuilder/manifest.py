@@ -0,0 +1,176 @@
+# EXPERIMENTAL in-process renderer of Package.swift from a package.json dump.
+# SwiftPackageWriter stays the default (SwiftPackage.experimental_package_swift_renderer):
+# tests/golden only pins this renderer's own output, tests/test_manifest.py compares
+# it with the writer where that is installed.
+import json
+
+SWIFT_TOOLS_VERSION = "5.9"
+
+IOS_VERSION = "v13"
+MACOS_VERSION = "v11"
+
+INDENT = "    "
+
+# platform names used in conditions of the dump
+PLATFORMS = {
+    "ios": ".iOS",
+    "macos": ".macOS",
+    "maccatalyst": ".macCatalyst",
+    "tvos": ".tvOS",
+    "watchos": ".watchOS",
+    "visionos": ".visionOS",
+    "linux": ".linux",
+}
+
+LINKER_SETTINGS = {
+    "framework": "linkedFramework",
+    "library": "linkedLibrary",
+}
+
+VERSION_REQUIREMENTS = {
+    "upToNextMajor": "upToNextMajor(from: {})",
+    "upToNextMinor": "upToNextMinor(from: {})",
+    "branch": "branch({})",
+    "revision": "revision({})",
+}
+
+
+def string(value: str) -> str:
+    """Swift string literal of value."""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def condition(data: dict | None) -> str | None:
+    if not data:
+        return None
+    platforms = data.get("platforms") or [data["platform"]]
+    return ".when(platforms: [{}])".format(", ".join(PLATFORMS[platform] for platform in platforms))
+
+
+def labeled_condition(data: dict | None) -> str | None:
+    when = condition(data)
+    return f"condition: {when}" if when else None
+
+
+def call(name: str, *arguments: str | None) -> str:
+    return "{}({})".format(name, ", ".join(argument for argument in arguments if argument))
+
+
+def block(name: str, arguments: list[str], level: int) -> list[str]:
+    """A call with one labeled argument per line."""
+    inner = INDENT * (level + 1)
+    lines = [f"{INDENT * level}{name}("]
+    for index, argument in enumerate(arguments):
+        separator = "," if index < len(arguments) - 1 else ""
+        argument_lines = argument.split("\n")
+        lines.append(f"{inner}{argument_lines[0]}")
+        lines.extend(argument_lines[1:])
+        lines[-1] += separator
+    lines.append(f"{INDENT * level})")
+    return lines
+
+
+def array(label: str, items: list[str], level: int) -> str:
+    """`label: [...]` with one item per line, level is the indentation of the label."""
+    if not items:
+        return f"{label}: []"
+    inner = INDENT * (level + 1)
+    lines = [f"{label}: ["]
+    lines.extend(f"{inner}{item}," for item in items)
+    lines.append(f"{INDENT * level}]")
+    return "\n".join(lines)
+
+
+def render_dependency(dependency: dict) -> str:
+    version = dependency["version"]
+    url = string(dependency["url"])
+    requirement = VERSION_REQUIREMENTS.get(dependency["type"])
+    if requirement is None:
+        # "extact" in the dump
+        return f".package(url: {url}, exact: {string(version)})"
+    return f".package(url: {url}, .{requirement.format(string(version))})"
+
+
+def render_target_dependency(dependency: dict) -> str:
+    kind = dependency["type"]
+    data = dependency["data"]
+    if kind == "string":
+        return string(data)
+    if kind == "target":
+        return call(".target", f"name: {string(data)}", labeled_condition(dependency.get("condition")))
+    # "dependency", data is a SwiftTarget.PackageDependency dump
+    when = labeled_condition(data.get("condition"))
+    if data["type"] == "product":
+        return call(".product", f"name: {string(data['name'])}", f"package: {string(data['package'])}", when)
+    if data["type"] == "target":
+        return call(".target", f"name: {string(data['name'])}", when)
+    if when:
+        return call(".byName", f"name: {string(data['name'])}", when)
+    return string(data["name"])
+
+
+def render_linker_setting(setting: dict) -> str:
+    return call(
+        "." + LINKER_SETTINGS[setting["kind"]], string(setting["name"]), condition(setting.get("condition"))
+    )
+
+
+def render_target(target: dict, level: int) -> str:
+    data = target["data"]
+    name = f"name: {string(data['name'])}"
+    if target["type"] == "binary":
+        return "\n".join(block(".binaryTarget", [
+            name, f"url: {string(data['url'])}", f"checksum: {string(data['checksum'])}"
+        ], level)).lstrip()
+    arguments = [name, array("dependencies", [
+        render_target_dependency(dependency) for dependency in data.get("dependencies", [])
+    ], level + 1)]
+    if data.get("resources"):
+        arguments.append(array("resources", [
+            call("." + resource["kind"], string(resource["path"])) for resource in data["resources"]
+        ], level + 1))
+    if data.get("linker_settings"):
+        arguments.append(array("linkerSettings", [
+            render_linker_setting(setting) for setting in data["linker_settings"]
+        ], level + 1))
+    if data.get("plugins"):
+        arguments.append(array("plugins", [
+            call(".plugin", f"name: {string(plugin['name'])}", f"package: {string(plugin['package'])}")
+            for plugin in data["plugins"]
+        ], level + 1))
+    return "\n".join(block(".target", arguments, level)).lstrip()
+
+
+def render_package_swift(
+        package: dict,
+        tools_version: str = SWIFT_TOOLS_VERSION,
+        ios_version: str = IOS_VERSION,
+        macos_version: str = MACOS_VERSION
+    ) -> str:
+    """Package.swift source of a SwiftPackage.dump (the content of package.json)."""
+    platforms = [f".iOS(.{ios_version})"]
+    if package.get("macos"):
+        platforms.append(f".macOS(.{macos_version})")
+    products = [
+        "\n".join(block(".library", [
+            f"name: {string(product['name'])}",
+            f"targets: [{', '.join(string(target) for target in product['targets'])}]",
+        ], 2)).lstrip()
+        for product in package.get("products", [])
+    ]
+    arguments = [
+        f"name: {string(package['name'])}",
+        f"platforms: [{', '.join(platforms)}]",
+        array("products", products, 1),
+        array("dependencies", [render_dependency(dependency) for dependency in package.get("dependencies", [])], 1),
+        array("targets", [render_target(target, 2) for target in package.get("targets", [])], 1),
+    ]
+    lines = [
+        f"// swift-tools-version: {tools_version}",
+        "// The swift-tools-version declares the minimum version of Swift required to build this package.",
+        "",
+        "import PackageDescription",
+        "",
+    ]
+    lines.extend(block("let package = Package", arguments, 0))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,93 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+
+from .targets import SwiftTarget, BinaryTarget
+
+
+class ResolvedTarget:
+    """A SwiftTarget with its recipes scanned once: xcframeworks, dependencies and linker settings."""
+
+    __slots__ = ("name", "xcframeworks", "dependencies", "resources", "linker_settings")
+
+    name: str
+    xcframeworks: tuple[str, ...]
+    dependencies: tuple[dict | str, ...]
+    resources: tuple[dict, ...]
+    linker_settings: tuple[dict, ...]
+
+    def __init__(self, target: SwiftTarget):
+        self.name = target.name
+        self.xcframeworks = tuple(target.xcframeworks)
+        self.dependencies = tuple(target.dump_dep(self.xcframeworks))
+        self.resources = tuple(resource.dump for resource in target.resources)
+        self.linker_settings = tuple(linker.dump for linker in target.linker_settings)
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "type": "target",
+            "data": {
+                "name": self.name,
+                "dependencies": list(self.dependencies),
+                "resources": list(self.resources),
+                "linker_settings": list(self.linker_settings),
+                "plugins": []
+            }
+        }
+
+
+class PackageModel:
+    """Targets of a SwiftPackage resolved once per run.
+
+    Built on first use by SwiftPackage.model and reused by dump, the
+    checksum step and export; the BinaryTargets keep their checksum.
+    Binary targets listed in the export manifest take its version and checksum.
+    """
+
+    __slots__ = ("version", "ctx", "targets", "xcframeworks", "binary_targets", "only_binary")
+
+    version: str
+    targets: tuple[ResolvedTarget, ...]
+    xcframeworks: tuple[str, ...]
+    binary_targets: tuple[BinaryTarget, ...]
+    only_binary: bool
+
+    def __init__(self, package):
+        self.version = package.version
+        self.ctx = package.ctx
+        self.only_binary = package.only_include_binary_targets
+        self.targets = tuple(ResolvedTarget(target) for target in package.targets)
+        self.xcframeworks = tuple(xc for target in self.targets for xc in target.xcframeworks)
+        root = package.swift_package_xcframeworks
+        exported = package.export_manifest
+        binary_targets = []
+        for xc in self.xcframeworks:
+            name = splitext(basename(xc))[0]
+            # unchanged targets stay on the release they were exported to
+            previous = exported.get(name)
+            binary_targets.append(BinaryTarget(
+                name,
+                join(root, "{}.zip".format(name)),
+                "kv-swift",
+                package.__class__.__name__,
+                previous.version if previous else package.version,
+                package.ctx.checksums,
+                previous.sha256 if previous else None
+            ))
+        self.binary_targets = tuple(binary_targets)
+
+    def matches(self, package) -> bool:
+        return (
+            self.version == package.version
+            and self.ctx is package.ctx
+            and self.only_binary == package.only_include_binary_targets
+        )
+
+    @property
+    def binary_files(self) -> list[str]:
+        return [target.file for target in self.binary_targets]
+
+    @property
+    def all_targets(self) -> list[ResolvedTarget | BinaryTarget]:
+        if self.only_binary:
+            return list(self.binary_targets)
+        return [*self.targets, *self.binary_targets]
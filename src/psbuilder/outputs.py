@@ -0,0 +1,336 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, abspath, relpath
+from os import listdir, unlink, makedirs, environ, stat, replace, sep
+from functools import cache
+from threading import RLock
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+from kivy_ios.toolchain import Recipe, logger
+
+from .checksums import sha256_file
+from .staging import stage_file
+from .sync import tree_files
+from .trace import span
+from .utils import atomic_write_json, fingerprint
+
+DEFAULT_MAX_BYTES = 16 << 30
+
+RECIPE_STEPS = ("download", "extract", "build_all")
+
+# side files of a state store: sqlite WAL, shared memory and rollback journal, JsonStore journal, lock and temporary file
+STATE_FILE_SUFFIXES = ("", "-wal", "-shm", "-journal", ".journal", ".lock", ".tmp")
+
+# environment variables that change what a recipe build produces
+BUILD_ENV_VARS = (
+    "CC", "CXX", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS",
+    "DEVELOPER_DIR", "SDKROOT", "IPHONEOS_DEPLOYMENT_TARGET", "MACOSX_DEPLOYMENT_TARGET",
+)
+
+
+class RecipeOutputStore:
+    """Content-addressed store of the files recipe builds add to the dist folder.
+
+    Entries are keyed by recipe_keys(), the files of an entry live below
+    `entries/<key>/` relative to the dist folder. The least recently used
+    entries are evicted above max_bytes.
+    """
+
+    root: str
+    max_bytes: int
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = RLock()
+        self.index = {"entries": {}}
+        if exists(self.index_filename):
+            try:
+                with open(self.index_filename, encoding="utf-8") as fd:
+                    self.index = json.load(fd)
+            except ValueError:
+                print("Unable to read the recipe output index, content will be replaced.")
+
+    @property
+    def index_filename(self) -> str:
+        return join(self.root, "index.json")
+
+    def entry_path(self, key: str) -> str:
+        return join(self.root, "entries", key)
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self.index["entries"] and isdir(self.entry_path(key))
+
+    def restore(self, key: str, destination: str, exclude: set[str] | None = None) -> list[str] | None:
+        """Stage the files of entry key below destination, None if there is no intact entry.
+
+        Files whose relative path is in exclude are left alone.
+        """
+        with self.lock:
+            entry = self.index["entries"].get(key)
+            if entry is None:
+                return None
+            root = self.entry_path(key)
+            for rel, size in entry["files"]:
+                path = join(root, rel)
+                if not exists(path) or stat(path).st_size != size:
+                    logger.warning("Recipe output {} of {} is missing or corrupt, dropping it".format(key, entry["recipe"]))
+                    self._remove(key)
+                    self._save()
+                    return None
+            files = [rel for rel, size in entry["files"] if not exclude or rel not in exclude]
+            for rel in files:
+                stage_file(join(root, rel), join(destination, rel), hardlink=False)
+            entry["last_used"] = time.time()
+            self._save()
+            return files
+
+    def add(self, key: str, recipe: str, source: str, files: list[str]):
+        """Store the files (relative to source) a build of recipe produced as entry key."""
+        with self.lock:
+            root = self.entry_path(key)
+            tmp = f"{root}.tmp"
+            if exists(tmp):
+                shutil.rmtree(tmp)
+            recorded = []
+            for rel in sorted(files):
+                stage_file(join(source, rel), join(tmp, rel), hardlink=False)
+                recorded.append([rel, stat(join(tmp, rel)).st_size])
+            makedirs(tmp, exist_ok=True)
+            if exists(root):
+                shutil.rmtree(root)
+            replace(tmp, root)
+            self.index["entries"][key] = {
+                "recipe": recipe,
+                "files": recorded,
+                "size": sum(size for rel, size in recorded),
+                "created": time.time(),
+                "last_used": time.time(),
+            }
+            self.evict(keep=key)
+            self._save()
+
+    def evict(self, max_bytes: int | None = None, keep: str | None = None) -> list[str]:
+        """Remove least recently used entries until the store fits max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = []
+        with self.lock:
+            entries = self.index["entries"]
+            total = sum(entry["size"] for entry in entries.values())
+            for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+                if total <= max_bytes:
+                    break
+                if key == keep:
+                    continue
+                total -= entry["size"]
+                self._remove(key)
+                removed.append(key)
+            if removed:
+                logger.info("Evicted {} recipe outputs from {}".format(len(removed), self.root))
+                self._save()
+        return removed
+
+    def entries(self) -> dict[str, dict]:
+        with self.lock:
+            return {
+                key: {name: value for name, value in entry.items() if name != "files"}
+                for key, entry in self.index["entries"].items()
+            }
+
+    @property
+    def size(self) -> int:
+        with self.lock:
+            return sum(entry["size"] for entry in self.index["entries"].values())
+
+    def _remove(self, key: str):
+        self.index["entries"].pop(key, None)
+        if exists(self.entry_path(key)):
+            shutil.rmtree(self.entry_path(key))
+
+    def _save(self):
+        atomic_write_json(self.index_filename, self.index)
+
+
+@cache
+def xcode_version() -> str | None:
+    try:
+        return subprocess.run(["xcodebuild", "-version"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_environment(ctx) -> dict:
+    return {
+        "platforms": sorted(plat.name for plat in ctx.selected_platforms),
+        "sdk": {name: str(getattr(ctx, name, None)) for name in ("sdkver", "sdksimver")},
+        "xcode": xcode_version(),
+        "host": [platform.system(), platform.machine(), platform.mac_ver()[0]],
+        "hostpython": getattr(ctx, "hostpython_ver", None),
+        "env": {name: environ.get(name) for name in BUILD_ENV_VARS},
+    }
+
+
+def recipe_source(recipe: Recipe) -> str:
+    """Folder of the recipe (with its patches), or its module when it is a single file."""
+    recipe_dir = getattr(recipe, "recipe_dir", None)
+    if recipe_dir and exists(recipe_dir):
+        return recipe_dir
+    module_file = sys.modules[recipe.__class__.__module__].__file__
+    return dirname(module_file) if basename(module_file) == "__init__.py" else module_file
+
+
+def source_fingerprint(path: str) -> str:
+    files = tree_files(path, lambda rel: "__pycache__" in rel.split(sep))
+    return fingerprint([[rel, sha256_file(join(path, rel) if rel else path)] for rel in sorted(files)])
+
+
+def recipe_keys(recipes: list[Recipe], ctx) -> dict[str, str]:
+    """Store keys of recipes given in build order, by name.
+
+    The key covers the recipe version, url and source, the build environment
+    and the keys of the dependencies, so a rebuilt dependency changes it.
+    Recipes built from a custom folder (`<NAME>_DIR`) get no key, nor does
+    anything built against them: their source is not part of any key.
+    """
+    environment = build_environment(ctx)
+    keys: dict[str, str] = {}
+    uncacheable: set[str] = set()
+    for recipe in recipes:
+        if getattr(recipe, "custom_dir", None) or uncacheable.intersection([*recipe.depends, *recipe.optional_depends]):
+            uncacheable.add(recipe.name)
+            continue
+        keys[recipe.name] = fingerprint({
+            "recipe": recipe.name,
+            "version": str(getattr(recipe, "version", "")),
+            "url": getattr(recipe, "url", None),
+            "source": source_fingerprint(recipe_source(recipe)),
+            "depends": {name: keys.get(name, name) for name in recipe.depends},
+            "optional_depends": {name: keys[name] for name in recipe.optional_depends if name in keys},
+            "environment": environment,
+        })
+    return keys
+
+
+def state_files(ctx) -> set[str]:
+    """Paths, relative to the dist folder, of the recipe state store and its side files.
+
+    Covers the store ctx.state actually uses and both default names, state.db
+    (JsonStore, the file migrated from) and state.sqlite.
+    """
+    names = {"state.db", "state.sqlite"}
+    filename = getattr(ctx.state, "filename", None)
+    if filename:
+        names.add(relpath(abspath(filename), abspath(ctx.dist_dir)))
+    return {f"{name}{suffix}" for name in names for suffix in STATE_FILE_SUFFIXES}
+
+
+def cacheable(recipe: Recipe, ctx) -> bool:
+    """Recipes already built and custom recipe folders are left to recipe.execute()."""
+    return not getattr(recipe, "custom_dir", None) and "{}.build_all".format(recipe.name) not in ctx.state
+
+
+def restore_recipe(recipe: Recipe, ctx, key: str) -> bool:
+    """Restore the outputs of recipe from ctx.recipe_outputs and mark it built."""
+    store: RecipeOutputStore | None = ctx.recipe_outputs
+    if store is None or not cacheable(recipe, ctx) or key not in store:
+        return False
+    with span("restore_recipe", recipe.name):
+        # entries stored before state files were excluded may still hold them
+        files = store.restore(key, ctx.dist_dir, state_files(ctx))
+    if files is None:
+        return False
+    with ctx.state.batch():
+        for step in RECIPE_STEPS:
+            ctx.state["{}.{}".format(recipe.name, step)] = True
+    logger.info("Restored {} ({} files) from {}".format(recipe.name, len(files), store.root))
+    return True
+
+
+def restore_recipes(recipes: list[Recipe], ctx, keys: dict[str, str]) -> set[str]:
+    """Restore the stored recipes (given in build order) whose dependencies are built, return their names."""
+    restored = set()
+    for recipe in recipes:
+        built = all("{}.build_all".format(name) in ctx.state for name in recipe.depends if name in keys)
+        if recipe.name in keys and built and restore_recipe(recipe, ctx, keys[recipe.name]):
+            restored.add(recipe.name)
+    return restored
+
+
+def execute_recipe(recipe: Recipe, ctx, key: str):
+    """recipe.execute(), restoring its outputs instead when they are stored and storing them otherwise.
+
+    The outputs are the files of the dist folder the build added or changed,
+    so recipes must be built one at a time.
+    """
+    store: RecipeOutputStore | None = ctx.recipe_outputs
+    if restore_recipe(recipe, ctx, key):
+        return
+    if store is None or not cacheable(recipe, ctx):
+        recipe.execute()
+        return
+    before = dist_files(ctx)
+    recipe.execute()
+    store_outputs(recipe.name, ctx, key, before)
+
+
+def dist_files(ctx) -> dict[str, object]:
+    """stat results of the files of the dist folder, without the state store."""
+    return tree_files(ctx.dist_dir, state_files(ctx).__contains__)
+
+
+def store_outputs(name: str, ctx, key: str, before: dict[str, object]):
+    """Store the files of the dist folder added or changed since before as the outputs of recipe name."""
+    store: RecipeOutputStore = ctx.recipe_outputs
+    after = dist_files(ctx)
+    changed = [
+        rel for rel, file_stat in after.items()
+        if rel not in before or (before[rel].st_size, before[rel].st_mtime_ns, before[rel].st_ino)
+        != (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+    ]
+    with span("store_recipe", name):
+        store.add(key, name, ctx.dist_dir, changed)
+    logger.info("Stored {} output files of {} in {}".format(len(changed), name, store.root))
+
+
+class OutputRecorder:
+    """Stores the outputs of recipes built by other processes (see build_recipes_concurrently).
+
+    The dist folder is listed when the first unit of a recipe starts and the
+    files changed by the time its last unit finished are stored. Recipes whose
+    build overlapped with the build of another one are not stored: the files
+    of the two can not be told apart.
+    """
+
+    keys: dict[str, str]
+
+    def __init__(self, ctx, keys: dict[str, str]):
+        self.ctx = ctx
+        self.keys = keys
+        self.lock = RLock()
+        # None for recipes whose outputs are not stored
+        self.before: dict[str, dict[str, object] | None] = {}
+        self.overlapped: set[str] = set()
+
+    def start(self, name: str):
+        with self.lock:
+            if name in self.before:
+                return
+            if self.before:
+                self.overlapped.update([*self.before, name])
+            stored = name in self.keys and "{}.build_all".format(name) not in self.ctx.state
+            self.before[name] = dist_files(self.ctx) if stored else None
+
+    def finish(self, name: str, succeeded: bool = True):
+        """The last unit of recipe name finished."""
+        with self.lock:
+            before = self.before.pop(name, None)
+            if before is None or not succeeded:
+                return
+            if name in self.overlapped:
+                logger.info("{} was built alongside other recipes, its outputs are not stored".format(name))
+                return
+            store_outputs(name, self.ctx, self.keys[name], before)
@@ -1,4 +1,4 @@
-from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, getsize
 from os import listdir, unlink, makedirs, environ, chdir, getcwd, walk
 import sh
 import shutil
@@ -7,11 +7,23 @@ import importlib
 import sys
 from .context import PackageContext
 from .targets import BinaryTarget, SwiftTarget
-from .utils import ChangeDir, ensure_dir, cache_execution, zip_to_path
+from .utils import ensure_dir, cache_execution, zip_to_path, tree_manifest, fingerprint
+from .archive import zip_tree, ZipWriter, CompressionPolicy, DEFAULT_COMPRESSION, read_checksum_file
+from .checksums import tree_fingerprint, sha256_file
+from .exports import ExportManifest, EXPORT_MANIFEST
+from .sync import SyncReport, sync_tree, remove_path
+from .staging import StageReport, stage_file
+from .trace import span, traced, add_bytes
+from .manifest import render_package_swift, SWIFT_TOOLS_VERSION, IOS_VERSION, MACOS_VERSION
+from .registry import registry
+from .model import PackageModel, ResolvedTarget
+from .precompile import DEFAULT_PRUNE_PATTERNS, TreeStats, matches, compile_tree, compiled_source, savings_table, target_python
+from kivy_ios.toolchain import logger
 from sh import Command
-from typing import Generator
+from typing import Generator, Callable
 import subprocess
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
 def copy_package_content(cls: "SwiftPackage"):
@@ -91,6 +103,21 @@ class SwiftPackage:
     
     repo_url: str | None = None
     
+    # EXPERIMENTAL: render Package.swift in process (or PSBUILDER_PACKAGE_SWIFT=experimental)
+    # instead of with SwiftPackageWriter. Its output is not verified to match the
+    # writer's yet, see manifest.py and tests/test_manifest.py
+    experimental_package_swift_renderer: bool = False
+    swift_tools_version: str = SWIFT_TOOLS_VERSION
+    ios_version: str = IOS_VERSION
+    macos_version: str = MACOS_VERSION
+    
+    # per pattern deflate levels of the exported zips, see CompressionPolicy
+    archive_compression: CompressionPolicy = DEFAULT_COMPRESSION
+    
+    # store hard linked files of an xcframework once, as symlinks (see ZipWriter),
+    # the headers inject_headers links into every slice are archived once
+    dedup_archive_links: bool = True
+    
     @property
     def name(self):
         return self.__class__.__name__
@@ -101,14 +128,26 @@ class SwiftPackage:
             for recipe in target.recipes:
                 recipe.init_with_ctx(ctx)
     
+    @traced
     @cache_execution
     def execute(self):
+        # the manifest may have changed since a previous run of this package
+        self.__dict__.pop("_export_manifest", None)
+        self.reset_model()
         print(self.get_binary_targets)
         ensure_dir(self.swift_package_dir)
-        self.pre_package()
-        self.copy_files_to_package()
+        with span("pre_package"):
+            self.pre_package()
+        # the checksum index is written once per export, not per hashed file
+        with self.ctx.checksums.batch():
+            self.copy_files_to_package()
         self.export_package()
-        self.post_package()
+        with span("post_package"):
+            self.post_package()
+    
+    def downloads(self) -> list[tuple[str, str | None]]:
+        """(url, sha256) of the artifacts execute fetches through ctx.artifacts."""
+        return []
     
     def pre_zip_dists(self):
         pass
@@ -119,12 +158,28 @@ class SwiftPackage:
     def pre_package(self):
         pass
     
+    def map_xcframeworks(self, function, xcframeworks: list[str]) -> list:
+        """function(xc) for each of xcframeworks, in parallel."""
+        with ThreadPoolExecutor(max_workers=max(len(xcframeworks), 1)) as executor:
+            return list(executor.map(function, xcframeworks))
+    
     def post_package(self):
         pass
         
     def generate_package_swift(self) -> str:
-        return str(sh.SwiftPackageWriter("create", join(self.swift_package_dir, "package.json")))
+        package_json = join(self.swift_package_dir, "package.json")
+        renderer = environ.get("PSBUILDER_PACKAGE_SWIFT", "experimental" if self.experimental_package_swift_renderer else "writer")
+        if renderer != "experimental":
+            return str(sh.SwiftPackageWriter("create", package_json))
+        logger.warning("Rendering Package.swift of {} with the experimental in-process renderer".format(self.name))
+        if exists(package_json):
+            with open(package_json) as fp:
+                dump = json.load(fp)
+        else:
+            dump = self.dump
+        return render_package_swift(dump, self.swift_tools_version, self.ios_version, self.macos_version)
     
+    @traced
     def write_package_swift(self, dir: str):
         with open(join(dir, "Package.swift"), "w") as fp:
             fp.write(self.generate_package_swift())
@@ -132,10 +187,11 @@ class SwiftPackage:
     def copy_files_to_package(self):
         self.zip_xc_frameworks_to_export()
         self.zip_dist_files_to_export()
-        with open(join(self.swift_package_dir, "package.json"), "w") as fp:
+        with span("dump"), open(join(self.swift_package_dir, "package.json"), "w") as fp:
             json.dump(self.dump, fp)
         
     
+    @traced
     def export_package(self):
         export_dir = join(self.swift_package_dir, "export")
         ensure_dir(export_dir)
@@ -161,46 +217,37 @@ class SwiftPackage:
         self.write_package_swift(root)        
         
         
+    @traced
     def create_from_repo(self, url: str, working_dir: str):
-        with ChangeDir(working_dir):
-            self.clone_url(url)
-            self.write_package_swift(basename(url))
+        self.clone_url(url, working_dir=working_dir)
+        self.write_package_swift(join(working_dir, basename(url)))
     
     @cache_execution
-    def clone_url(self, url: str, **kwargs):
-        sh.git("clone", url)
+    def clone_url(self, url: str, working_dir: str | None = None, **kwargs):
+        sh.git("clone", url, _cwd=working_dir)
     
     @property
-    def all_targets(self) -> list[SwiftTarget | BinaryTarget]:
-        output: list[SwiftTarget | BinaryTarget] = []
-        if not self.only_include_binary_targets:
-            output.extend(self.targets)
-        for src in self.get_binary_targets:
-            output.append(
-                BinaryTarget(
-                    splitext(basename(src))[0],
-                    src,
-                    "kv-swift",
-                    self.__class__.__name__,
-                    self.version
-                )
-            )
-        return output
+    def model(self) -> PackageModel:
+        """The resolved targets, built once (again after version or ctx changed)."""
+        model: PackageModel | None = self.__dict__.get("_model")
+        if model is None or not model.matches(self):
+            model = PackageModel(self)
+            self._model = model
+        return model
+    
+    def reset_model(self):
+        self.__dict__.pop("_model", None)
+    
+    @property
+    def all_targets(self) -> list[ResolvedTarget | BinaryTarget]:
+        return self.model.all_targets
     
     def get_all_xcframeworks(self):
-        for target in self.targets:
-            for xc in target.xcframeworks:
-                yield xc
+        yield from self.model.xcframeworks
     
     @property
     def get_binary_targets(self) -> list[str]:
-        bin_targets: list[str] = []
-        root = self.swift_package_xcframeworks
-        for xc in self.get_all_xcframeworks():
-            fn, ext = splitext(basename(xc))
-            bin_targets.append(join(root, f"{fn}.zip"))
-        
-        return bin_targets
+        return self.model.binary_files
     
     @property
     def get_dependencies(self) -> list[Dependency]:
@@ -222,6 +269,20 @@ class SwiftPackage:
             pass
         return deps
     
+    @property
+    def package_dependencies(self) -> set[str]:
+        """Names of the swift packages this package depends on."""
+        names: set[str] = set()
+        for dep in self.get_dependencies:
+            name = basename(dep.url.rstrip("/"))
+            names.add(name.removesuffix(".git"))
+        for target in self.targets:
+            for dep in target.dependencies:
+                if isinstance(dep, SwiftTarget.PackageDependency) and dep.package:
+                    names.add(dep.package)
+        names.discard(self.name)
+        return names
+    
     @property
     def swift_package_dir(self) -> str:
         return join(self.ctx.swift_packages, self.__class__.__name__)
@@ -230,6 +291,16 @@ class SwiftPackage:
     def swift_package_xcframeworks(self) -> str:
         return join(self.swift_package_dir, "xcframeworks")
     
+    @property
+    def export_manifest(self) -> ExportManifest:
+        """The export manifest, read once per execute (again after ctx changed)."""
+        filename = join(self.swift_package_dir, EXPORT_MANIFEST)
+        manifest: ExportManifest | None = self.__dict__.get("_export_manifest")
+        if manifest is None or manifest.filename != filename:
+            manifest = ExportManifest(filename)
+            self._export_manifest = manifest
+        return manifest
+    
     @property
     def swift_package_site(self) -> str:
         return join(self.swift_package_dir, "site-packages")
@@ -250,49 +321,113 @@ class SwiftPackage:
             for recipe in target.recipes:
                 yield recipe
     
+    def get_dist_libraries(self) -> Generator[tuple[str, str], None, None]:
+        sdks = []
+        for plat in self.ctx.supported_platforms:
+            if plat.sdk not in sdks:
+                sdks.append(plat.sdk)
+        for sdk in sdks:
+            for recipe in self.get_all_targets_recipes():
+                for lib in recipe._get_all_libraries():
+                    yield sdk, join(self.ctx.dist_dir, "lib", sdk, basename(lib))
+    
+    def fingerprint_inputs(self, step: str, *args) -> dict:
+        if step == "clone_url":
+            return {"args": args}
+        inputs = {
+            "version": self.version,
+            "recipes": {recipe.name: str(recipe.version) for recipe in self.get_all_targets_recipes()},
+            # by content, a touched but unchanged package module does not rerun every step
+            "source": sha256_file(sys.modules[self.__class__.__module__].__file__),
+            "archive": self.archive_options,
+        }
+        if step in ("execute", "zip_xc_frameworks_to_export"):
+            inputs["xcframeworks"] = {
+                basename(xc): tree_manifest(xc) for xc in self.get_all_xcframeworks()
+            }
+        if step in ("execute", "zip_dist_files_to_export"):
+            inputs["libraries"] = [
+                [sdk, tree_manifest(lib)] for sdk, lib in self.get_dist_libraries()
+            ]
+        return inputs
+    
+    @property
+    def archive_options(self) -> dict:
+        return {"compression": self.archive_compression.dump, "dedup_links": self.dedup_archive_links}
+    
+    def fingerprint(self, step: str, *args) -> str:
+        return fingerprint(self.fingerprint_inputs(step, *args))
+    
+    @traced
     @cache_execution
     def zip_dist_files_to_export(self):
         root = join(self.swift_package_dir, "dist_files")
-        has_dist_files = False
-        platforms_to_build = dict()
-        for plat in self.ctx.supported_platforms:
-            if plat.sdk in platforms_to_build:
+        report = StageReport()
+        staged: set[str] = set()
+        for sdk, static_fn in self.get_dist_libraries():
+            dst = join(root, sdk, basename(static_fn))
+            if dst in staged:
                 continue
-            platforms_to_build[plat.sdk] = plat
-        
-        for plat in platforms_to_build.values():
-            plat_root = join(root, plat.sdk)
-            for recipe in self.get_all_targets_recipes():
-                recipe_root = join(plat_root, recipe.name)
-                ensure_dir(plat_root)
-                #with ChangeDir(plat_root):
-                for lib in recipe._get_all_libraries():
-                    has_dist_files = True
-                    library_fn = basename(lib)
-                    library_name = library_fn.split(".a")[0]
-                    static_fn = join(self.ctx.dist_dir, "lib", plat.sdk, library_fn)
-                    try:
-                        shutil.copy(static_fn, join(plat_root))
-                    except: pass
-        if has_dist_files:
-            with ChangeDir(self.swift_package_dir):
-                zip_to_path("dist_files", "./")
+            if not exists(static_fn):
+                report.missing.append(static_fn)
+                continue
+            stage_file(static_fn, dst, report)
+            staged.add(dst)
+        if report.missing:
+            logger.warning("Missing static libraries for {}:\n  {}".format(
+                self.name, "\n  ".join(report.missing)))
+        if exists(root):
+            for sdk in listdir(root):
+                for fn in listdir(join(root, sdk)):
+                    if join(root, sdk, fn) not in staged:
+                        unlink(join(root, sdk, fn))
+        logger.info("Staged dist files of {}: {}".format(self.name, report))
+        if staged:
+            with span("zip_dist_files", bytes_staged=report.bytes_staged) as zip_span:
+                zip_span.add_bytes(getsize(zip_to_path(root, self.swift_package_dir, self.archive_compression)))
         
         
+    @traced
     @cache_execution
     def zip_xc_frameworks_to_export(self):
-        last_path = getcwd()
         xc_export_root = self.swift_package_xcframeworks
         ensure_dir(xc_export_root)
-        self.pre_zip_xc_frameworks()
+        with span("pre_zip_xc_frameworks"):
+            self.pre_zip_xc_frameworks()
+        manifest = self.export_manifest
+        exported = {}
+        upload = []
         for xc in self.get_all_xcframeworks():
-            chdir(dirname(xc))
-            xc_basename = basename(xc)
-            fn = splitext(xc_basename)[0]
-            zip_name = f"{fn}.zip"
-            zipfile = join(xc_export_root, f"{fn}.zip")
-            sh.zip("-r", zipfile, xc_basename)
-        chdir(last_path)
+            fn = splitext(basename(xc))[0]
+            zip_path = join(xc_export_root, f"{fn}.zip")
+            with span("fingerprint_xcframework", xcframework=fn):
+                content = fingerprint([tree_fingerprint(xc, self.ctx.checksums), self.archive_options])
+            previous = manifest.get(fn)
+            if not manifest.changed(fn, content) and exists(zip_path):
+                logger.info("{} is unchanged since {}, keeping its release".format(fn, previous.version))
+                exported[fn] = previous
+                continue
+            with span("zip_xcframework", xcframework=fn) as zip_span:
+                zip_span.add_bytes(getsize(zip_tree(
+                    xc, zip_path, policy=self.archive_compression, dedup_links=self.dedup_archive_links)))
+            sha256 = read_checksum_file(zip_path)
+            if previous and previous.fingerprint == content and previous.sha256 == sha256:
+                # the zip was missing and came out the same
+                exported[fn] = previous
+                continue
+            manifest.record(fn, basename(zip_path), content, self.version, sha256)
+            exported[fn] = manifest.get(fn)
+            upload.append(basename(zip_path))
+        # forget the targets the package no longer has
+        manifest.targets = exported
+        # unchanged targets were published by an earlier export, even to this version
+        manifest.upload = upload
+        manifest.sync()
+        if manifest.upload:
+            logger.info("Binary targets of {} to upload to release {}:\n  {}".format(
+                self.name, self.version, "\n  ".join(manifest.upload)))
+        # checksums of the binary targets are stale now
+        self.reset_model()
         
     
             
@@ -307,8 +442,8 @@ class SwiftPackage:
         else:
             version = None
 
-        mod = importlib.import_module(f"psbuilder.packages.{name}")
-        package: SwiftPackage = mod.package
+        # KeyError for unknown packages, third-party ones come from entry points
+        package: SwiftPackage = registry.load(name)
         #recipe.recipe_dir = join(ctx.root_dir, "packages", name)
 
         #recipe.init_after_import(ctx)
@@ -324,10 +459,8 @@ class SwiftPackage:
         @cache_execution decorator to log an action and its time of occurrence,
         but it needs to be done manually in recipes.
         """
-        key_time = "{}.at".format(key)
-        self.ctx.state[key] = value
+        self.ctx.packages_state.set(key, value)
         now_str = str(datetime.utcnow())
-        self.ctx.state[key_time] = now_str
         print("New State: {} at {}".format(key, now_str))
 
 PackageDependency = SwiftPackage.Dependency
@@ -336,28 +469,111 @@ PackageProduct = SwiftPackage.Product
 class PythonSwiftPackage(SwiftPackage):
     site_package_targets: list[str]
     
+    # copy site_package_targets into swift_package_site before zipping,
+    # instead of streaming them into site-packages.zip
+    stage_site_packages: bool = False
+    
+    # compile the staged site-packages to .pyc files for ctx.hostpython_ver
+    # and leave out site_package_prune_patterns (implies staging)
+    precompile_site_packages: bool = False
+    # ship only the .pyc files of precompiled site-packages
+    drop_py_sources: bool = False
+    site_package_prune_patterns: list[str] = DEFAULT_PRUNE_PATTERNS
+    
+    def fingerprint_inputs(self, step: str, *args) -> dict:
+        inputs = super().fingerprint_inputs(step, *args)
+        if step == "execute":
+            inputs["site_packages"] = {
+                target: tree_manifest(join(self.ctx.site_packages_root, target))
+                for target in self.site_package_targets
+            }
+            inputs["site_packages_options"] = [
+                self.stage_site_packages, self.precompile_site_packages,
+                self.drop_py_sources, self.site_package_prune_patterns
+            ]
+        return inputs
+    
     def copy_files_to_package(self):
         super().copy_files_to_package()
-        self.copy_site_package_folder()
-        self.zip_site_packages()
+        # streaming is the default, the incremental sync only runs for staged site-packages
+        if self.stage_site_packages or self.precompile_site_packages:
+            self.copy_site_package_folder()
+            if self.precompile_site_packages:
+                self.precompile_site_package_folder()
+            self.zip_site_packages()
+        else:
+            self.stream_site_packages()
 
-    def copy_site_package_folder(self):
+    @traced
+    def copy_site_package_folder(self) -> SyncReport:
         site_packages_dir = self.ctx.site_packages_root
         target_root = self.swift_package_site
         ensure_dir(site_packages_dir)
+        ensure_dir(target_root)
         
+        report = SyncReport()
+        synced = set()
+        exclude = None
+        preserve = None
         for target in self.site_package_targets:
             src = join(site_packages_dir, target)
+            if self.precompile_site_packages:
+                patterns = self.site_package_prune_patterns
+                exclude = lambda rel, target=target: matches(f"{target}/{rel}", patterns)
+                # compiled next to their sources by precompile_site_package_folder
+                preserve = lambda rel, src=src: rel.endswith(".pyc") and exists(join(src, rel[:-1]))
             if exists(src):
-                if isdir(src):
-                    shutil.copytree(src, join(target_root, target))
-                else:
-                    shutil.copy(src, target_root)
+                sync_tree(src, join(target_root, target), report=report, exclude=exclude, preserve=preserve)
+                synced.add(target)
+        for entry in listdir(target_root):
+            if entry not in synced:
+                remove_path(join(target_root, entry), report)
+        logger.info("Synced site-packages of {}: {}".format(self.name, report))
+        return report
                     
+    @traced
+    def precompile_site_package_folder(self):
+        site_packages_dir = self.ctx.site_packages_root
+        target_root = self.swift_package_site
+        before = {
+            target: TreeStats.of(join(site_packages_dir, target))
+            for target in self.site_package_targets
+        }
+        hostpython = getattr(self.ctx, "hostpython", None) or join(self.ctx.dist_dir, "hostpython3", "bin", "python")
+        compiled = compile_tree(target_root, target_python(self.ctx.hostpython_ver, hostpython))
+        logger.info("Compiled {} changed site-packages sources of {}".format(compiled, self.name))
+        after = {
+            target: TreeStats.of(join(target_root, target), self.site_package_exclude)
+            for target in self.site_package_targets
+        }
+        logger.info("Precompiled site-packages of {}:\n{}".format(self.name, savings_table(before, after)))
+    
+    @property
+    def site_package_exclude(self) -> Callable[[str], bool] | None:
+        # the sources stay in the synced folder, so warm runs neither copy nor compile them again
+        return compiled_source if self.precompile_site_packages and self.drop_py_sources else None
+
+    @traced
     def zip_site_packages(self):
-        with ChangeDir(self.swift_package_dir):
-            #sh.zip("-r", "site-packages", "site-packages.zip")
-            zip_to_path("site-packages", "./")
+        zip_to_path(self.swift_package_site, self.swift_package_dir, self.archive_compression, self.site_package_exclude)
+    
+    @traced
+    def stream_site_packages(self) -> str:
+        site_packages_dir = self.ctx.site_packages_root
+        site_zip = join(self.swift_package_dir, "site-packages.zip")
+        ensure_dir(site_packages_dir)
+        if exists(self.swift_package_site):
+            # left over from a staged run
+            shutil.rmtree(self.swift_package_site)
+        with ZipWriter(site_zip, policy=self.archive_compression) as writer:
+            writer.add_dir("site-packages", site_packages_dir)
+            for target in self.site_package_targets:
+                src = join(site_packages_dir, target)
+                if exists(src):
+                    writer.add_tree(src, site_packages_dir, "site-packages")
+        logger.info("Streamed {} bytes of site-packages into {}".format(writer.bytes_in, site_zip))
+        add_bytes(writer.bytes_in)
+        return site_zip
             
     
     
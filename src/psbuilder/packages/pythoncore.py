@@ -1,4 +1,7 @@
 from psbuilder.targets import SwiftTarget
+from psbuilder.trace import traced, span
+from psbuilder.headers import inject_headers
+from psbuilder.sync import write_file
 from psbuilder.package import SwiftPackage, CythonSwiftPackage
 
 from kivy_ios.toolchain import Recipe
@@ -9,8 +12,6 @@ import plistlib
 import shutil
 import os
 
-from urllib.request import urlretrieve
-
 PackageDependency = SwiftTarget.PackageDependency
 
 class PythonCoreTarget(SwiftTarget):
@@ -60,6 +61,11 @@ class PythonCore(SwiftPackage):
     #include_pythonswiftlink = True
     py_swift_version = "311.0.3"
     
+    # expected SHA-256 of release assets, by asset name
+    release_checksums: dict[str, str] = {}
+    
+    release_assets = ["Python.zip", "macos-python-stdlib.zip"]
+    
     products = [
         SwiftPackage.Product("PythonCore", [
             "PythonCore", "libpython3.11", 
@@ -83,11 +89,34 @@ class PythonCore(SwiftPackage):
             "ios-arm64_x86_64-simulator"
         ]
     
+    def release_asset_url(self, asset: str) -> str:
+        return f"https://github.com/Py-Swift/PythonCore/releases/download/{self.py_swift_version}/{asset}"
+    
+    def fetch_release_asset(self, asset: str) -> str:
+        with span("fetch_release_asset", asset=asset):
+            return self.ctx.artifacts.fetch(self.release_asset_url(asset), self.release_checksums.get(asset))
+    
+    def downloads(self) -> list[tuple[str, str | None]]:
+        return [
+            (self.release_asset_url(asset), self.release_checksums.get(asset))
+            for asset in self.release_assets
+        ]
+    
+    def pre_package(self):
+        # both assets are needed later on, download them side by side up front
+        with span("prefetch_release_assets"):
+            self.ctx.artifacts.fetch_many(self.downloads())
+    
     def process_plist(self, plist: str, header_fn: str):
         with open(plist, "rb") as rp:
             plist_data: dict = plistlib.load(rp)
         
-        available_libraries: list = plist_data.get("AvailableLibraries", [])
+        # the macos slice may have been added by an earlier run
+        available_libraries: list = [
+            lib for lib in plist_data.get("AvailableLibraries", [])
+            if lib.get("LibraryIdentifier") != "macos-arm64_x86_64"
+        ]
+        plist_data["AvailableLibraries"] = available_libraries
         available_libraries.append(
             {
                 "HeadersPath": header_fn,
@@ -106,31 +135,25 @@ class PythonCore(SwiftPackage):
                 plistlib.dumps(plist_data)
             )
     
+    @traced
     def process_xc(self, xc: str):
         py_headers_fn = "python3.11"
         py_headers = join(self.ctx.dist_dir, "root", "python3", "include", py_headers_fn)
         
-        with open(join(py_headers, "module.modulemap"), "w") as fp:
-            fp.write(self.module_map)
+        write_file(join(py_headers, "module.modulemap"), self.module_map)
             
-        for plat in self.xc_platforms:
-            xc_plat = join(xc, plat)
-            xc_target = join(xc_plat, py_headers_fn)
-            if os.path.exists(xc_target): continue
-            shutil.copytree(
-                py_headers,
-                xc_target
-            )
+        inject_headers(py_headers, [xc], self.xc_platforms)
         
         self.process_plist(
             join(xc,"Info.plist"),
             py_headers_fn
         )
-        python_zip = join(xc, "Python.zip")
-        python_zip = urlretrieve(f"https://github.com/Py-Swift/PythonCore/releases/download/{self.py_swift_version}/Python.zip", python_zip)[0]
-        print(f"Downloaded Python.zip to {python_zip}")
+        python_zip = self.fetch_release_asset("Python.zip")
         unpack_dir = join(xc, "Python.xcframework")
-        shutil.unpack_archive(python_zip, xc)
+        shutil.unpack_archive(python_zip, xc, "zip")
+        if exists(join(xc, "macos-arm64_x86_64")):
+            # left by an earlier run
+            shutil.rmtree(join(xc, "macos-arm64_x86_64"))
         shutil.copytree(
             join(unpack_dir, "macos-arm64_x86_64"),
             join(xc, "macos-arm64_x86_64"),
@@ -139,14 +162,11 @@ class PythonCore(SwiftPackage):
             join(xc, "macos-arm64_x86_64", "Headers"),
             join(xc, "macos-arm64_x86_64", "python3.11")
         )
-        
-        os.remove(python_zip)
     
     def pre_zip_xc_frameworks(self):
-        for xc in self.get_all_xcframeworks():
-            xc_name = basename(xc)
-            if xc_name.startswith("libpython"):
-                self.process_xc(xc)
+        self.map_xcframeworks(self.process_xc, [
+            xc for xc in self.get_all_xcframeworks() if basename(xc).startswith("libpython")
+        ])
         return super().pre_zip_xc_frameworks()
     
     def post_package(self):
@@ -167,8 +187,11 @@ class PythonCore(SwiftPackage):
         if exists(to_remove):
             shutil.rmtree(to_remove)
             
-        python_zip = join(export_dir, "macos-python-stdlib.zip")
-        python_zip = urlretrieve(f"https://github.com/Py-Swift/PythonCore/releases/download/{self.py_swift_version}/macos-python-stdlib.zip", python_zip)[0]
+        self.ctx.artifacts.copy_to(
+            self.release_asset_url("macos-python-stdlib.zip"),
+            join(export_dir, "macos-python-stdlib.zip"),
+            self.release_checksums.get("macos-python-stdlib.zip")
+        )
 
     module_map = """
 module Python [extern_c] {
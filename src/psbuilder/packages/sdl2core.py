@@ -1,4 +1,7 @@
 from psbuilder.targets import SwiftTarget
+from psbuilder.trace import traced
+from psbuilder.headers import inject_headers
+from psbuilder.sync import write_file
 from psbuilder.package import SwiftPackage
 
 from kivy_ios.toolchain import Recipe
@@ -68,22 +71,14 @@ class SDL2Core(SwiftPackage):
                 plistlib.dumps(plist_data)
             )
         
+    @traced
     def process_xc(self, xc: str):
         sdl_header_fn = "sdl2"
         sdl_headers = join(self.ctx.dist_dir, "include", "common", sdl_header_fn)
         
-        with open(join(sdl_headers, "module.modulemap"), "w") as fp:
-            fp.write(self.module_map)
+        write_file(join(sdl_headers, "module.modulemap"), self.module_map)
             
-        for plat in self.xc_platforms:
-            xc_plat = join(xc, plat)
-            xc_target = join(xc_plat, sdl_header_fn)
-            if os.path.exists(xc_target): continue
-            
-            shutil.copytree(
-                sdl_headers,
-                xc_target
-            )
+        inject_headers(sdl_headers, [xc], self.xc_platforms)
         
         self.process_plist(
             join(xc,"Info.plist"),
@@ -91,10 +86,9 @@ class SDL2Core(SwiftPackage):
         )
         
     def pre_zip_xc_frameworks(self):
-        for xc in self.get_all_xcframeworks():
-            xc_name = basename(xc)
-            if xc_name == "libSDL2":
-                self.process_xc(xc)
+        self.map_xcframeworks(self.process_xc, [
+            xc for xc in self.get_all_xcframeworks() if basename(xc) == "libSDL2"
+        ])
         return super().pre_zip_xc_frameworks()
 
     module_map = """
@@ -0,0 +1,203 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, getsize
+import json
+
+from kivy_ios.toolchain import Recipe
+
+from .package import SwiftPackage, PythonSwiftPackage
+from .outputs import RECIPE_STEPS, recipe_keys, cacheable
+from .precompile import TreeStats
+from .scheduler import topological_order
+from .utils import step_status
+
+
+def tree_size(paths) -> int:
+    return sum(TreeStats.of(path).size for path in paths)
+
+
+class RecipePlan:
+    """What building a recipe would do, from the recipe state of ctx.state."""
+
+    name: str
+    version: str
+    steps: dict[str, str]
+    depends: list[str]
+    archive: str | None
+    archive_bytes: int | None
+    output_bytes: int
+    restorable: bool
+
+    def __init__(self, recipe: Recipe, ctx, key: str | None = None):
+        self.name = recipe.name
+        self.version = str(getattr(recipe, "version", ""))
+        self.depends = list(recipe.depends)
+        self.steps = {
+            step: "cached" if "{}.{}".format(recipe.name, step) in ctx.state else "run"
+            for step in RECIPE_STEPS
+        }
+        if getattr(recipe, "custom_dir", None):
+            # execute() drops the recipe state of custom recipe folders
+            self.steps = {step: "run" for step in RECIPE_STEPS}
+        try:
+            self.archive = recipe.archive_fn if getattr(recipe, "url", None) else None
+        except (AttributeError, TypeError):
+            self.archive = None
+        self.archive_bytes = getsize(self.archive) if self.archive and exists(self.archive) else None
+        self.output_bytes = tree_size(getattr(recipe, "dist_xcframeworks", []))
+        store = ctx.recipe_outputs
+        self.restorable = bool(key and store is not None and cacheable(recipe, ctx) and key in store)
+
+    @property
+    def action(self) -> str:
+        if self.steps["build_all"] == "cached":
+            return "cached"
+        return "restore" if self.restorable else "build"
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "action": self.action,
+            "steps": self.steps,
+            "depends": self.depends,
+            "archive": self.archive,
+            "archive_cached": self.archive_bytes is not None,
+            "archive_bytes": self.archive_bytes,
+            # size of the xcframeworks of the previous build, if any
+            "output_bytes": self.output_bytes,
+        }
+
+
+class PackagePlan:
+    """What executing a package would do, from the cache_execution state and fingerprints."""
+
+    name: str
+    steps: dict[str, str]
+    reasons: list[str]
+    depends: list[str]
+    downloads: list[dict]
+    input_bytes: int
+    previous_bytes: int
+
+    def __init__(self, package: SwiftPackage, rebuilt_recipes: set[str], packages: set[str]):
+        ctx = package.ctx
+        self.name = package.name
+        self.depends = sorted(package.package_dependencies & packages)
+        self.steps = {"execute": step_status(package, "execute")}
+        for step in ("zip_xc_frameworks_to_export", "zip_dist_files_to_export"):
+            self.steps[step] = step_status(package, step)
+        if package.repo_url:
+            self.steps["clone_url"] = step_status(package, "clone_url", package.repo_url)
+        self.reasons = []
+        recipes = sorted({recipe.name for recipe in package.get_all_targets_recipes()} & rebuilt_recipes)
+        if recipes:
+            self.reasons.append("recipes rebuilt: {}".format(", ".join(recipes)))
+        for step, status in self.steps.items():
+            if status == "changed":
+                self.reasons.append("inputs of {} changed".format(step))
+            elif status == "run" and step == "execute":
+                self.reasons.append("never executed")
+        self.downloads = []
+        for url, sha256 in package.downloads():
+            size = ctx.artifacts.cached_size(url, sha256)
+            self.downloads.append({"url": url, "cached": size is not None, "bytes": size})
+
+        inputs = list(package.get_all_xcframeworks())
+        inputs.extend(lib for sdk, lib in package.get_dist_libraries())
+        outputs = list(package.get_binary_targets)
+        outputs.append(join(package.swift_package_dir, "dist_files.zip"))
+        if isinstance(package, PythonSwiftPackage):
+            inputs.extend(join(ctx.site_packages_root, target) for target in package.site_package_targets)
+            outputs.append(join(package.swift_package_dir, "site-packages.zip"))
+        self.input_bytes = tree_size(inputs)
+        self.previous_bytes = tree_size(outputs)
+
+    @property
+    def action(self) -> str:
+        if self.reasons:
+            return "run"
+        return "cached"
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Size of the archives: the previous ones, else the uncompressed inputs as an upper bound."""
+        return self.previous_bytes or self.input_bytes
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "name": self.name,
+            "action": self.action,
+            "reasons": self.reasons,
+            "steps": self.steps,
+            "depends": self.depends,
+            "downloads": self.downloads,
+            "input_bytes": self.input_bytes,
+            "previous_bytes": self.previous_bytes,
+            "estimated_bytes": self.estimated_bytes,
+        }
+
+
+class Plan:
+    recipes: list[RecipePlan]
+    packages: list[PackagePlan]
+
+    def __init__(self, recipes: list[RecipePlan], packages: list[PackagePlan] | None = None):
+        self.recipes = recipes
+        self.packages = packages or []
+
+    @property
+    def dump(self) -> dict:
+        downloads = [download for package in self.packages for download in package.downloads]
+        return {
+            "recipes": [recipe.dump for recipe in self.recipes],
+            "packages": [package.dump for package in self.packages],
+            "summary": {
+                "recipes_to_build": [recipe.name for recipe in self.recipes if recipe.action == "build"],
+                "recipes_to_restore": [recipe.name for recipe in self.recipes if recipe.action == "restore"],
+                "packages_to_run": [package.name for package in self.packages if package.action == "run"],
+                "downloads": [download["url"] for download in downloads if not download["cached"]],
+                "estimated_bytes": sum(package.estimated_bytes for package in self.packages if package.action == "run"),
+            },
+        }
+
+    def table(self) -> str:
+        lines = ["{:<24} {:<8} {:<34} {:>14}".format("recipe", "action", "download/extract/build_all", "output bytes")]
+        for recipe in self.recipes:
+            lines.append("{:<24} {:<8} {:<34} {:>14}".format(
+                recipe.name, recipe.action, "/".join(recipe.steps[step] for step in RECIPE_STEPS), recipe.output_bytes))
+        if self.packages:
+            lines.append("")
+            lines.append("{:<16} {:<8} {:>14} {:>10}  {}".format("package", "action", "est. bytes", "downloads", "reasons"))
+            for package in self.packages:
+                missing = sum(1 for download in package.downloads if not download["cached"])
+                lines.append("{:<16} {:<8} {:>14} {:>10}  {}".format(
+                    package.name, package.action, package.estimated_bytes,
+                    "{}/{}".format(missing, len(package.downloads)), "; ".join(package.reasons)))
+        summary = self.dump["summary"]
+        lines.append("")
+        lines.append("{} recipe(s) to build, {} to restore, {} package(s) to run, {} download(s), ~{} bytes of archives".format(
+            len(summary["recipes_to_build"]), len(summary["recipes_to_restore"]), len(summary["packages_to_run"]),
+            len(summary["downloads"]), summary["estimated_bytes"]))
+        return "\n".join(lines)
+
+    def print(self, output_format: str = "table"):
+        if output_format == "json":
+            print(json.dumps(self.dump, indent=2))
+        else:
+            print(self.table())
+
+
+def plan_recipes(recipes: list[Recipe], ctx) -> list[RecipePlan]:
+    keys = recipe_keys(recipes, ctx) if ctx.recipe_outputs is not None else {}
+    return [RecipePlan(recipe, ctx, keys.get(recipe.name)) for recipe in recipes]
+
+
+def plan_packages(packages: list[SwiftPackage], graph: dict[str, set[str]], recipe_plans: list[RecipePlan]) -> list[PackagePlan]:
+    """Plans of packages in execution order."""
+    rebuilt = {recipe.name for recipe in recipe_plans if recipe.action != "cached"}
+    by_name = {package.name: package for package in packages}
+    return [
+        PackagePlan(by_name[name], rebuilt, set(by_name))
+        for name in topological_order({name: deps & graph.keys() for name, deps in graph.items()})
+    ]
@@ -0,0 +1,170 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, relpath
+from os import listdir, unlink, makedirs, walk, stat, cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
+from typing import Callable
+import _imp
+import compileall
+import importlib.util
+import py_compile
+import subprocess
+import sys
+
+from kivy_ios.toolchain import logger
+
+# folder or file names (or relative paths, when containing a "/") left out of site-packages
+DEFAULT_PRUNE_PATTERNS = [
+    "__pycache__",
+    "*.pyc",
+    "tests",
+    "examples",
+    "*.pyi",
+    "*.egg-info/SOURCES.txt",
+    "*.egg-info/dependency_links.txt",
+    "*.egg-info/installed-files.txt",
+    "*.egg-info/not-zip-safe",
+]
+
+
+def matches(rel: str, patterns: list[str]) -> bool:
+    rel = rel.replace("\\", "/")
+    parts = rel.split("/")
+    for pattern in patterns:
+        if "/" in pattern:
+            if fnmatch(rel, pattern) or fnmatch(rel, f"*/{pattern}"):
+                return True
+        elif any(fnmatch(part, pattern) for part in parts):
+            return True
+    return False
+
+
+class TreeStats:
+    files: int
+    size: int
+
+    def __init__(self, files: int = 0, size: int = 0):
+        self.files = files
+        self.size = size
+
+    @classmethod
+    def of(cls, path: str, exclude: Callable[[str], bool] | None = None) -> "TreeStats":
+        stats = cls()
+        if not exists(path):
+            return stats
+        if not isdir(path):
+            return cls(1, stat(path).st_size)
+        for dir_path, dir_names, file_names in walk(path, followlinks=True):
+            for fn in file_names:
+                if exclude and exclude(join(dir_path, fn)):
+                    continue
+                try:
+                    stats.size += stat(join(dir_path, fn)).st_size
+                except FileNotFoundError:
+                    continue
+                stats.files += 1
+        return stats
+
+
+def savings_table(before: dict[str, TreeStats], after: dict[str, TreeStats]) -> str:
+    lines = ["{:<40} {:>8} {:>8} {:>12} {:>12} {:>7}".format(
+        "target", "files", "after", "bytes", "after", "saved")]
+    total_before = TreeStats()
+    total_after = TreeStats()
+    for name, b in before.items():
+        a = after.get(name, TreeStats())
+        total_before.files += b.files
+        total_before.size += b.size
+        total_after.files += a.files
+        total_after.size += a.size
+        lines.append(savings_line(name, b, a))
+    lines.append(savings_line("total", total_before, total_after))
+    return "\n".join(lines)
+
+
+def savings_line(name: str, before: TreeStats, after: TreeStats) -> str:
+    saved = 100 * (before.size - after.size) / before.size if before.size else 0
+    return "{:<40} {:>8} {:>8} {:>12} {:>12} {:>6.1f}%".format(
+        name, before.files, after.files, before.size, after.size, saved)
+
+
+def compile_tree(root: str, python: str | None = None, workers: int | None = None, optimize: int = 0) -> int:
+    """Compile every .py below root to a .pyc next to it (importable without the source).
+
+    Uses compileall with a process pool when python is None (the running
+    interpreter), otherwise runs `python -m compileall` of the target interpreter.
+    The .pyc files are unchecked hash based: they do not embed the source mtime,
+    which the deterministic site-packages.zip does not keep.
+
+    compileall always recompiles hash based .pyc files, so only the sources whose
+    hash differs from the one recorded in their .pyc are compiled, returns their
+    number. The interpreter never checks unchecked .pyc files: one left next to
+    a .py edited in place, outside of this function, goes stale silently.
+    """
+    workers = workers or cpu_count() or 1
+    stale = stale_sources(root, importlib.util.MAGIC_NUMBER if python is None else pyc_magic(python))
+    if not stale:
+        return 0
+    if python is None:
+        compile_file = partial(
+            compileall.compile_file, quiet=1, legacy=True, optimize=optimize,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if not all(executor.map(compile_file, stale, chunksize=64)):
+                raise RuntimeError("Failed to compile {}".format(root))
+        return len(stale)
+    # compileall compiles a file list (-i) in one process, so -j only applies to root
+    sources = [root] if len(stale) >= workers * 64 else ["-i", "-"]
+    subprocess.run(
+        [python, "-m", "compileall", "-q", "-b", "-o", str(optimize), "-j", str(workers),
+         "--invalidation-mode", "unchecked-hash", *sources],
+        input="\n".join(stale), text=True, check=True
+    )
+    return len(stale)
+
+
+def pyc_magic(python: str) -> bytes:
+    """Magic number of the .pyc files python writes."""
+    return subprocess.run(
+        [python, "-c", "import importlib.util, sys; sys.stdout.buffer.write(importlib.util.MAGIC_NUMBER)"],
+        capture_output=True, check=True
+    ).stdout
+
+
+def stale_sources(root: str, magic: bytes) -> list[str]:
+    """.py files below root without an unchecked hash .pyc of magic matching their content."""
+    stale = []
+    key = int.from_bytes(magic, "little")
+    for dir_path, dir_names, file_names in walk(root):
+        for fn in file_names:
+            if not fn.endswith(".py"):
+                continue
+            source = join(dir_path, fn)
+            try:
+                with open(f"{source}c", "rb") as fp:
+                    header = fp.read(16)
+            except FileNotFoundError:
+                stale.append(source)
+                continue
+            with open(source, "rb") as fp:
+                source_hash = _imp.source_hash(key, fp.read())
+            # magic, flags (hash based, unchecked), source hash
+            if header != magic + (1).to_bytes(4, "little") + source_hash:
+                stale.append(source)
+    return sorted(stale)
+
+
+def compiled_source(path: str) -> bool:
+    """Whether path is a .py file with a compiled .pyc next to it."""
+    return path.endswith(".py") and exists(f"{path}c")
+
+
+def target_python(version: str, hostpython: str) -> str | None:
+    """None when the running interpreter produces bytecode for version, else the hostpython binary."""
+    if "{}.{}".format(*sys.version_info[:2]) == version:
+        return None
+    if not exists(hostpython):
+        raise RuntimeError(
+            "Python {} is needed to compile site-packages, {} does not exist".format(version, hostpython))
+    logger.info("Compiling site-packages with {}".format(hostpython))
+    return hostpython
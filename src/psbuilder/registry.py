@@ -0,0 +1,287 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir
+from importlib import metadata
+import argparse
+import ast
+import importlib
+import importlib.util
+import json
+
+ENTRY_POINT_GROUP = "psbuilder.packages"
+
+PACKAGES_DIR = join(dirname(realpath(__file__)), "packages")
+
+RECIPES_MODULE = "kivy_ios.recipes"
+
+# swift packages added by SwiftPackage.get_dependencies
+PYTHONCORE = "PythonCore"
+PYSWIFTKIT = "PySwiftKit"
+
+
+class PackageInfo:
+    """What is known about a package without importing its module (and its recipes).
+
+    products is None when they are computed at import time.
+    """
+
+    name: str
+    module: str
+    attribute: str
+    file: str | None
+    class_name: str | None
+    products: list[tuple[str, list[str]]] | None
+    dependencies: list[str]
+    recipes: list[str]
+    repo_url: str | None
+    source: str
+
+    def __init__(self, name: str, module: str, attribute: str = "package", source: str = "builtin"):
+        self.name = name
+        self.module = module
+        self.attribute = attribute
+        self.source = source
+        self.file = None
+        self.class_name = None
+        self.products = None
+        self.dependencies = []
+        self.recipes = []
+        self.repo_url = None
+
+    @property
+    def dump(self) -> dict:
+        return {
+            "name": self.name,
+            "module": self.module,
+            "source": self.source,
+            "class": self.class_name,
+            "products": None if self.products is None else [
+                {"name": name, "targets": targets} for name, targets in self.products
+            ],
+            "dependencies": self.dependencies,
+            "recipes": self.recipes,
+            "repo_url": self.repo_url,
+        }
+
+
+class ModuleIndex:
+    """Static view of a package module: its classes and the recipes it imports."""
+
+    def __init__(self, tree: ast.Module):
+        self.classes: dict[str, ast.ClassDef] = {}
+        self.assignments: dict[str, ast.expr] = {}
+        # local name -> recipe name, for `from kivy_ios.recipes import x` and `from kivy_ios.recipes.x import XRecipe`
+        self.recipe_names: dict[str, str] = {}
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                self.classes[node.name] = node
+            elif isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self.assignments[target.id] = node.value
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                for alias in node.names:
+                    local = alias.asname or alias.name
+                    if node.module == RECIPES_MODULE:
+                        self.recipe_names[local] = alias.name
+                    elif node.module.startswith(f"{RECIPES_MODULE}."):
+                        self.recipe_names[local] = node.module.rpartition(".")[2]
+
+    def class_attribute(self, class_name: str, attribute: str) -> ast.AST | None:
+        """The assignment value or property of attribute on class_name or its module-local bases."""
+        node = self.classes.get(class_name)
+        if node is None:
+            return None
+        for item in node.body:
+            if isinstance(item, ast.Assign):
+                if any(isinstance(target, ast.Name) and target.id == attribute for target in item.targets):
+                    return item.value
+            elif isinstance(item, ast.AnnAssign) and item.value is not None:
+                if isinstance(item.target, ast.Name) and item.target.id == attribute:
+                    return item.value
+            elif isinstance(item, ast.FunctionDef) and item.name == attribute:
+                return item
+        for base in node.bases:
+            if isinstance(base, ast.Name):
+                value = self.class_attribute(base.id, attribute)
+                if value is not None:
+                    return value
+        return None
+
+    def constant(self, class_name: str, attribute: str):
+        value = self.class_attribute(class_name, attribute)
+        if isinstance(value, ast.Constant):
+            return value.value
+        return None
+
+    def resolve(self, node: ast.AST | None) -> ast.AST | None:
+        """Follow a module level name to its value."""
+        if isinstance(node, ast.Name) and node.id in self.assignments:
+            return self.assignments[node.id]
+        return node
+
+    def instances(self, node: ast.AST | None) -> list[str]:
+        """Class names instantiated in a list like `targets = [Target(), ...]`."""
+        node = self.resolve(node)
+        if not isinstance(node, (ast.List, ast.Tuple)):
+            return []
+        return [
+            item.func.id for item in node.elts
+            if isinstance(item, ast.Call) and isinstance(item.func, ast.Name)
+        ]
+
+    def calls(self, node: ast.AST | None, name: str) -> list[ast.Call]:
+        if node is None:
+            return []
+        return [
+            item for item in ast.walk(node)
+            if isinstance(item, ast.Call) and isinstance(item.func, ast.Attribute) and item.func.attr == name
+        ]
+
+    def recipes(self, node: ast.AST | None) -> list[str]:
+        """Recipe names of `recipes = [module.recipe, XRecipe(), ...]`."""
+        names = []
+        for item in getattr(self.resolve(node), "elts", []):
+            if isinstance(item, ast.Attribute) and isinstance(item.value, ast.Name):
+                local = item.value.id
+            elif isinstance(item, ast.Call) and isinstance(item.func, ast.Name):
+                local = item.func.id
+            else:
+                continue
+            if local in self.recipe_names:
+                names.append(self.recipe_names[local])
+        return names
+
+
+def strings(node: ast.AST | None) -> list[str] | None:
+    if not isinstance(node, (ast.List, ast.Tuple)):
+        return None
+    values = [item.value for item in node.elts if isinstance(item, ast.Constant) and isinstance(item.value, str)]
+    return values if len(values) == len(node.elts) else None
+
+
+def url_name(url: str) -> str:
+    return basename(url.rstrip("/")).removesuffix(".git")
+
+
+def index_package(info: PackageInfo, source: str) -> PackageInfo:
+    """Fill info from the source of its module (see SwiftPackage.package_dependencies)."""
+    module = ModuleIndex(ast.parse(source))
+    package = module.assignments.get(info.attribute)
+    if not (isinstance(package, ast.Call) and isinstance(package.func, ast.Name)):
+        return info
+    class_name = package.func.id
+    info.class_name = class_name
+    info.repo_url = module.constant(class_name, "repo_url")
+
+    products_node = module.class_attribute(class_name, "products")
+    products = []
+    if products_node is not None and not isinstance(products_node, ast.List):
+        # built by code, e.g. list(create_products())
+        products = None
+    for call in module.calls(products_node, "Product"):
+        targets = strings(call.args[1]) if len(call.args) > 1 else []
+        if products is None or not isinstance(call.args[0], ast.Constant) or targets is None:
+            products = None
+            break
+        products.append((call.args[0].value, targets))
+    info.products = products
+
+    dependencies: list[str] = []
+    for call in module.calls(module.class_attribute(class_name, "dependencies"), "Dependency"):
+        if call.args and isinstance(call.args[0], ast.Constant):
+            dependencies.append(url_name(call.args[0].value))
+    if module.constant(class_name, "include_pythonswiftlink"):
+        dependencies.append(PYSWIFTKIT)
+    if module.constant(class_name, "include_pythoncore"):
+        dependencies.append(PYTHONCORE)
+
+    recipes: list[str] = []
+    for target in module.instances(module.class_attribute(class_name, "targets")):
+        recipes.extend(module.recipes(module.class_attribute(target, "recipes")))
+        for call in module.calls(module.class_attribute(target, "dependencies"), "product"):
+            if len(call.args) > 1 and isinstance(call.args[1], ast.Constant):
+                dependencies.append(call.args[1].value)
+    info.dependencies = [name for name in dict.fromkeys(dependencies) if name != class_name]
+    info.recipes = list(dict.fromkeys(recipes))
+    return info
+
+
+class PackageRegistry:
+    """Packages of psbuilder.packages and of the `psbuilder.packages` entry point group.
+
+    Listing and indexing only parse the package modules; a module (and the
+    recipes it imports) is imported by load(). Only `psbuilder packages` stays
+    at that level: --plan and generation load every package they run and its
+    recipes, whose dependencies and state they need.
+    """
+
+    def __init__(self):
+        self._packages: dict[str, PackageInfo] | None = None
+        self._indexed: set[str] = set()
+
+    def discover(self) -> dict[str, PackageInfo]:
+        if self._packages is not None:
+            return self._packages
+        packages = {}
+        for fn in sorted(listdir(PACKAGES_DIR)):
+            name, ext = splitext(fn)
+            if ext == ".py" and not name.startswith("_"):
+                info = PackageInfo(name, f"psbuilder.packages.{name}")
+                info.file = join(PACKAGES_DIR, fn)
+                packages[name] = info
+        for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+            if entry_point.name in packages:
+                continue
+            module, _, attribute = entry_point.value.partition(":")
+            packages[entry_point.name] = PackageInfo(
+                entry_point.name, module.strip(), attribute.strip() or "package", "entry_point"
+            )
+        self._packages = packages
+        return packages
+
+    def names(self) -> list[str]:
+        return list(self.discover())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.discover()
+
+    def info(self, name: str) -> PackageInfo:
+        info = self.discover()[name]
+        if name not in self._indexed:
+            self._indexed.add(name)
+            if info.file is None:
+                spec = importlib.util.find_spec(info.module)
+                info.file = spec.origin if spec else None
+            if info.file and exists(info.file):
+                with open(info.file, encoding="utf-8") as fp:
+                    index_package(info, fp.read())
+        return info
+
+    def load(self, name: str):
+        """Import the module of a package and return its SwiftPackage instance."""
+        info = self.discover()[name]
+        return getattr(importlib.import_module(info.module), info.attribute)
+
+
+registry = PackageRegistry()
+
+
+def packages_command(argv: list[str]):
+    parser = argparse.ArgumentParser(
+            prog="psbuilder packages",
+            description="List the available packages without loading their recipes")
+    parser.add_argument("package", nargs="*", help="only show these packages")
+    parser.add_argument("--json", action="store_true", help="print the package metadata as JSON")
+    args = parser.parse_args(argv)
+    names = args.package or registry.names()
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        parser.error("unknown package(s): {}".format(", ".join(unknown)))
+    infos = [registry.info(name) for name in names]
+    if args.json:
+        print(json.dumps([info.dump for info in infos], indent=2))
+        return
+    print("{:<12} {:<14} {:<40} {}".format("name", "package", "recipes", "depends on"))
+    for info in infos:
+        print("{:<12} {:<14} {:<40} {}".format(
+            info.name, info.class_name or "?", ", ".join(info.recipes), ", ".join(info.dependencies)))
@@ -0,0 +1,86 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, Hashable, TypeVar
+
+from kivy_ios.toolchain import logger
+
+Node = TypeVar("Node", bound=Hashable)
+
+
+class CycleError(ValueError):
+    pass
+
+
+def topological_order(dependencies: dict[Node, set[Node]]) -> list[Node]:
+    """Nodes ordered so every node comes after its dependencies, ties kept in insertion order."""
+    order: list[Node] = []
+    done: set[Node] = set()
+    remaining = list(dependencies)
+    while remaining:
+        ready = [node for node in remaining if dependencies[node] <= done]
+        if not ready:
+            raise CycleError("dependency cycle between {}".format(remaining))
+        for node in ready:
+            order.append(node)
+            done.add(node)
+        remaining = [node for node in remaining if node not in done]
+    return order
+
+
+def run_graph(
+        dependencies: dict[Node, set[Node]],
+        run: Callable[[Node], object],
+        jobs: int = 1,
+        executor: Executor | None = None
+    ) -> dict[Node, object]:
+    """Run every node as soon as all of its dependencies finished, at most `jobs` at a time.
+
+    Dependencies on nodes that are not part of the graph are ignored. When a
+    node fails no new nodes are started, running ones are waited for and the
+    first error is raised.
+    """
+    dependencies = {
+        node: {dep for dep in deps if dep in dependencies and dep != node}
+        for node, deps in dependencies.items()
+    }
+    order = topological_order(dependencies)
+    results: dict[Node, object] = {}
+    if jobs <= 1 and executor is None:
+        for node in order:
+            results[node] = run(node)
+        return results
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    done: set[Node] = set()
+    pending = list(order)
+    running: dict[Future, Node] = {}
+    error: BaseException | None = None
+    try:
+        while pending or running:
+            if error is None:
+                for node in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    if dependencies[node] <= done:
+                        pending.remove(node)
+                        logger.info("Scheduling {}".format(node))
+                        running[executor.submit(run, node)] = node
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    logger.error("{} failed: {}".format(node, exc))
+                    error = error or exc
+                    continue
+                results[node] = future.result()
+                done.add(node)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    if error is not None:
+        raise error
+    return results
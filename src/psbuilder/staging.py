@@ -0,0 +1,139 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, samefile
+from os import listdir, unlink, makedirs, stat, replace, link
+import ctypes
+import ctypes.util
+import errno
+import shutil
+import sys
+import os
+
+# ioctl request number of FICLONE on linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+STAGE_METHODS = ("reflink", "hardlink", "copy_file_range", "copy")
+
+# (method, source device, destination device) combinations that failed before
+_unsupported: set[tuple[str, int, int]] = set()
+
+
+class StageReport:
+    staged: dict[str, int]
+    bytes_staged: int
+    missing: list[str]
+
+    def __init__(self):
+        self.staged = {method: 0 for method in STAGE_METHODS}
+        self.bytes_staged = 0
+        self.missing = []
+
+    @property
+    def count(self) -> int:
+        return sum(self.staged.values())
+
+    def __str__(self) -> str:
+        methods = ", ".join(f"{count} {method}" for method, count in self.staged.items() if count)
+        return "{} files staged ({}), {} bytes, {} missing".format(
+            self.count, methods or "none", self.bytes_staged, len(self.missing)
+        )
+
+
+def _clonefile():
+    if sys.platform != "darwin":
+        return None
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    clonefile = getattr(libc, "clonefile", None)
+    if clonefile is not None:
+        clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+        clonefile.restype = ctypes.c_int
+    return clonefile
+
+
+clonefile = _clonefile()
+
+
+def reflink(src: str, dst: str):
+    if clonefile is not None:
+        if clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+        return
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            unlink(dst)
+            raise
+
+
+def copy_file_range(src: str, dst: str):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            fdst.close()
+            unlink(dst)
+            raise
+        if remaining:
+            raise OSError(errno.EIO, "copy_file_range stopped early", src)
+
+
+_stage_functions = {
+    "reflink": reflink,
+    "hardlink": link,
+    "copy_file_range": copy_file_range,
+    "copy": shutil.copyfile,
+}
+
+
+def stage_file(src: str, dst: str, report: StageReport | None = None, hardlink: bool = True) -> str:
+    """Place the content of src at dst as cheaply as possible and return the method used.
+
+    Tries a reflink (FICLONE / clonefile), then a hard link, then
+    copy_file_range and finally a plain copy. Hard links share the inode with
+    src, pass hardlink=False when dst may be modified in place.
+    """
+    makedirs(dirname(dst), exist_ok=True)
+    if hardlink and exists(dst) and samefile(src, dst):
+        # already linked by an earlier run
+        if report is not None:
+            report.staged["hardlink"] += 1
+            report.bytes_staged += stat(dst).st_size
+        return "hardlink"
+    tmp = f"{dst}.stage-tmp"
+    if exists(tmp):
+        unlink(tmp)
+    src_dev = stat(src).st_dev
+    dst_dev = stat(dirname(dst)).st_dev
+    for method in STAGE_METHODS:
+        if method == "hardlink" and not hardlink:
+            continue
+        key = (method, src_dev, dst_dev)
+        if method != "copy" and key in _unsupported:
+            continue
+        try:
+            _stage_functions[method](src, tmp)
+        except OSError as err:
+            if exists(tmp):
+                unlink(tmp)
+            if method == "copy":
+                raise
+            if err.errno in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL, errno.ENOTTY, errno.EPERM, errno.EMLINK):
+                _unsupported.add(key)
+            continue
+        if method != "hardlink":
+            shutil.copymode(src, tmp)
+        replace(tmp, dst)
+        if report is not None:
+            report.staged[method] += 1
+            report.bytes_staged += stat(dst).st_size
+        return method
+    raise OSError(errno.EIO, "unable to stage file", src)
@@ -0,0 +1,204 @@
+from os.path import join, dirname, realpath, exists, isdir, islink, basename, splitext, relpath
+from os import listdir, unlink, makedirs, walk, stat, replace, rmdir, link
+from typing import Callable
+import shutil
+
+from .checksums import sha256_file
+
+
+class SyncReport:
+    copied: int
+    updated: int
+    deleted: int
+    unchanged: int
+    bytes_copied: int
+    bytes_deleted: int
+
+    def __init__(self):
+        self.copied = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.bytes_copied = 0
+        self.bytes_deleted = 0
+
+    def add(self, other: "SyncReport"):
+        self.copied += other.copied
+        self.updated += other.updated
+        self.deleted += other.deleted
+        self.unchanged += other.unchanged
+        self.bytes_copied += other.bytes_copied
+        self.bytes_deleted += other.bytes_deleted
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.copied or self.updated or self.deleted)
+
+    def __str__(self) -> str:
+        return "{} copied, {} updated, {} deleted, {} unchanged ({} bytes copied, {} bytes deleted)".format(
+            self.copied, self.updated, self.deleted, self.unchanged, self.bytes_copied, self.bytes_deleted
+        )
+
+
+def tree_files(root: str, exclude: Callable[[str], bool] | None = None, dirs: set[str] | None = None) -> dict[str, object]:
+    """stat results of all files below root, by path relative to root.
+
+    Files and folders whose relative path matches exclude are skipped. The
+    relative paths of the folders below root are added to dirs when given.
+    """
+    if not isdir(root):
+        return {"": stat(root)} if exists(root) else {}
+    files = {}
+    for dir_path, dir_names, file_names in walk(root, followlinks=True):
+        if exclude:
+            dir_names[:] = [
+                dn for dn in dir_names if not exclude(relpath(join(dir_path, dn), root))
+            ]
+        if dirs is not None:
+            dirs.update(relpath(join(dir_path, dn), root) for dn in dir_names)
+        for fn in file_names:
+            path = join(dir_path, fn)
+            rel = relpath(path, root)
+            if exclude and exclude(rel):
+                continue
+            try:
+                files[rel] = stat(path)
+            except FileNotFoundError:
+                continue
+    return files
+
+
+def same_file(src: str, src_stat, dst: str, dst_stat, checksum: bool) -> bool:
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    return checksum and sha256_file(src) == sha256_file(dst)
+
+
+def copy_file(src: str, dst: str):
+    makedirs(dirname(dst), exist_ok=True)
+    tmp = f"{dst}.sync-tmp"
+    shutil.copy2(src, tmp)
+    replace(tmp, dst)
+
+
+def link_file(src: str, dst: str):
+    """Hard link src at dst, copying it when src is on another device or cannot be linked."""
+    makedirs(dirname(dst), exist_ok=True)
+    tmp = f"{dst}.sync-tmp"
+    if exists(tmp):
+        unlink(tmp)
+    try:
+        link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    replace(tmp, dst)
+
+
+def write_file(path: str, data: str):
+    """Write data to a new file replacing path, files hard linked to path keep their content."""
+    tmp = f"{path}.sync-tmp"
+    with open(tmp, "w") as fp:
+        fp.write(data)
+    replace(tmp, path)
+
+
+def remove_path(path: str, report: SyncReport):
+    if isdir(path) and not islink(path):
+        for dst_file, dst_stat in tree_files(path).items():
+            report.deleted += 1
+            report.bytes_deleted += dst_stat.st_size
+        shutil.rmtree(path)
+    else:
+        report.deleted += 1
+        report.bytes_deleted += stat(path).st_size if exists(path) else 0
+        unlink(path)
+
+
+def sync_tree(
+        src: str,
+        dst: str,
+        checksum: bool = False,
+        delete: bool = True,
+        report: SyncReport | None = None,
+        exclude: Callable[[str], bool] | None = None,
+        preserve: Callable[[str], bool] | None = None,
+        copy_function: Callable[[str, str], None] = copy_file
+    ) -> SyncReport:
+    """Make dst a copy of src (file or folder), copying only what changed.
+
+    Files are compared by size and mtime (copies keep the source mtime); with
+    checksum=True files of equal size but different mtime are compared by
+    content before being copied. Files in dst that are not in src are deleted
+    unless delete=False or their relative path matches preserve. Paths of src
+    matching exclude are not copied, empty folders are. Pass
+    copy_function=link_file to hard link the files instead, dst then shares
+    them with src and must not be modified in place.
+    """
+    report = report or SyncReport()
+    if not isdir(src):
+        if isdir(dst) and not islink(dst):
+            remove_path(dst, report)
+        src_stat = stat(src)
+        dst_files = tree_files(dst)
+        if "" in dst_files and same_file(src, src_stat, dst, dst_files[""], checksum):
+            if src_stat.st_mtime_ns != dst_files[""].st_mtime_ns:
+                shutil.copystat(src, dst)
+            report.unchanged += 1
+            return report
+        if dst_files:
+            report.updated += 1
+        else:
+            report.copied += 1
+        copy_function(src, dst)
+        report.bytes_copied += src_stat.st_size
+        return report
+
+    if exists(dst) and not isdir(dst):
+        remove_path(dst, report)
+    src_dirs: set[str] = set()
+    src_files = tree_files(src, exclude, src_dirs)
+    dst_files = tree_files(dst)
+    if delete:
+        for rel in dst_files.keys() - src_files.keys():
+            if preserve and preserve(rel):
+                continue
+            dst_file = join(dst, rel)
+            if exists(dst_file) or islink(dst_file):
+                remove_path(dst_file, report)
+        remove_empty_dirs(src, dst)
+    for rel, src_stat in src_files.items():
+        src_file = join(src, rel)
+        dst_file = join(dst, rel)
+        dst_stat = dst_files.get(rel)
+        if dst_stat is not None and same_file(src_file, src_stat, dst_file, dst_stat, checksum):
+            if src_stat.st_mtime_ns != dst_stat.st_mtime_ns:
+                shutil.copystat(src_file, dst_file)
+            report.unchanged += 1
+            continue
+        if isdir(dst_file) and not islink(dst_file):
+            remove_path(dst_file, report)
+            dst_stat = None
+        copy_function(src_file, dst_file)
+        report.bytes_copied += src_stat.st_size
+        if dst_stat is None:
+            report.copied += 1
+        else:
+            report.updated += 1
+    makedirs(dst, exist_ok=True)
+    # folders holding files exist by now, this creates the empty ones
+    for rel in src_dirs:
+        makedirs(join(dst, rel), exist_ok=True)
+    return report
+
+
+def remove_empty_dirs(src: str, dst: str):
+    """Remove folders of dst that are empty and do not exist in src."""
+    if not isdir(dst):
+        return
+    for dir_path, dir_names, file_names in walk(dst, topdown=False):
+        if dir_path == dst or file_names or listdir(dir_path):
+            continue
+        if not isdir(join(src, relpath(dir_path, dst))):
+            rmdir(dir_path)
@@ -1,6 +1,9 @@
 from .recipe import _Recipe
-import hashlib
-from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from .archive import read_checksum_file
+from .checksums import ChecksumIndex, sha256_file
+from .trace import span, tracer
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, getsize
+from functools import cached_property
 from typing import TypeAlias
 
 class SwiftTarget:
@@ -88,30 +91,30 @@ class SwiftTarget:
     
     linker_libraries: list[LinkerSetting] = []
     
+    @cached_property
+    def platform_only(self) -> tuple[frozenset[str], frozenset[str]]:
+        return frozenset(self.ios_only), frozenset(self.macos_only)
+    
+    def platform_condition(self, name: str) -> dict | None:
+        ios_only, macos_only = self.platform_only
+        if name in ios_only:
+            return {"platform": "ios"}
+        if name in macos_only:
+            return {"platform": "macos"}
+        return None
+    
     @property
     def linker_settings(self) -> list[LinkerSetting]:
         output = []
         for recipe in self.recipes:
             if hasattr(recipe, "pbx_frameworks"):
                 for pbx in recipe.pbx_frameworks:
-                    condition = None
-                    if pbx in self.ios_only:
-                        condition = {"platform": "ios"}
-                    elif pbx in self.macos_only:
-                        condition = {"platform": "macos"}
-                    output.append(SwiftTarget.LinkerSetting(pbx, condition=condition))
+                    output.append(SwiftTarget.LinkerSetting(pbx, condition=self.platform_condition(pbx)))
             if hasattr(recipe, "pbx_libraries"):
                 for lib in recipe.pbx_libraries:
                     lib: str = lib
-                    condition = None
-                    if lib in self.ios_only:
-                        condition = {"platform": "ios"}
-                    elif lib in self.macos_only:
-                        condition = {"platform": "macos"}
-                    if lib.startswith("lib"):
-                        output.append(SwiftTarget.LinkerSetting(lib.removeprefix("lib"),"library", condition=condition))
-                    else:
-                         output.append(SwiftTarget.LinkerSetting(lib,"library", condition=condition))
+                    condition = self.platform_condition(lib)
+                    output.append(SwiftTarget.LinkerSetting(lib.removeprefix("lib"), "library", condition=condition))
         
         return output + self.linker_libraries
     
@@ -122,23 +125,18 @@ class SwiftTarget:
             xcs.extend(recipe.dist_xcframeworks)
         return xcs
     
-    def dump_dep(self) -> list[dict | str]:
+    def dump_dep(self, xcframeworks: list[str] | None = None) -> list[dict | str]:
         deps = []
         for dep in self.dependencies:
             
             match dep:
                 case str():
-                    if dep in self.ios_only:
-                        deps.append({
-                                    "type": "target",
-                                    "data": dep,
-                                    "condition": {"platform": "ios"}
-                                })
-                    elif dep in self.macos_only:
+                    condition = self.platform_condition(dep)
+                    if condition:
                         deps.append({
                                     "type": "target",
                                     "data": dep,
-                                    "condition": {"platform": "macos"}
+                                    "condition": condition
                                 })
                     else:
                         deps.append({
@@ -150,36 +148,19 @@ class SwiftTarget:
                         "type": "dependency",
                         "data": dep.dump
                     })
-        for xc in self.xcframeworks:
+        for xc in self.xcframeworks if xcframeworks is None else xcframeworks:
             fn, ext = splitext(basename(xc))
-            if fn in self.ios_only:
-                deps.append({
-                            "type": "dependency",
-                            "data": {
-                                    "name": fn,
-                                    "type": "target",
-                                    "condition": {"platform": "ios"}
-                                },
-                            
-                        })
-            elif fn in self.macos_only:
-                deps.append({
-                            "type": "dependency",
-                            "data": {
-                                    "name": fn,
-                                    "type": "target",
-                                    "condition": {"platform": "macos"}
-                                },
-                            
-                        })
-            else:
-                deps.append({
-                            "type": "dependency",
-                            "data": {
-                                    "name": fn,
-                                    "type": "target"
-                                }
-                        })
+            data = {
+                "name": fn,
+                "type": "target"
+            }
+            condition = self.platform_condition(fn)
+            if condition:
+                data["condition"] = condition
+            deps.append({
+                "type": "dependency",
+                "data": data
+            })
         return deps
                     
         
@@ -219,6 +200,8 @@ class SwiftTarget:
 TargetDependency: TypeAlias = SwiftTarget.PackageDependency    
 
 class BinaryTarget:
+    __slots__ = ("name", "file", "github", "repo", "version", "_sha256", "checksums")
+    
     name: str
     file: str
     github: str
@@ -226,29 +209,35 @@ class BinaryTarget:
     version: str
     
     _sha256: str
+    checksums: ChecksumIndex | None
         
-    def __init__(self,name: str, file: str, github: str, repo: str, version: str):
+    def __init__(self,name: str, file: str, github: str, repo: str, version: str, checksums: ChecksumIndex | None = None, sha256: str | None = None):
         self.name = name
         self.file = file
         self.github = github
         self.repo = repo
         self.version = version
-        self._sha256 = None
+        self.checksums = checksums
+        self._sha256 = sha256
     
     @property
     def url(self) -> str:
         return f"https://github.com/{self.github}/{self.repo}/releases/download/{self.version}/{basename(self.file)}"
     
     def calculate_checksum(self):
-        BUF_SIZE = 65536
-        sha256 = hashlib.sha256()
-        with open(self.file, "rb") as fp:
-            while True:
-                data = fp.read(BUF_SIZE)
-                if not data:
-                    break
-                sha256.update(data)
-        self._sha256 = sha256.hexdigest()
+        with span("checksum", target=self.name) as checksum_span:
+            sha256 = self.checksums.get(self.file) if self.checksums else None
+            if sha256 is None:
+                # digest recorded by the zip step while the archive was written
+                sha256 = read_checksum_file(self.file)
+                if sha256 is None:
+                    sha256 = sha256_file(self.file)
+                    # only bytes actually hashed count, and only when tracing
+                    if tracer.enabled:
+                        checksum_span.add_bytes(getsize(self.file))
+                if self.checksums:
+                    self.checksums.record(self.file, sha256)
+            self._sha256 = sha256
                 
     @property
     def checksum(self) -> str:
@@ -33,12 +33,24 @@ from kivy_ios.toolchain import build_recipes
 from .targets import SwiftTarget
 from .context import PackageContext
 from .package import SwiftPackage
+from .scheduler import run_graph
+from .builder import build_recipes_concurrently
+from .trace import tracer, span
+from .registry import packages_command
+from .plan import Plan, plan_recipes, plan_packages
+from .outputs import recipe_keys, restore_recipes, execute_recipe, OutputRecorder
 
 
 
 
-def generate_packages(packages: list[str], ctx: PackageContext, **kw):
-    version: str | None = kw.pop("version", None)
+# packages of `swiftpackage all`
+ALL_PACKAGES = [
+    "pythoncore" ,"kivycore", "sdl2core", "imagecore",
+    "kivynumpy", "freetype", "pillow"
+]
+
+
+def load_packages(packages: list[str], ctx: PackageContext, version: str | None = None) -> list[SwiftPackage]:
     logger.info(f"generate_packages: {packages}")
     #ctx.wanted_recipes = names[:]
     packages_to_load = packages
@@ -57,24 +69,60 @@ def generate_packages(packages: list[str], ctx: PackageContext, **kw):
         
         to_run.append(package)
     
-    recipes_to_build = []
     for package in to_run:
         package.init_with_ctx(ctx)
-        
+    
+    if version:
+        for package in to_run:
+            package.version = version
+    return to_run
+
+
+def package_recipes(packages: list[SwiftPackage]) -> list[str]:
+    recipes_to_build = []
+    for package in packages:
         for t in package.targets:
             for recipe in t.recipes:
                 recipes_to_build.append(recipe.name)
+    return recipes_to_build
+
+
+def package_graph(packages: list[SwiftPackage]) -> dict[str, set[str]]:
+    return {
+        package.name: package.package_dependencies
+        for package in packages
+    }
+
+
+def generate_packages(packages: list[str], ctx: PackageContext, **kw):
+    version: str | None = kw.pop("version", None)
+    jobs: int = kw.pop("jobs", 1)
+    recipe_jobs: int = kw.pop("recipe_jobs", 1)
+    split_platforms: bool = kw.pop("split_platforms", False)
+    to_run = load_packages(packages, ctx)
+    recipes_to_build = package_recipes(to_run)
     
-    build_recipes(recipes_to_build, ctx)
-        
-    for package in to_run:
-        if version:
+    with span("build_recipes", recipes=len(recipes_to_build)):
+        build_recipes(recipes_to_build, ctx, recipe_jobs, split_platforms)
+    
+    if version:
+        for package in to_run:
             package.version = version
-        package.execute()
+    
+    packages_by_name = {package.name: package for package in to_run}
+    graph = package_graph(to_run)
+    logger.info("Package graph is {}".format({name: sorted(deps & graph.keys()) for name, deps in graph.items()}))
+    
+    def execute_package(name: str):
+        with ctx.packages_state.batch():
+            packages_by_name[name].execute()
+    
+    run_graph(graph, execute_package, jobs)
         
     
 
-def build_recipes(names, ctx):
+def resolve_recipes(names, ctx) -> list[Recipe]:
+    """Recipes to build for names (and their dependencies) in build order, without aliases."""
     # gather all the dependencies
     logger.info("Want to build {}".format(names))
     graph = Graph()
@@ -115,8 +163,42 @@ def build_recipes(names, ctx):
     logger.info("Recipe order is {}".format(recipes_order))
     for recipe in recipes:
         recipe.init_with_ctx(ctx)
+    return recipes
+
+
+def build_recipes(names, ctx, jobs: int = 1, split_platforms: bool = False):
+    recipes = resolve_recipes(names, ctx)
+    keys = recipe_keys(recipes, ctx) if ctx.recipe_outputs is not None else {}
+    if jobs > 1:
+        restored = restore_recipes(recipes, ctx, keys)
+        outputs = OutputRecorder(ctx, keys) if keys else None
+        build_recipes_concurrently(
+            [recipe for recipe in recipes if recipe.name not in restored], ctx, jobs, split_platforms, outputs)
+        return
     for recipe in recipes:
-        recipe.execute()
+        with span("recipe", recipe.name):
+            if recipe.name in keys:
+                execute_recipe(recipe, ctx, keys[recipe.name])
+            else:
+                recipe.execute()
+
+
+def plan_build(names: list[str], ctx: PackageContext) -> Plan:
+    return Plan(plan_recipes(resolve_recipes(names, ctx), ctx))
+
+
+def plan_generate_packages(packages: list[str], ctx: PackageContext, version: str | None = None) -> Plan:
+    to_run = load_packages(packages, ctx, version)
+    recipe_plans = plan_recipes(resolve_recipes(package_recipes(to_run), ctx), ctx)
+    return Plan(recipe_plans, plan_packages(to_run, package_graph(to_run), recipe_plans))
+
+
+def write_trace(filename: str | None):
+    if not filename:
+        return
+    tracer.write(filename)
+    logger.info("Wrote trace to {}".format(filename))
+    print(tracer.summary())
 
 
 class PSLToolchainCL(ToolchainCL):
@@ -139,7 +221,26 @@ class PSLToolchainCL(ToolchainCL):
                             help="do not use pbzip2 for bzip2 decompression")
         parser.add_argument("--add-custom-recipe", action="append", default=[],
                             help="Path to custom recipe")
+        parser.add_argument("--jobs", type=int, default=1,
+                            help="number of recipes built at the same time, each in its own process "
+                                 "(recipes built alongside others are not stored in the recipe cache)")
+        parser.add_argument("--split-platforms", action="store_true",
+                            help="with --jobs, build the platforms of a recipe concurrently and assemble them afterwards")
+        parser.add_argument("--trace", default=None, metavar="FILE",
+                            help="write a Chrome trace of the build phases to FILE and print a summary")
+        parser.add_argument("--plan", action="store_true",
+                            help="only print what would be built")
+        parser.add_argument("--json", action="store_true",
+                            help="print the --plan as JSON")
+        parser.add_argument("--no-recipe-cache", action="store_true",
+                            help="always compile, do not restore or store recipe outputs")
         args = parser.parse_args(sys.argv[2:])
+        if args.no_recipe_cache:
+            ctx.recipe_outputs = None
+        if args.trace:
+            tracer.enable()
+        if args.plan and args.json:
+            logger.setLevel(logging.WARNING)
 
         if args.platform:
 
@@ -176,7 +277,14 @@ class PSLToolchainCL(ToolchainCL):
         if ctx.use_pbzip2:
             logger.info("Using pbzip2 to decompress bzip2 data")
 
-        build_recipes(args.recipe, ctx)
+        if args.plan:
+            plan_build(args.recipe, ctx).print("json" if args.json else "table")
+            return
+
+        try:
+            build_recipes(args.recipe, ctx, args.jobs, args.split_platforms)
+        finally:
+            write_trace(args.trace)
 
     
     
@@ -189,22 +297,69 @@ class PSLToolchainCL(ToolchainCL):
                             help="export destination")
         parser.add_argument("--version", default=None,
                             help="set global version if package accepts its")
+        parser.add_argument("--jobs", type=int, default=1,
+                            help="number of packages generated concurrently, each zips with its own threads")
+        parser.add_argument("--recipe-jobs", type=int, default=1,
+                            help="number of recipes built at the same time, each in its own process "
+                                 "(recipes built alongside others are not stored in the recipe cache)")
+        parser.add_argument("--split-platforms", action="store_true",
+                            help="with --recipe-jobs, build the platforms of a recipe concurrently")
+        parser.add_argument("--offline", action="store_true",
+                            help="only use release assets from the artifact cache, never download")
+        parser.add_argument("--trace", default=None, metavar="FILE",
+                            help="write a Chrome trace of the packaging phases to FILE and print a summary")
+        parser.add_argument("--plan", action="store_true",
+                            help="only print which recipes and packages would run (loads their modules and recipes)")
+        parser.add_argument("--json", action="store_true",
+                            help="print the --plan as JSON")
+        parser.add_argument("--no-recipe-cache", action="store_true",
+                            help="always compile, do not restore or store recipe outputs")
         args = parser.parse_args(sys.argv[2:])
+        ctx.artifacts.offline = args.offline
+        if args.no_recipe_cache:
+            ctx.recipe_outputs = None
+        if args.trace:
+            tracer.enable()
         kw = {
-            "version": args.version
+            "version": args.version,
+            "jobs": args.jobs,
+            "recipe_jobs": args.recipe_jobs,
+            "split_platforms": args.split_platforms
         }
-        if args.package == ["all"]:
-            generate_packages(
-                [
-                   "pythoncore" ,"kivycore", "sdl2core", "imagecore",
-                   "kivynumpy", "freetype", "pillow"
-                ],
-                ctx,
-                **kw
-            )
-        else:
-            generate_packages(args.package, ctx, **kw)
-        
+        packages = list(ALL_PACKAGES) if args.package == ["all"] else args.package
+        if args.plan:
+            if args.json:
+                logger.setLevel(logging.WARNING)
+            plan_generate_packages(packages, ctx, args.version).print("json" if args.json else "table")
+            return
+        try:
+            generate_packages(packages, ctx, **kw)
+        finally:
+            write_trace(args.trace)
+
+    def packages(self):
+        packages_command(sys.argv[2:])
+
+    def checksums(self):
+        ctx = PackageContext()
+        parser = argparse.ArgumentParser(
+                description="Inspect or invalidate the archive checksum index")
+        parser.add_argument("--invalidate", nargs="?", const="", default=None,
+                            help="forget checksums for paths starting with the given prefix (all if empty)")
+        parser.add_argument("--prune", action="store_true",
+                            help="forget checksums of missing or changed files")
+        args = parser.parse_args(sys.argv[2:])
+        index = ctx.checksums
+        if args.invalidate is not None:
+            removed = index.invalidate(args.invalidate or None)
+            print("Invalidated {} checksum(s)".format(len(removed)))
+        if args.prune:
+            removed = index.prune()
+            print("Pruned {} checksum(s)".format(len(removed)))
+        for path, entry in sorted(index.entries().items()):
+            print("{} {} {}".format(
+                entry["sha256"], "valid  " if entry["valid"] else "changed", path))
+
 
 def main():
     PSLToolchainCL()
@@ -0,0 +1,142 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import listdir, unlink, makedirs, getpid
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local, get_ident
+from typing import Callable, Generator
+import json
+import time
+
+
+class Span:
+    name: str
+    package: str | None
+    start: float
+    end: float
+    bytes: int
+    args: dict
+
+    def __init__(self, name: str, package: str | None = None, **args):
+        self.name = name
+        self.package = package
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.bytes = 0
+        self.args = args
+        self.thread = get_ident()
+
+    def add_bytes(self, count: int):
+        self.bytes += count
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Tracer:
+    """Collects timed spans of the build phases.
+
+    Disabled by default, spans are then not recorded at all. Spans opened
+    while another one is open on the same thread inherit its package.
+    """
+
+    enabled: bool
+    spans: list[Span]
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.lock = Lock()
+        self.local = local()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, package: str | None = None, **args) -> Generator[Span, None, None]:
+        stack: list[Span] = self.local.__dict__.setdefault("stack", [])
+        if package is None and stack:
+            package = stack[-1].package
+        span = Span(name, package, **args)
+        if not self.enabled:
+            yield span
+            return
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.end = time.perf_counter()
+            with self.lock:
+                self.spans.append(span)
+
+    def add_bytes(self, count: int):
+        """Count bytes processed towards the innermost open span of this thread."""
+        stack = self.local.__dict__.get("stack")
+        if stack:
+            stack[-1].add_bytes(count)
+
+    def chrome_trace(self) -> dict:
+        """The spans in the Chrome trace event format (also read by Perfetto)."""
+        pid = getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "psbuilder"}}]
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        for span in spans:
+            args = dict(span.args)
+            if span.package:
+                args["package"] = span.package
+            if span.bytes:
+                args["bytes"] = span.bytes
+            events.append({
+                "name": span.name,
+                "cat": span.package or "toolchain",
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6),
+                "dur": round(span.duration * 1e6),
+                "pid": pid,
+                "tid": span.thread,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, filename: str):
+        makedirs(dirname(realpath(filename)), exist_ok=True)
+        with open(filename, "w") as fp:
+            json.dump(self.chrome_trace(), fp)
+
+    def summary(self) -> str:
+        """Wall time, count and bytes per package and phase (nested phases are included in their parents)."""
+        totals: dict[tuple[str, str], list] = {}
+        with self.lock:
+            for span in self.spans:
+                total = totals.setdefault((span.package or "-", span.name), [0, 0.0, 0])
+                total[0] += 1
+                total[1] += span.duration
+                total[2] += span.bytes
+        lines = ["{:<20} {:<32} {:>6} {:>10} {:>14}".format("package", "phase", "count", "seconds", "bytes")]
+        for (package, name), (count, seconds, size) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append("{:<20} {:<32} {:>6} {:>10.3f} {:>14}".format(package, name, count, seconds, size))
+        return "\n".join(lines)
+
+
+tracer = Tracer()
+
+
+def span(name: str, package: str | None = None, **args):
+    return tracer.span(name, package, **args)
+
+
+def add_bytes(count: int):
+    tracer.add_bytes(count)
+
+
+def traced(func: Callable) -> Callable:
+    """Record calls of a SwiftPackage method as a span named after it."""
+    @wraps(func)
+    def traced_func(self, *args, **kwargs):
+        with tracer.span(func.__name__, self.name):
+            return func(self, *args, **kwargs)
+    return traced_func
@@ -1,8 +1,18 @@
-from os.path import join, dirname, realpath, exists, isdir, basename, splitext
-from os import listdir, unlink, makedirs, environ, chdir, getcwd, walk
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext, abspath, relpath
+from os import listdir, unlink, makedirs, environ, chdir, getcwd, walk, fsync, replace, stat
+from contextlib import contextmanager
+from typing import Callable
+from functools import wraps
+from datetime import datetime, timezone
+from threading import RLock
+import threading
+import fcntl
+import hashlib
+import sqlite3
+import time
 from kivy_ios.toolchain import ensure_dir, logger
+from .archive import zip_tree, CompressionPolicy, DEFAULT_COMPRESSION
 import json
-import sh
 
 class ChangeDir:
     last_path: None
@@ -23,66 +33,522 @@ class ChangeDir:
         
 class JsonStore:
     """Replacement of shelve using json, needed for support python 2 and 3.
+
+    Writes are atomic (temporary file + rename). Inside `batch()` changes are
+    kept in an overlay of the thread and only committed, in one write, when
+    its outermost batch exits; other threads do not see them before. In
+    journal mode changes are appended to `<filename>.journal` and folded back
+    into the main file every `compact_after` entries.
+
+    A locked store can be shared by several processes: commits take a file
+    lock, read the file again and save it with this thread's changes merged
+    in. reload() picks up what other processes committed.
     """
 
-    def __init__(self, filename):
+    _DELETED = object()
+
+    def __init__(self, filename, journal: bool = False, compact_after: int = 256, locked: bool = False):
+        if journal and locked:
+            raise ValueError("A locked JsonStore has no journal")
         self.filename = filename
+        self.journal = journal
+        self.compact_after = compact_after
+        self.locked = locked
+        self.data = {}
+        self.lock = RLock()
+        self._local = threading.local()
+        self._journal_size = 0
+        self._load()
+
+    @property
+    def journal_filename(self) -> str:
+        return f"{self.filename}.journal"
+
+    @property
+    def lock_filename(self) -> str:
+        return f"{self.filename}.lock"
+
+    @property
+    def process_safe(self) -> bool:
+        return self.locked
+
+    @property
+    def _batch_depth(self) -> int:
+        # per thread: a batch of one thread does not defer the writes of another
+        return getattr(self._local, "batch_depth", 0)
+
+    @_batch_depth.setter
+    def _batch_depth(self, depth: int):
+        self._local.batch_depth = depth
+
+    @property
+    def _pending(self) -> dict:
+        """Uncommitted changes of this thread's batch, _DELETED for removed keys."""
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def __getitem__(self, key):
+        value = self.get(key, self._DELETED)
+        if value is self._DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._write(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write(key, self._DELETED)
+
+    def __contains__(self, item):
+        return self.get(item, self._DELETED) is not self._DELETED
+
+    def get(self, item, default=None):
+        pending = self._pending
+        if item in pending:
+            value = pending[item]
+            return default if value is self._DELETED else value
+        return self.data.get(item, default)
+
+    def keys(self):
+        pending = self._pending
+        if not pending:
+            return self.data.keys()
+        with self.lock:
+            keys = dict.fromkeys(self.data)
+        keys.update(pending)
+        return [key for key in keys if pending.get(key) is not self._DELETED]
+
+    def set(self, key, value):
+        """Set key and record when it was set in "<key>.at"."""
+        with self.batch():
+            self[key] = value
+            self["{}.at".format(key)] = str(datetime.utcnow())
+
+    def updated_at(self, key) -> datetime | None:
+        at = self.get("{}.at".format(key))
+        return datetime.fromisoformat(at) if at else None
+
+    def remove_all(self, prefix):
+        with self.batch():
+            for key in tuple(self.keys()):
+                if not key.startswith(prefix):
+                    continue
+                del self[key]
+
+    @contextmanager
+    def batch(self):
+        """Defer writes until the outermost batch of this thread exits, then commit once.
+
+        Changes made before an exception are still committed, they describe
+        steps that did complete. Unlike with kivy_ios' JsonStore the lock is not
+        held while the batch runs: other threads keep reading and writing, their
+        writes are not deferred and do not carry this batch's changes.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.commit()
+
+    def commit(self):
+        """Apply and save the pending changes of this thread."""
+        pending = self._pending
+        if not pending:
+            return
+        ops = [["del", key] if value is self._DELETED else ["set", key, value] for key, value in pending.items()]
+        pending.clear()
+        with self.lock:
+            if self.locked:
+                with file_lock(self.lock_filename):
+                    self._load()
+                    for op in ops:
+                        self._apply(op)
+                    self.sync()
+                return
+            for op in ops:
+                self._apply(op)
+            if self.journal:
+                self._append_journal(ops)
+            else:
+                self.sync()
+
+    def reload(self):
+        """Read the committed state again, with the changes of other processes."""
+        with self.lock:
+            self._load()
+
+    def sync(self):
+        with self.lock:
+            atomic_write_json(self.filename, self.data)
+            if exists(self.journal_filename):
+                unlink(self.journal_filename)
+            self._journal_size = 0
+
+    compact = sync
+
+    def _load(self):
         self.data = {}
-        if exists(filename):
+        self._journal_size = 0
+        if exists(self.filename):
             try:
-                with open(filename, encoding='utf-8') as fd:
+                with open(self.filename, encoding='utf-8') as fd:
                     self.data = json.load(fd)
             except ValueError:
                 print("Unable to read the state.db, content will be replaced.")
+        self._replay_journal()
+
+    def _write(self, key, value):
+        self._pending[key] = value
+        if self._batch_depth == 0:
+            self.commit()
+
+    def _apply(self, op: list):
+        match op:
+            case ["set", key, value]:
+                self.data[key] = value
+            case ["del", key]:
+                self.data.pop(key, None)
+
+    def _append_journal(self, ops: list[list]):
+        makedirs(dirname(abspath(self.filename)), exist_ok=True)
+        with open(self.journal_filename, "a", encoding="utf-8") as fd:
+            for op in ops:
+                fd.write(json.dumps(op, ensure_ascii=False))
+                fd.write("\n")
+            fd.flush()
+            fsync(fd.fileno())
+        self._journal_size += len(ops)
+        if self._journal_size >= self.compact_after:
+            self.compact()
+
+    def _replay_journal(self):
+        if not exists(self.journal_filename):
+            return
+        with open(self.journal_filename, encoding="utf-8") as fd:
+            for line in fd:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the journal, fold what was
+                    # readable into the main file so appends start clean
+                    self.compact()
+                    return
+                self._apply(op)
+                self._journal_size += 1
+
+
+class SqliteStore:
+    """JsonStore compatible state store backed by sqlite in WAL mode.
+
+    Keys are indexed, so prefix queries and `remove_all` do not scan the whole
+    store, and the time a key was last set is kept in its own column. Every
+    thread gets its own connection; several processes can read and write the
+    same database concurrently.
+    """
+
+    _DELETED = object()
+    process_safe = True
+
+    def __init__(self, filename, migrate_from: str | None = None, timeout: float = 60.0):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+        makedirs(dirname(abspath(filename)), exist_ok=True)
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if migrate_from:
+            self.migrate_from_json(migrate_from)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.depth = 0
+            self._local.pending = {}
+        return db
 
     def __getitem__(self, key):
-        return self.data[key]
+        value = self.get(key, self._DELETED)
+        if value is self._DELETED:
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key, value):
-        self.data[key] = value
-        self.sync()
+        self._write(key, value)
 
     def __delitem__(self, key):
-        del self.data[key]
-        self.sync()
+        if key not in self:
+            raise KeyError(key)
+        self._write(key, self._DELETED)
 
     def __contains__(self, item):
-        return item in self.data
+        return self.get(item, self._DELETED) is not self._DELETED
 
     def get(self, item, default=None):
-        return self.data.get(item, default)
+        db = self._connection()
+        pending = self._local.pending
+        if item in pending:
+            value = pending[item][0]
+            return default if value is self._DELETED else value
+        row = db.execute("SELECT value FROM state WHERE key = ?", (item,)).fetchone()
+        return json.loads(row[0]) if row else default
 
-    def keys(self):
-        return self.data.keys()
+    def keys(self, prefix: str = ""):
+        return [key for key, _ in self.items(prefix)]
+
+    def items(self, prefix: str = "") -> list[tuple[str, object]]:
+        self.commit()
+        return [
+            (key, json.loads(value))
+            for key, value in self._connection().execute(
+                "SELECT key, value FROM state WHERE " + self._prefix_clause(prefix) + " ORDER BY key",
+                self._prefix_args(prefix)
+            )
+        ]
+
+    def set(self, key, value):
+        self._write(key, value)
+
+    def updated_at(self, key) -> datetime | None:
+        self.commit()
+        row = self._connection().execute("SELECT updated_at FROM state WHERE key = ?", (key,)).fetchone()
+        return datetime.utcfromtimestamp(row[0]) if row else None
 
     def remove_all(self, prefix):
-        for key in tuple(self.data.keys()):
-            if not key.startswith(prefix):
-                continue
-            del self.data[key]
-        self.sync()
+        self.commit()
+        self._connection().execute(
+            "DELETE FROM state WHERE " + self._prefix_clause(prefix),
+            self._prefix_args(prefix)
+        )
+
+    @contextmanager
+    def batch(self):
+        """Collect writes of this thread and commit them in one transaction
+        when the outermost batch exits (also when it exits with an error)."""
+        self._connection()
+        self._local.depth += 1
+        try:
+            yield self
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self.commit()
+
+    def commit(self):
+        db = self._connection()
+        pending: dict = self._local.pending
+        if not pending:
+            return
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for key, (value, at) in pending.items():
+                if value is self._DELETED:
+                    db.execute("DELETE FROM state WHERE key = ?", (key,))
+                else:
+                    db.execute(
+                        "INSERT INTO state (key, value, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                        (key, json.dumps(value, ensure_ascii=False), at)
+                    )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        pending.clear()
 
     def sync(self):
-        with open(self.filename, 'w') as fd:
-            json.dump(self.data, fd, ensure_ascii=False)
+        self.commit()
+
+    def reload(self):
+        # reads always go to the database
+        pass
+
+    def close(self):
+        self.commit()
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def migrate_from_json(self, json_filename: str) -> int:
+        """Import a JsonStore file (and its journal) once. Returns the number of keys imported."""
+        done_key = "migrated:{}".format(abspath(json_filename))
+        db = self._connection()
+        if db.execute("SELECT 1 FROM meta WHERE key = ?", (done_key,)).fetchone():
+            return 0
+        if not exists(json_filename) and not exists(f"{json_filename}.journal"):
+            return 0
+        data = JsonStore(json_filename, journal=True).data
+        # "<key>.at" timestamps of JsonStore.set become the updated_at of their key
+        stamps = {key for key in data if key.endswith(".at") and key.removesuffix(".at") in data}
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for key, value in data.items():
+                if key in stamps:
+                    continue
+                at = now
+                stamp = data.get("{}.at".format(key))
+                if isinstance(stamp, str):
+                    try:
+                        at = datetime.fromisoformat(stamp).replace(tzinfo=timezone.utc).timestamp()
+                    except ValueError:
+                        pass
+                db.execute(
+                    "INSERT OR IGNORE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), at)
+                )
+            db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (done_key, str(datetime.utcnow())))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        imported = len(data) - len(stamps)
+        logger.info("Migrated {} keys from {} to {}".format(imported, json_filename, self.filename))
+        return imported
+
+    def _write(self, key, value):
+        self._connection()
+        self._local.pending[key] = (value, time.time())
+        if self._local.depth == 0:
+            self.commit()
+
+    @staticmethod
+    def _prefix_clause(prefix: str) -> str:
+        return "key >= ? AND key < ?" if prefix else "1"
+
+    @staticmethod
+    def _prefix_args(prefix: str) -> tuple:
+        if not prefix:
+            return ()
+        # upper bound of the key range sharing `prefix`, so the primary key index is used
+        return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def open_state_store(filename: str, shared: bool = False):
+    """State store for a `<name>.db` JsonStore path, of PSBUILDER_STATE_BACKEND (json or sqlite).
+
+    A shared store is also read and written by kivy_ios itself, it defaults to
+    a plain JsonStore file (no journal) kivy_ios can read. Others default to sqlite.
+    """
+    if environ.get("PSBUILDER_STATE_BACKEND", "json" if shared else "sqlite") == "json":
+        # a shared store is also used by concurrent recipe builds, from several processes
+        return JsonStore(filename, journal=not shared, locked=shared)
+    return SqliteStore(f"{splitext(filename)[0]}.sqlite", migrate_from=filename)
+
+
+@contextmanager
+def file_lock(filename: str):
+    """Exclusive lock, between processes, on filename (created when missing)."""
+    makedirs(dirname(abspath(filename)), exist_ok=True)
+    with open(filename, "a") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def atomic_write_json(filename: str, data):
+    makedirs(dirname(abspath(filename)), exist_ok=True)
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fd:
+        json.dump(data, fd, ensure_ascii=False)
+        fd.flush()
+        fsync(fd.fileno())
+    replace(tmp, filename)
             
             
+def tree_manifest(path: str) -> list[list]:
+    """Sorted (relative path, size, mtime_ns) of every file below path."""
+    if not exists(path):
+        return []
+    if not isdir(path):
+        st = stat(path)
+        return [[basename(path), st.st_size, st.st_mtime_ns]]
+    manifest = []
+    for dir_path, dir_names, file_names in walk(path, followlinks=True):
+        dir_names.sort()
+        for fn in sorted(file_names):
+            file_path = join(dir_path, fn)
+            try:
+                st = stat(file_path)
+            except FileNotFoundError:
+                continue
+            manifest.append([relpath(file_path, path), st.st_size, st.st_mtime_ns])
+    return manifest
+
+
+def fingerprint(inputs) -> str:
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def step_key(name: str, step: str, args: tuple) -> str:
+    key = "{}.{}".format(name, step)
+    for arg in args:
+        key += ".{}".format(arg)
+    return key
+
+
+def step_status(obj, step: str, *args) -> str:
+    """State of a cache_execution step: "cached", "changed" (inputs differ) or "run"."""
+    state = obj.ctx.packages_state
+    key = step_key(obj.name, step, args)
+    if key not in state:
+        return "run"
+    get_fingerprint = getattr(obj, "fingerprint", None)
+    if get_fingerprint is None or state.get("{}.fingerprint".format(key)) == get_fingerprint(step, *args):
+        return "cached"
+    return "changed"
+
+
 def cache_execution(f):
+    """Run a step once per state key, again when its inputs changed.
+
+    If the instance provides `fingerprint(step, *args)`, the digest of the
+    step's inputs is stored as "<key>.fingerprint" after the step ran, and
+    a cached step only counts as done while that digest still matches.
+    """
+    @wraps(f)
     def _cache_execution(self, *args, **kwargs):
         state = self.ctx.packages_state
-        key = "{}.{}".format(self.name, f.__name__)
+        key = step_key(self.name, f.__name__, args)
         force = kwargs.pop("force", False)
-        if args:
-            for arg in args:
-                key += ".{}".format(arg)
-        if key in state and not force:
+        key_fingerprint = "{}.fingerprint".format(key)
+        get_fingerprint = getattr(self, "fingerprint", None)
+        status = "run" if force else step_status(self, f.__name__, *args)
+        if status == "cached":
             logger.info("Cached result: {} {}. Ignoring".format(f.__name__.capitalize(), self.name))
             return
+        if status == "changed":
+            logger.info("Inputs of {} {} changed".format(f.__name__, self.name))
         logger.info("{} {}".format(f.__name__.capitalize(), self.name))
         f(self, *args, **kwargs)
-        self.update_state(key, True)
+        with state.batch():
+            self.update_state(key, True)
+            if get_fingerprint is not None:
+                # taken after the step, as steps may prepare their own inputs
+                state[key_fingerprint] = get_fingerprint(f.__name__, *args)
     return _cache_execution
 
 
-def zip_to_path(src: str, destination: str):
-    sh.zip("-r", join(destination, f"{basename(src)}.zip"), src)
\ No newline at end of file
+def zip_to_path(
+        src: str, destination: str, policy: CompressionPolicy | None = DEFAULT_COMPRESSION,
+        exclude: Callable[[str], bool] | None = None) -> str:
+    return zip_tree(src, join(destination, f"{basename(src)}.zip"), policy=policy, exclude=exclude)
\ No newline at end of file
@@ -0,0 +1,18 @@
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Paths hashed by the artifact cache and the binary targets, in call order."""
+    calls = []
+
+    def sha256_file(path):
+        calls.append(path)
+        with open(path, "rb") as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    monkeypatch.setattr("psbuilder.artifacts.sha256_file", sha256_file)
+    monkeypatch.setattr("psbuilder.targets.sha256_file", sha256_file)
+    return calls
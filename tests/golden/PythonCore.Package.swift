@@ -0,0 +1,40 @@
+// swift-tools-version: 5.9
+// The swift-tools-version declares the minimum version of Swift required to build this package.
+
+import PackageDescription
+
+let package = Package(
+    name: "PythonCore",
+    platforms: [.iOS(.v13), .macOS(.v11)],
+    products: [
+        .library(
+            name: "PythonCore",
+            targets: ["PythonCore", "libpython3.11"]
+        ),
+        .library(
+            name: "PythonLibrary",
+            targets: ["PythonLibrary"]
+        ),
+    ],
+    dependencies: [],
+    targets: [
+        .target(
+            name: "PythonCore",
+            dependencies: [
+                .target(name: "libpython3.11", condition: .when(platforms: [.iOS])),
+            ]
+        ),
+        .target(
+            name: "PythonLibrary",
+            dependencies: [],
+            resources: [
+                .copy("lib"),
+            ]
+        ),
+        .binaryTarget(
+            name: "libpython3.11",
+            url: "https://github.com/kv-swift/PythonCore/releases/download/311.0.3/libpython3.11.zip",
+            checksum: "cdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcd"
+        ),
+    ]
+)
@@ -0,0 +1,40 @@
+// swift-tools-version: 5.9
+// The swift-tools-version declares the minimum version of Swift required to build this package.
+
+import PackageDescription
+
+let package = Package(
+    name: "SDL2Core",
+    platforms: [.iOS(.v13)],
+    products: [
+        .library(
+            name: "SDL2Core",
+            targets: ["SDL2Core", "libSDL2"]
+        ),
+    ],
+    dependencies: [
+        .package(url: "https://github.com/kv-swift/PythonCore", .upToNextMajor(from: "311.0.0")),
+        .package(url: "https://github.com/kv-swift/ImageCore", exact: "311.0.1"),
+    ],
+    targets: [
+        .target(
+            name: "SDL2Core",
+            dependencies: [
+                "libSDL2",
+                .product(name: "libpng", package: "ImageCore", condition: .when(platforms: [.iOS])),
+            ],
+            resources: [
+                .copy("lib"),
+            ],
+            linkerSettings: [
+                .linkedFramework("AudioToolbox"),
+                .linkedLibrary("ncurses", .when(platforms: [.macOS])),
+            ]
+        ),
+        .binaryTarget(
+            name: "libSDL2",
+            url: "https://github.com/kv-swift/SDL2Core/releases/download/311.0.1/libSDL2.zip",
+            checksum: "abababababababababababababababababababababababababababababababab"
+        ),
+    ]
+)
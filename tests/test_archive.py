@@ -0,0 +1,160 @@
+import hashlib
+import os
+import stat
+import zipfile
+import zlib
+
+from psbuilder import archive
+from psbuilder.archive import ZipWriter, zip_tree
+
+
+def make_tree(root, files=12):
+    (root / "pkg" / "sub").mkdir(parents=True)
+    (root / "pkg" / "empty").mkdir()
+    for i in range(files):
+        (root / "pkg" / "sub" / f"mod{i}.py").write_text(f"VALUE = {i}\n" * (i + 1) * 50)
+    (root / "pkg" / "data.bin").write_bytes(os.urandom(4096))
+    return root / "pkg"
+
+
+def tree_contents(src):
+    contents = {}
+    for path in sorted(src.rglob("*")):
+        name = f"{src.name}/{path.relative_to(src).as_posix()}"
+        contents[f"{name}/" if path.is_dir() else name] = None if path.is_dir() else path.read_bytes()
+    contents[f"{src.name}/"] = None
+    return contents
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {info.filename: None if info.is_dir() else zf.read(info) for info in zf.infolist()}
+
+
+def test_thread_pool_keeps_order(tmp_path):
+    src = make_tree(tmp_path / "src", files=40)
+    destination = tmp_path / "pkg.zip"
+    with ZipWriter(str(destination), workers=4) as writer:
+        assert writer.max_pending == 8
+        writer.add_tree(str(src))
+    contents = read_zip(destination)
+    assert list(contents) == sorted(contents)
+    assert contents == tree_contents(src)
+    assert writer.bytes_in == sum(len(data) for data in contents.values() if data)
+
+
+def test_spooled_members(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "SPOOL_SIZE", 64)
+    rolled = []
+    compress_member = archive.compress_member
+
+    def spy(member, level, spool_dir=None):
+        compressed = compress_member(member, level, spool_dir)
+        if compressed.data:
+            rolled.append((compressed.data._rolled, compressed.compress_size > archive.SPOOL_SIZE))
+        return compressed
+
+    monkeypatch.setattr(archive, "compress_member", spy)
+    src = make_tree(tmp_path / "src")
+    zip_tree(str(src), str(tmp_path / "pkg.zip"), workers=2)
+    # members larger than SPOOL_SIZE go to disk, the others stay in memory
+    assert all(on_disk == large for on_disk, large in rolled)
+    assert (True, True) in rolled and (False, False) in rolled
+    assert read_zip(tmp_path / "pkg.zip") == tree_contents(src)
+    assert sorted(os.listdir(tmp_path)) == ["pkg.zip", "pkg.zip.sha256", "src"]
+
+
+def test_zip64_entry_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ZIP_MAX_ENTRIES", 5)
+    src = make_tree(tmp_path / "src")
+    zip_tree(str(src), str(tmp_path / "pkg.zip"))
+    data = (tmp_path / "pkg.zip").read_bytes()
+    assert data.find(b"PK\x06\x06") != -1
+    assert read_zip(tmp_path / "pkg.zip") == tree_contents(src)
+
+
+def test_zip64_sizes(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ZIP64_LIMIT", 1024)
+    src = make_tree(tmp_path / "src")
+    zip_tree(str(src), str(tmp_path / "pkg.zip"))
+    with zipfile.ZipFile(tmp_path / "pkg.zip") as zf:
+        info = zf.getinfo("pkg/data.bin")
+        assert info.file_size == 4096
+        assert info.extract_version == 45
+    assert read_zip(tmp_path / "pkg.zip") == tree_contents(src)
+
+
+def test_symlink_entries(tmp_path):
+    src = make_tree(tmp_path / "src", files=1)
+    os.link(src / "data.bin", src / "sub" / "linked.bin")
+    zip_tree(str(src), str(tmp_path / "pkg.zip"), dedup_links=True)
+    contents = read_zip(tmp_path / "pkg.zip")
+    with zipfile.ZipFile(tmp_path / "pkg.zip") as zf:
+        info = zf.getinfo("pkg/sub/linked.bin")
+        assert stat.S_ISLNK(info.external_attr >> 16)
+        assert not stat.S_ISLNK(zf.getinfo("pkg/data.bin").external_attr >> 16)
+    assert contents["pkg/sub/linked.bin"] == b"../data.bin"
+    assert contents["pkg/data.bin"] == (src / "data.bin").read_bytes()
+
+    zip_tree(str(src), str(tmp_path / "copies.zip"))
+    assert read_zip(tmp_path / "copies.zip")["pkg/sub/linked.bin"] == (src / "data.bin").read_bytes()
+
+
+def test_deterministic_archives(tmp_path, monkeypatch):
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1700000000")
+    first = make_tree(tmp_path / "first")
+    os.chmod(first / "data.bin", 0o755)
+    zip_tree(str(first), str(tmp_path / "first.zip"), workers=1)
+
+    second = tmp_path / "second" / "pkg"
+    (second / "empty").mkdir(parents=True)
+    (second / "sub").mkdir()
+    # created in another order, with other mtimes and permission bits
+    for path in reversed(sorted(first.rglob("*.py"))):
+        copy = second / path.relative_to(first)
+        copy.write_bytes(path.read_bytes())
+        os.chmod(copy, 0o600)
+        os.utime(copy, (1234567890, 1234567890))
+    (second / "data.bin").write_bytes((first / "data.bin").read_bytes())
+    os.chmod(second / "data.bin", 0o700)
+    zip_tree(str(second), str(tmp_path / "second.zip"), workers=4)
+
+    assert (tmp_path / "first.zip").read_bytes() == (tmp_path / "second.zip").read_bytes()
+    sha256 = hashlib.sha256((tmp_path / "first.zip").read_bytes()).hexdigest()
+    assert archive.read_checksum_file(str(tmp_path / "first.zip")) == sha256
+    assert (tmp_path / "second.zip.sha256").read_text() == f"{sha256}  second.zip\n"
+    with zipfile.ZipFile(tmp_path / "first.zip") as zf:
+        assert {info.date_time for info in zf.infolist()} == {(2023, 11, 14, 22, 13, 20)}
+        assert zf.getinfo("pkg/data.bin").external_attr >> 16 == stat.S_IFREG | 0o755
+        assert zf.getinfo("pkg/sub/mod0.py").external_attr >> 16 == stat.S_IFREG | 0o644
+
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1710000000")
+    zip_tree(str(first), str(tmp_path / "later.zip"))
+    assert (tmp_path / "later.zip").read_bytes() != (tmp_path / "first.zip").read_bytes()
+
+
+def test_compression_policy_levels(tmp_path):
+    src = tmp_path / "pkg"
+    src.mkdir()
+    text = b"".join(b"line %d of a compressible file\n" % i for i in range(2000))
+    for name in ("a.py", "b.txt", "c.png", "d.so"):
+        (src / name).write_bytes(text)
+    policy = archive.CompressionPolicy([("*.png", 0), ("pkg/*.txt", 1), ("*.so", 9)])
+    assert policy.level_for("pkg/a.py", 6) == 6
+    assert policy.level_for("pkg/sub/c.png", 6) == 0
+    zip_tree(str(src), str(tmp_path / "pkg.zip"), level=6, policy=policy)
+
+    def deflated_size(level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return len(compressor.compress(text) + compressor.flush())
+
+    with zipfile.ZipFile(tmp_path / "pkg.zip") as zf:
+        assert zf.testzip() is None
+        png = zf.getinfo("pkg/c.png")
+        assert (png.compress_type, png.compress_size) == (zipfile.ZIP_STORED, len(text))
+        for name, level in (("a.py", 6), ("b.txt", 1), ("d.so", 9)):
+            info = zf.getinfo(f"pkg/{name}")
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert info.compress_size == deflated_size(level)
+    assert deflated_size(1) != deflated_size(6)
@@ -0,0 +1,51 @@
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.artifacts import ArtifactCache
+
+URL = "https://example.com/releases/libfoo.zip"
+
+
+def add(cache, tmp_path, content=b"content"):
+    tmp = tmp_path / "download"
+    tmp.write_bytes(content)
+    return cache.add(URL, str(tmp), hashlib.sha256(content).hexdigest(), verified=True)
+
+
+def test_lookup_trusts_unchanged_objects(tmp_path, hashed):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    path = add(cache, tmp_path)
+    assert cache.lookup(URL) == path
+    assert ArtifactCache(cache.root).lookup(URL) == path
+    assert hashed == []
+
+
+def test_lookup_verifies_changed_objects_once(tmp_path, hashed):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    path = add(cache, tmp_path)
+    os.utime(path, ns=(0, 0))
+    assert cache.lookup(URL) == path
+    assert cache.lookup(URL) == path
+    assert hashed == [path]
+
+
+def test_lookup_drops_corrupt_objects(tmp_path, hashed):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    path = add(cache, tmp_path)
+    with open(path, "wb") as fp:
+        fp.write(b"corrupt")
+    assert cache.lookup(URL) is None
+    assert not os.path.exists(path)
+    assert cache.entries() == {}
+
+
+def test_lookup_of_missing_object(tmp_path, hashed):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    path = add(cache, tmp_path)
+    os.unlink(path)
+    assert cache.lookup(URL) is None
+    assert cache.entries() == {}
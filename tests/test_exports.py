@@ -0,0 +1,72 @@
+import inspect
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.checksums import ChecksumIndex
+from psbuilder.exports import ExportManifest
+from psbuilder.package import SwiftPackage
+
+
+class Package(SwiftPackage):
+    targets = []
+
+    def __init__(self, root, xcframeworks):
+        self.ctx = SimpleNamespace(swift_packages=str(root / "packages"), checksums=ChecksumIndex(str(root / "checksums.json")))
+        self.xcframeworks = xcframeworks
+
+    def get_all_xcframeworks(self):
+        yield from self.xcframeworks
+
+    def export(self):
+        inspect.unwrap(SwiftPackage.zip_xc_frameworks_to_export)(self)
+        return self.export_manifest
+
+
+def xcframework(root, name, content):
+    xc = root / "dist" / f"{name}.xcframework"
+    (xc / "ios-arm64").mkdir(parents=True, exist_ok=True)
+    (xc / "ios-arm64" / f"{name}.a").write_text(content)
+    return str(xc)
+
+
+def test_upload_lists_only_rezipped_targets(tmp_path):
+    package = Package(tmp_path, [xcframework(tmp_path, "libfoo", "foo"), xcframework(tmp_path, "libbar", "bar")])
+    assert sorted(package.export().upload) == ["libbar.zip", "libfoo.zip"]
+    assert package.export().upload == []
+
+    xcframework(tmp_path, "libfoo", "foo 2")
+    package.version = "311.0.1"
+    manifest = package.export()
+    assert manifest.upload == ["libfoo.zip"]
+    assert manifest.get("libbar").version == "311.0.0"
+    assert manifest.get("libfoo").version == "311.0.1"
+
+
+def test_export_manifest_is_read_once(tmp_path):
+    package = Package(tmp_path, [])
+    assert package.export_manifest is package.export_manifest
+
+
+def test_unreadable_manifest(tmp_path, caplog):
+    filename = tmp_path / "export_manifest.json"
+    filename.write_text("{")
+    with caplog.at_level(logging.WARNING):
+        manifest = ExportManifest(str(filename))
+    assert manifest.targets == {} and manifest.upload == []
+    assert "Unable to read" in caplog.text
+
+
+def test_manifest_round_trip(tmp_path):
+    filename = str(tmp_path / "export_manifest.json")
+    manifest = ExportManifest(filename)
+    manifest.record("libfoo", "libfoo.zip", "fingerprint", "311.0.0", "ab" * 32)
+    manifest.upload = ["libfoo.zip"]
+    manifest.sync()
+    with open(filename) as fp:
+        assert json.load(fp) == manifest.dump
+    assert ExportManifest(filename).dump == manifest.dump
@@ -0,0 +1,144 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.fetch import Fetcher, FetchError, ChecksumMismatch
+
+DATA = bytes(range(256)) * 4096
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", "/file")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path != "/file":
+            self.send_error(404)
+            return
+        if server.failures:
+            server.failures -= 1
+            self.send_error(503)
+            return
+        start = 0
+        if self.headers.get("Range") and server.ranges:
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(DATA) - 1, len(DATA)))
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if server.truncate:
+            # drop the connection halfway through the body
+            server.truncate -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []
+    server.failures = 0
+    server.truncate = 0
+    server.ranges = True
+    thread = Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = Fetcher(retries=2, backoff=0, timeout=5)
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch(server, fetcher, tmp_path):
+    destination = str(tmp_path / "file.zip")
+    assert fetcher.fetch(server.url + "/file", destination, SHA256) == SHA256
+    with open(destination, "rb") as fp:
+        assert fp.read() == DATA
+    assert not os.path.exists(destination + ".part")
+
+
+def test_resume_part_file_with_range(server, fetcher, tmp_path):
+    destination = tmp_path / "file.zip"
+    (tmp_path / "file.zip.part").write_bytes(DATA[:1000])
+    assert fetcher.fetch(server.url + "/file", str(destination), SHA256) == SHA256
+    assert destination.read_bytes() == DATA
+    assert server.requests == [("/file", "bytes=1000-")]
+
+
+def test_restart_without_range_support(server, fetcher, tmp_path):
+    server.ranges = False
+    destination = tmp_path / "file.zip"
+    (tmp_path / "file.zip.part").write_bytes(b"x" * 1000)
+    assert fetcher.fetch(server.url + "/file", str(destination), SHA256) == SHA256
+    assert destination.read_bytes() == DATA
+
+
+def test_retry_server_errors(server, fetcher, tmp_path):
+    server.failures = 2
+    assert fetcher.fetch(server.url + "/file", str(tmp_path / "file.zip"), SHA256) == SHA256
+    assert len(server.requests) == 3
+
+
+def test_give_up_after_retries(server, fetcher, tmp_path):
+    server.failures = 3
+    with pytest.raises(FetchError, match="after 3 attempts"):
+        fetcher.fetch(server.url + "/file", str(tmp_path / "file.zip"))
+
+
+def test_resume_after_dropped_connection(server, fetcher, tmp_path):
+    server.truncate = 1
+    destination = tmp_path / "file.zip"
+    assert fetcher.fetch(server.url + "/file", str(destination), SHA256) == SHA256
+    assert destination.read_bytes() == DATA
+    assert server.requests[-1] == ("/file", "bytes={}-".format(len(DATA) // 2))
+
+
+def test_follow_redirects(server, fetcher, tmp_path):
+    assert fetcher.fetch(server.url + "/redirect", str(tmp_path / "file.zip"), SHA256) == SHA256
+    assert [path for path, range in server.requests] == ["/redirect", "/file"]
+
+
+def test_client_errors_are_not_retried(server, fetcher, tmp_path):
+    with pytest.raises(FetchError, match="404"):
+        fetcher.fetch(server.url + "/missing", str(tmp_path / "file.zip"))
+    assert len(server.requests) == 1
+
+
+def test_checksum_mismatch(server, fetcher, tmp_path):
+    destination = tmp_path / "file.zip"
+    with pytest.raises(ChecksumMismatch):
+        fetcher.fetch(server.url + "/file", str(destination), "0" * 64)
+    assert not destination.exists()
+    assert not (tmp_path / "file.zip.part").exists()
+
+
+def test_fetch_many(server, fetcher, tmp_path):
+    downloads = [(server.url + "/file", str(tmp_path / f"{index}.zip"), SHA256) for index in range(3)]
+    assert fetcher.fetch_many(downloads) == [SHA256] * 3
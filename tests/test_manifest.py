@@ -0,0 +1,110 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from psbuilder.manifest import render_package_swift
+
+GOLDEN = join(dirname(realpath(__file__)), "golden")
+
+# shaped like the dumps of packages/, one of each dependency, target and setting kind
+DUMPS = {
+    "SDL2Core": {
+        "name": "SDL2Core",
+        "macos": False,
+        "version": "311.0.1",
+        "products": [{"name": "SDL2Core", "targets": ["SDL2Core", "libSDL2"]}],
+        "dependencies": [
+            {"type": "upToNextMajor", "url": "https://github.com/kv-swift/PythonCore", "version": "311.0.0"},
+            {"type": "extact", "url": "https://github.com/kv-swift/ImageCore", "version": "311.0.1"},
+        ],
+        "targets": [
+            {"type": "target", "data": {
+                "name": "SDL2Core",
+                "dependencies": [
+                    {"type": "string", "data": "libSDL2"},
+                    {"type": "dependency", "data": {
+                        "type": "product", "name": "libpng", "package": "ImageCore",
+                        "condition": {"platforms": ["ios"]},
+                    }},
+                ],
+                "resources": [{"kind": "copy", "path": "lib"}],
+                "linker_settings": [
+                    {"kind": "framework", "name": "AudioToolbox", "condition": None},
+                    {"kind": "library", "name": "ncurses", "condition": {"platform": "macos"}},
+                ],
+                "plugins": [],
+            }},
+            {"type": "binary", "data": {
+                "name": "libSDL2",
+                "url": "https://github.com/kv-swift/SDL2Core/releases/download/311.0.1/libSDL2.zip",
+                "checksum": "ab" * 32,
+            }},
+        ],
+    },
+    "PythonCore": {
+        "name": "PythonCore",
+        "macos": True,
+        "version": "311.0.3",
+        "products": [
+            {"name": "PythonCore", "targets": ["PythonCore", "libpython3.11"]},
+            {"name": "PythonLibrary", "targets": ["PythonLibrary"]},
+        ],
+        "dependencies": [],
+        "targets": [
+            {"type": "target", "data": {
+                "name": "PythonCore",
+                "dependencies": [{"type": "target", "data": "libpython3.11", "condition": {"platform": "ios"}}],
+                "resources": [],
+                "linker_settings": [],
+                "plugins": [],
+            }},
+            {"type": "target", "data": {
+                "name": "PythonLibrary",
+                "dependencies": [],
+                "resources": [{"kind": "copy", "path": "lib"}],
+                "linker_settings": [],
+                "plugins": [],
+            }},
+            {"type": "binary", "data": {
+                "name": "libpython3.11",
+                "url": "https://github.com/kv-swift/PythonCore/releases/download/311.0.3/libpython3.11.zip",
+                "checksum": "cd" * 32,
+            }},
+        ],
+    },
+}
+
+
+def golden(name: str) -> str:
+    with open(join(GOLDEN, f"{name}.Package.swift")) as fp:
+        return fp.read()
+
+
+# regression goldens of the renderer itself, not of SwiftPackageWriter
+@pytest.mark.parametrize("name", sorted(DUMPS))
+def test_render_matches_golden(name):
+    assert render_package_swift(DUMPS[name]) == golden(name)
+
+
+# PSBUILDER_REQUIRE_SWIFT_PACKAGE_WRITER=1 turns the skip into a failure, for CI runs on macOS
+@pytest.mark.skipif(
+    shutil.which("SwiftPackageWriter") is None and not os.environ.get("PSBUILDER_REQUIRE_SWIFT_PACKAGE_WRITER"),
+    reason="SwiftPackageWriter is not installed")
+@pytest.mark.parametrize("name", sorted(DUMPS))
+def test_render_matches_swift_package_writer(name, tmp_path):
+    package_json = tmp_path / "package.json"
+    package_json.write_text(json.dumps(DUMPS[name]))
+    written = subprocess.run(
+        ["SwiftPackageWriter", "create", str(package_json)], capture_output=True, text=True, check=True
+    ).stdout
+    assert render_package_swift(DUMPS[name]) == written
+
+
+def test_render_versions():
+    rendered = render_package_swift(DUMPS["PythonCore"], "5.10", "v15", "v12")
+    assert rendered.startswith("// swift-tools-version: 5.10\n")
+    assert "platforms: [.iOS(.v15), .macOS(.v12)]," in rendered
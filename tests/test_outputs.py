@@ -0,0 +1,134 @@
+from os.path import join, dirname, realpath, exists, isdir, basename, splitext
+from os import makedirs, unlink
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.outputs import RecipeOutputStore, OutputRecorder, recipe_keys, execute_recipe, state_files
+from psbuilder.utils import SqliteStore
+
+
+class Context:
+    def __init__(self, root: str):
+        self.dist_dir = join(root, "dist")
+        self.selected_platforms = []
+        self.hostpython_ver = "3.11"
+        self.state = SqliteStore(join(self.dist_dir, "state.sqlite"), migrate_from=join(self.dist_dir, "state.db"))
+        self.recipe_outputs = RecipeOutputStore(join(root, "recipe_outputs"))
+
+
+class Recipe:
+    version = "1.0"
+    url = None
+    depends = []
+    optional_depends = []
+    custom_dir = None
+
+    def __init__(self, ctx: Context, root: str, name: str = "foo"):
+        self.ctx = ctx
+        self.name = name
+        self.recipe_dir = join(root, "recipes", name)
+        makedirs(self.recipe_dir, exist_ok=True)
+        with open(join(self.recipe_dir, "__init__.py"), "w") as fp:
+            fp.write("recipe = None\n")
+        self.executed = 0
+
+    @property
+    def library(self) -> str:
+        return join(self.ctx.dist_dir, "lib", f"lib{self.name}.a")
+
+    def execute(self):
+        self.executed += 1
+        makedirs(dirname(self.library), exist_ok=True)
+        with open(self.library, "w") as fp:
+            fp.write("archive")
+        for step in ("download", "extract", "build_all"):
+            self.ctx.state[f"{self.name}.{step}"] = True
+
+
+def test_store_then_restore_keeps_the_state_store(tmp_path):
+    root = str(tmp_path)
+    ctx = Context(root)
+    recipe = Recipe(ctx, root)
+    key = recipe_keys([recipe], ctx)[recipe.name]
+
+    execute_recipe(recipe, ctx, key)
+    assert recipe.executed == 1
+    stored = ctx.recipe_outputs.index["entries"][key]["files"]
+    assert [rel for rel, size in stored] == [join("lib", "libfoo.a")]
+    assert not state_files(ctx) & {rel for rel, size in stored}
+
+    # a clean dist: the library is gone and the recipe is no longer marked built
+    unlink(recipe.library)
+    ctx.state.remove_all(recipe.name)
+    ctx.state["other.build_all"] = True
+
+    execute_recipe(recipe, ctx, key)
+    assert recipe.executed == 1
+    assert exists(recipe.library)
+    assert ctx.state["foo.build_all"] is True
+    assert ctx.state["other.build_all"] is True
+    assert SqliteStore(ctx.state.filename)["foo.build_all"] is True
+
+
+def test_restore_skips_state_files_of_old_entries(tmp_path):
+    root = str(tmp_path)
+    ctx = Context(root)
+    ctx.state["foo.extract"] = True
+    source = join(root, "old")
+    makedirs(join(source, "lib"))
+    for rel in ("state.sqlite-wal", join("lib", "libfoo.a")):
+        with open(join(source, rel), "w") as fp:
+            fp.write("stale")
+    ctx.recipe_outputs.add("key", "foo", source, ["state.sqlite-wal", join("lib", "libfoo.a")])
+
+    files = ctx.recipe_outputs.restore("key", ctx.dist_dir, state_files(ctx))
+    assert files == [join("lib", "libfoo.a")]
+    assert ctx.state["foo.extract"] is True
+
+
+def test_no_key_for_recipes_built_against_a_custom_folder(tmp_path):
+    root = str(tmp_path)
+    ctx = Context(root)
+    custom = Recipe(ctx, root, "python3")
+    custom.custom_dir = join(root, "python3-src")
+    dependent = Recipe(ctx, root, "numpy")
+    dependent.depends = ["python3"]
+    other = Recipe(ctx, root, "libffi")
+
+    keys = recipe_keys([custom, other, dependent], ctx)
+    assert set(keys) == {"libffi"}
+
+
+def test_recorder_stores_recipes_built_alone(tmp_path):
+    root = str(tmp_path)
+    ctx = Context(root)
+    foo, bar = Recipe(ctx, root, "foo"), Recipe(ctx, root, "bar")
+    keys = recipe_keys([foo, bar], ctx)
+    recorder = OutputRecorder(ctx, keys)
+    for recipe in (foo, bar):
+        # as if built by a worker process
+        recorder.start(recipe.name)
+        recipe.execute()
+        recorder.finish(recipe.name)
+    assert set(ctx.recipe_outputs.index["entries"]) == {keys["foo"], keys["bar"]}
+    assert ctx.recipe_outputs.index["entries"][keys["bar"]]["files"] == [[join("lib", "libbar.a"), 7]]
+
+
+def test_recorder_skips_overlapping_and_built_recipes(tmp_path):
+    root = str(tmp_path)
+    ctx = Context(root)
+    foo, bar, baz = Recipe(ctx, root, "foo"), Recipe(ctx, root, "bar"), Recipe(ctx, root, "baz")
+    keys = recipe_keys([foo, bar, baz], ctx)
+    baz.execute()
+    recorder = OutputRecorder(ctx, keys)
+    recorder.start("foo")
+    recorder.start("bar")
+    foo.execute()
+    bar.execute()
+    recorder.finish("foo")
+    recorder.finish("bar")
+    recorder.start("baz")
+    recorder.finish("baz")
+    assert ctx.recipe_outputs.index["entries"] == {}
@@ -0,0 +1,50 @@
+import importlib.util
+import sys
+import zipfile
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.archive import zip_tree
+from psbuilder.precompile import compile_tree, compiled_source, stale_sources
+
+
+def write_tree(root):
+    (root / "pkg").mkdir()
+    (root / "pkg" / "__init__.py").write_text("VALUE = 1\n")
+    (root / "pkg" / "mod.py").write_text("def f():\n    return 2\n")
+
+
+@pytest.mark.parametrize("python", [None, sys.executable])
+def test_warm_compile_only_changed_sources(tmp_path, python):
+    write_tree(tmp_path)
+    assert compile_tree(str(tmp_path), python, workers=2) == 2
+    assert (tmp_path / "pkg" / "mod.pyc").exists()
+    assert compile_tree(str(tmp_path), python, workers=2) == 0
+
+    (tmp_path / "pkg" / "mod.py").write_text("def f():\n    return 3\n")
+    assert stale_sources(str(tmp_path), importlib.util.MAGIC_NUMBER) == [str(tmp_path / "pkg" / "mod.py")]
+    assert compile_tree(str(tmp_path), python, workers=2) == 1
+    assert stale_sources(str(tmp_path), importlib.util.MAGIC_NUMBER) == []
+
+
+def test_pyc_of_other_interpreter_is_stale(tmp_path):
+    write_tree(tmp_path)
+    compile_tree(str(tmp_path), workers=1)
+    assert len(stale_sources(str(tmp_path), b"\x00\x00\r\n")) == 2
+
+
+def test_zip_without_compiled_sources(tmp_path):
+    site = tmp_path / "site-packages"
+    site.mkdir()
+    write_tree(site)
+    (site / "pkg" / "data.txt").write_text("data")
+    compile_tree(str(site), workers=1)
+    zip_tree(str(site), str(tmp_path / "site-packages.zip"), exclude=compiled_source)
+    with zipfile.ZipFile(tmp_path / "site-packages.zip") as archive:
+        names = archive.namelist()
+    assert "site-packages/pkg/mod.pyc" in names and "site-packages/pkg/data.txt" in names
+    assert not [name for name in names if name.endswith(".py")]
+    # the sources are kept, a warm run has nothing to compile
+    assert compile_tree(str(site), workers=1) == 0
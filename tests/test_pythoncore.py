@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+import plistlib
+import shutil
+
+import pytest
+
+pytest.importorskip("kivy_ios.recipes.python3")
+
+from psbuilder.packages.pythoncore import PythonCore
+
+
+def python_zip(tmp_path):
+    """Stand-in for the Python.zip release asset, with its macos slice."""
+    macos = tmp_path / "asset" / "Python.xcframework" / "macos-arm64_x86_64"
+    (macos / "Headers").mkdir(parents=True)
+    (macos / "Headers" / "Python.h").write_text("")
+    (macos / "libPython3.11.a").write_text("lib")
+    return shutil.make_archive(str(tmp_path / "Python"), "zip", tmp_path / "asset")
+
+
+def test_process_xc_twice(tmp_path, monkeypatch):
+    headers = tmp_path / "dist" / "root" / "python3" / "include" / "python3.11"
+    headers.mkdir(parents=True)
+    (headers / "Python.h").write_text("")
+    xc = tmp_path / "libpython3.11.xcframework"
+    for platform in ("ios-arm64", "ios-arm64_x86_64-simulator"):
+        (xc / platform).mkdir(parents=True)
+    (xc / "Info.plist").write_bytes(plistlib.dumps({"AvailableLibraries": [
+        {"LibraryIdentifier": "ios-arm64"},
+        {"LibraryIdentifier": "ios-arm64_x86_64-simulator"},
+    ]}))
+    package = PythonCore()
+    package.ctx = SimpleNamespace(dist_dir=str(tmp_path / "dist"))
+    asset = python_zip(tmp_path)
+    monkeypatch.setattr(package, "fetch_release_asset", lambda name: asset)
+
+    package.process_xc(str(xc))
+    package.process_xc(str(xc))
+
+    with open(xc / "Info.plist", "rb") as fp:
+        libraries = plistlib.load(fp)["AvailableLibraries"]
+    assert [lib["LibraryIdentifier"] for lib in libraries] == [
+        "ios-arm64", "ios-arm64_x86_64-simulator", "macos-arm64_x86_64"
+    ]
+    assert {lib["HeadersPath"] for lib in libraries} == {"python3.11"}
+    assert (xc / "macos-arm64_x86_64" / "python3.11" / "Python.h").exists()
+    assert not (xc / "macos-arm64_x86_64" / "Headers").exists()
@@ -0,0 +1,109 @@
+from multiprocessing import get_context
+from threading import Event, Thread
+import json
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder.utils import JsonStore, SqliteStore, open_state_store
+
+
+def stored(path):
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def test_batch_is_committed_once(tmp_path):
+    store = JsonStore(str(tmp_path / "state.db"))
+    with store.batch():
+        store["a.download"] = True
+        with store.batch():
+            store["a.extract"] = True
+        assert not (tmp_path / "state.db").exists()
+    assert stored(tmp_path / "state.db") == {"a.download": True, "a.extract": True}
+
+
+def test_batch_of_another_thread_does_not_defer_writes(tmp_path):
+    store = JsonStore(str(tmp_path / "state.db"))
+    in_batch = Event()
+    written = Event()
+
+    def batch():
+        with store.batch():
+            store["a.download"] = True
+            in_batch.set()
+            written.wait(5)
+
+    thread = Thread(target=batch)
+    thread.start()
+    in_batch.wait(5)
+    store["b.download"] = True
+    # the open batch of the other thread is neither saved nor visible yet
+    assert stored(tmp_path / "state.db") == {"b.download": True}
+    assert "a.download" not in store
+    written.set()
+    thread.join()
+    assert stored(tmp_path / "state.db") == {"a.download": True, "b.download": True}
+
+
+def test_shared_state_stays_a_kivy_ios_json_store(tmp_path, monkeypatch):
+    monkeypatch.delenv("PSBUILDER_STATE_BACKEND", raising=False)
+    store = open_state_store(str(tmp_path / "state.db"), shared=True)
+    assert isinstance(store, JsonStore) and not store.journal
+    store["a.build_all"] = True
+    assert stored(tmp_path / "state.db") == {"a.build_all": True}
+    assert isinstance(open_state_store(str(tmp_path / "packages_state.db")), SqliteStore)
+
+
+def test_state_backend_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("PSBUILDER_STATE_BACKEND", "sqlite")
+    assert isinstance(open_state_store(str(tmp_path / "state.db"), shared=True), SqliteStore)
+    monkeypatch.setenv("PSBUILDER_STATE_BACKEND", "json")
+    assert open_state_store(str(tmp_path / "packages_state.db")).journal
+
+
+def test_batch_reads_its_own_changes(tmp_path):
+    store = JsonStore(str(tmp_path / "state.db"), journal=True)
+    store["a.download"] = True
+    store["a.extract"] = True
+    with store.batch():
+        store.remove_all("a.")
+        store["b.download"] = True
+        assert "a.download" not in store and store["b.download"]
+        assert sorted(store.keys()) == ["b.download"]
+        assert sorted(JsonStore(str(tmp_path / "state.db"), journal=True).keys()) == ["a.download", "a.extract"]
+    assert sorted(JsonStore(str(tmp_path / "state.db"), journal=True).keys()) == ["b.download"]
+
+
+def test_migration_maps_timestamps(tmp_path):
+    json_store = JsonStore(str(tmp_path / "state.db"))
+    json_store.set("Package.execute", True)
+    json_store["libffi.build_all"] = True
+    store = SqliteStore(str(tmp_path / "state.sqlite"), migrate_from=str(tmp_path / "state.db"))
+    assert store.keys() == ["Package.execute", "libffi.build_all"]
+    assert store.updated_at("Package.execute") == json_store.updated_at("Package.execute")
+
+
+def write_keys(filename, name, count):
+    store = JsonStore(filename, locked=True)
+    for i in range(count):
+        with store.batch():
+            store["{}.{}".format(name, i)] = True
+
+
+def test_locked_store_merges_writes_of_processes(tmp_path):
+    filename = str(tmp_path / "state.db")
+    store = JsonStore(filename, locked=True)
+    store["parent.build_all"] = True
+    spawn = get_context("spawn")
+    workers = [spawn.Process(target=write_keys, args=(filename, name, 20)) for name in ("a", "b", "c")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert len(stored(filename)) == 61
+    assert "a.19" not in store
+    store.reload()
+    assert "a.19" in store and store["parent.build_all"]
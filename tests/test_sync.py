@@ -0,0 +1,62 @@
+from psbuilder.headers import inject_headers
+from psbuilder.sync import sync_tree, link_file, write_file
+
+
+def make_src(root):
+    (root / "pkg" / "empty").mkdir(parents=True)
+    (root / "pkg" / "tests" / "empty").mkdir(parents=True)
+    (root / "pkg" / "__init__.py").write_text("")
+    (root / "pkg" / "mod.py").write_text("VALUE = 1\n")
+
+
+def test_sync_copies_only_changes(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    make_src(src)
+    report = sync_tree(str(src), str(dst))
+    assert (report.copied, report.unchanged) == (2, 0)
+    assert (dst / "pkg" / "mod.py").read_text() == "VALUE = 1\n"
+
+    (src / "pkg" / "mod.py").write_text("VALUE = 22\n")
+    (src / "pkg" / "__init__.py").unlink()
+    report = sync_tree(str(src), str(dst))
+    assert (report.updated, report.deleted, report.unchanged) == (1, 1, 0)
+    assert (dst / "pkg" / "mod.py").read_text() == "VALUE = 22\n"
+    assert not (dst / "pkg" / "__init__.py").exists()
+
+
+def test_sync_empty_folders(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    make_src(src)
+    sync_tree(str(src), str(dst), exclude=lambda rel: rel.split("/")[-1] == "tests")
+    assert (dst / "pkg" / "empty").is_dir()
+    assert not (dst / "pkg" / "tests").exists()
+
+    (src / "pkg" / "empty").rmdir()
+    sync_tree(str(src), str(dst))
+    assert not (dst / "pkg" / "empty").exists()
+    assert (dst / "pkg" / "tests" / "empty").is_dir()
+
+
+def test_sync_links(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    make_src(src)
+    sync_tree(str(src), str(dst), copy_function=link_file)
+    assert (dst / "pkg" / "mod.py").stat().st_ino == (src / "pkg" / "mod.py").stat().st_ino
+    assert (dst / "pkg" / "empty").is_dir()
+
+
+def test_write_file_keeps_linked_slices(tmp_path):
+    headers = tmp_path / "include" / "sdl2"
+    headers.mkdir(parents=True)
+    (headers / "SDL.h").write_text("")
+    write_file(str(headers / "module.modulemap"), "module SDL2 {}\n")
+    xc = tmp_path / "SDL2.xcframework"
+    inject_headers(str(headers), [str(xc)], ["ios-arm64", "ios-arm64_x86_64-simulator"])
+    slice_map = xc / "ios-arm64" / "sdl2" / "module.modulemap"
+    assert slice_map.stat().st_ino == (headers / "module.modulemap").stat().st_ino
+
+    write_file(str(headers / "module.modulemap"), "module SDL2 { header \"SDL.h\" }\n")
+    assert slice_map.read_text() == "module SDL2 {}\n"
+    inject_headers(str(headers), [str(xc)], ["ios-arm64", "ios-arm64_x86_64-simulator"])
+    assert slice_map.read_text() == "module SDL2 { header \"SDL.h\" }\n"
+    assert not (headers / "module.modulemap.sync-tmp").exists()
@@ -0,0 +1,70 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip("kivy_ios")
+
+from psbuilder import checksums as checksums_module, targets
+from psbuilder.archive import write_checksum_file
+from psbuilder.checksums import ChecksumIndex
+from psbuilder.targets import BinaryTarget
+from psbuilder.trace import tracer
+
+DATA = b"zip content"
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    monkeypatch.setattr(tracer, "enabled", True)
+    monkeypatch.setattr(tracer, "spans", [])
+    return tracer.spans
+
+
+def target(tmp_path, checksums=None) -> BinaryTarget:
+    path = tmp_path / "libfoo.zip"
+    path.write_bytes(DATA)
+    return BinaryTarget("libfoo", str(path), "kv-swift", "Foo", "311.0.0", checksums)
+
+
+def test_hashed_bytes_are_traced(tmp_path, traced, hashed):
+    assert target(tmp_path).checksum == SHA256
+    assert hashed and [span.bytes for span in traced] == [len(DATA)]
+
+
+def test_index_hit_is_not_hashed(tmp_path, traced, hashed):
+    checksums = ChecksumIndex(str(tmp_path / "checksums.json"))
+    first = target(tmp_path, checksums)
+    assert first.checksum == SHA256
+    second = BinaryTarget("libfoo", first.file, "kv-swift", "Foo", "311.0.0", checksums)
+    assert second.checksum == SHA256
+    assert len(hashed) == 1
+    assert [span.bytes for span in traced] == [len(DATA), 0]
+
+
+def test_checksum_file_is_not_hashed(tmp_path, traced, hashed):
+    binary = target(tmp_path)
+    write_checksum_file(binary.file, SHA256)
+    assert binary.checksum == SHA256
+    assert hashed == [] and [span.bytes for span in traced] == [0]
+
+
+def test_untraced_checksum_does_not_stat(tmp_path, hashed, monkeypatch):
+    monkeypatch.setattr(tracer, "enabled", False)
+    monkeypatch.setattr(targets, "getsize", lambda path: pytest.fail("stat while tracing is disabled"))
+    assert target(tmp_path).checksum == SHA256
+
+
+def test_checksum_index_is_written_once_per_batch(tmp_path, hashed, monkeypatch):
+    checksums = ChecksumIndex(str(tmp_path / "checksums.json"))
+    writes = []
+    replace = checksums_module.replace
+    monkeypatch.setattr(checksums_module, "replace", lambda src, dst: writes.append(dst) or replace(src, dst))
+    with checksums.batch():
+        for name in ("libfoo", "libbar"):
+            path = tmp_path / f"{name}.zip"
+            path.write_bytes(DATA + name.encode())
+            assert BinaryTarget(name, str(path), "kv-swift", "Foo", "311.0.0", checksums).checksum
+        assert writes == []
+    assert writes == [checksums.filename]
+    assert len(ChecksumIndex(checksums.filename).data) == 2